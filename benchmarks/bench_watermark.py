@@ -0,0 +1,260 @@
+"""Benchmarks for the watermarking hot path.
+
+Generates synthetic inputs (JPEG/PNG/BMP, RGB/RGBA, 1-100 MP), times every stage of
+apply_modern_watermark for single images plus whole batches, records peak RSS and the
+headless cold-start (import) time of the engine, and writes the results as JSON so runs can be compared:
+
+    python benchmarks/bench_watermark.py --sizes 1,12,48 --output bench.json
+    python benchmarks/bench_watermark.py --sizes 1,12 --output new.json --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+from PIL import Image, ImageDraw
+
+import watermark_engine as wm
+
+try:
+    import resource
+except ImportError: # Windows: no peak RSS
+    resource = None
+
+TEXTS = {
+    "latin": ("Site Record", "Building 3, Level 2, North Wall"),
+    "cjk": ("施工记录", "上海市浦东新区 3号楼 2层 北侧墙体"),
+}
+FORMATS = {"jpeg": ".jpg", "png": ".png", "bmp": ".bmp"}
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+STYLE = dict(anchor="bottom_left", padding=(30, 30), base_font_size=40)
+
+# --- Synthetic inputs ---
+def dimensions_for_megapixels(megapixels):
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    return width, int(width * 3 / 4)
+
+def make_synthetic_image(size, mode):
+    # Gradients plus noise: compresses roughly like a photo instead of a flat fill or pure noise
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size, Image.BILINEAR)
+    noise = Image.effect_noise(size, 24)
+    channels = [Image.blend(gradient, noise, 0.35), Image.blend(gradient.rotate(90).resize(size), noise, 0.2), noise]
+    img = Image.merge("RGB", channels)
+    ImageDraw.Draw(img).rectangle([width // 4, height // 4, width // 2, height // 2], fill=(200, 80, 40))
+    if mode == "RGBA": img.putalpha(Image.linear_gradient("L").resize(size).point(lambda v: 128 + v // 2))
+    return img
+
+def ensure_input(workdir, megapixels, image_format, mode):
+    path = os.path.join(workdir, f"synthetic_{megapixels}mp_{mode.lower()}{FORMATS[image_format]}")
+    if not os.path.exists(path):
+        make_synthetic_image(dimensions_for_megapixels(megapixels), mode).save(path, quality=90)
+    return path
+
+def case_matrix(sizes, formats, modes, texts):
+    for megapixels in sizes:
+        for image_format in formats:
+            for mode in modes:
+                if mode == "RGBA" and image_format == "jpeg": continue # JPEG has no alpha
+                for text_key in texts: yield megapixels, image_format, mode, text_key
+
+# --- Measurement helpers ---
+def peak_rss_mb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KiB on Linux
+
+def timed(timings, stage, func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+    return result
+
+def time_stages(path, output_path, font_path, text_key):
+    # Mirrors apply_modern_watermark step by step. Font load and draw are measured cold (caches cleared).
+    title_text, location_text = TEXTS[text_key]
+    timings = {}
+    wm.clear_watermark_caches()
+    img = timed(timings, "open_decode", _open_decode, path)
+    if img.mode != wm._working_mode(img): img = timed(timings, "convert_in", img.convert, wm._working_mode(img))
+    base_font, title_font = timed(timings, "font_load", wm.load_watermark_fonts, font_path, STYLE["base_font_size"], lambda m: None)
+    time_str = TIMESTAMP.strftime("%Y-%m-%d %H:%M:%S")
+    context_draw = wm._measure_draw()
+    layout = timed(timings, "layout", wm.compute_watermark_layout, img.size, title_text, time_str, location_text,
+                   STYLE["anchor"], STYLE["padding"], STYLE["base_font_size"], base_font, title_font, context_draw)
+    style_key = (font_path, STYLE["base_font_size"])
+    tile, box = timed(timings, "draw", wm.render_watermark_tile, img.size, layout, title_text, time_str, location_text,
+                      base_font, title_font, context_draw, style_key)
+    # Warm draw: a second image of the batch only re-renders the timestamp line
+    timed(timings, "draw_warm", wm.render_watermark_tile, img.size, layout, title_text, time_str, location_text,
+          base_font, title_font, context_draw, style_key)
+    img = timed(timings, "composite", wm.composite_watermark_region, img, tile, box)
+    if output_path.lower().endswith((".jpg", ".jpeg")) and img.mode != "RGB":
+        img = timed(timings, "convert_out", img.convert, "RGB")
+    data = timed(timings, "encode", wm.encode_watermarked_image, img, output_path)
+    with open(output_path, "wb") as f: timed(timings, "write", f.write, data)
+    return timings, len(data)
+
+def _open_decode(path):
+    img = Image.open(path)
+    img.load()
+    return img
+
+def run_single_case(case, workdir, font_path, repeat):
+    megapixels, image_format, mode, text_key = case
+    path = ensure_input(workdir, megapixels, image_format, mode)
+    output_path = os.path.join(workdir, "out_" + os.path.basename(path))
+    title_text, location_text = TEXTS[text_key]
+    rss_before = peak_rss_mb()
+
+    stage_runs, end_to_end = [], []
+    for _ in range(repeat):
+        timings, output_bytes = time_stages(path, output_path, font_path, text_key)
+        stage_runs.append(timings)
+        started = time.perf_counter()
+        wm.apply_modern_watermark(path, output_path, title_text, location_text, TIMESTAMP, font_path=font_path,
+                                  log_callback=lambda m: None, **STYLE)
+        end_to_end.append((time.perf_counter() - started) * 1000)
+
+    with Image.open(path) as probe: size = probe.size
+    return {
+        "case": f"{megapixels}mp-{image_format}-{mode.lower()}-{text_key}",
+        "megapixels": megapixels, "format": image_format, "mode": mode, "text": text_key, "size": list(size),
+        "input_bytes": os.path.getsize(path), "output_bytes": output_bytes,
+        "stages_ms": {stage: statistics.median(run[stage] for run in stage_runs) for stage in stage_runs[0]},
+        "end_to_end_ms": {"median": statistics.median(end_to_end), "min": min(end_to_end)},
+        "peak_rss_mb": peak_rss_mb(), "rss_before_mb": rss_before,
+    }
+
+def _isolated(func, *args):
+    # Runs one case in a fresh process so its peak RSS is not polluted by earlier, larger cases
+    with multiprocessing.get_context("spawn").Pool(1) as pool: return pool.apply(func, args)
+
+def run_batch_case(workdir, font_path, megapixels, count, engine, workers):
+    batch_dir = os.path.join(workdir, f"batch_{megapixels}mp_{count}")
+    if not os.path.isdir(batch_dir):
+        os.makedirs(batch_dir)
+        source = make_synthetic_image(dimensions_for_megapixels(megapixels), "RGB")
+        for i in range(count): source.save(os.path.join(batch_dir, f"img_{i:04d}.jpg"), quality=90)
+    output_dir = os.path.join(workdir, f"batch_out_{engine}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = wm.build_batch_jobs(batch_dir, output_dir, TIMESTAMP, "1min")
+    title_text, location_text = TEXTS["cjk"]
+    started = time.perf_counter()
+    results = wm.run_batch(jobs, title_text, location_text, STYLE["anchor"], STYLE["padding"], font_path, STYLE["base_font_size"],
+                           workers=workers, log_callback=lambda m: None, engine=engine)
+    elapsed = time.perf_counter() - started
+    return {
+        "case": f"batch-{megapixels}mp-x{count}-{engine}-w{workers}", "engine": engine, "workers": workers,
+        "images": count, "megapixels": megapixels, "failed": sum(1 for r in results if not r.success),
+        "seconds": elapsed, "images_per_second": count / elapsed if elapsed else None, "peak_rss_mb": peak_rss_mb(),
+    }
+
+STARTUP_IMPORTS = {
+    "pillow": "import PIL.Image, PIL.ImageDraw, PIL.ImageFont",
+    "engine": "import watermark_engine",
+    "main": "import main",
+}
+
+def measure_cold_start(repeat):
+    # Each import runs in a fresh interpreter, so nothing is cached in sys.modules; the interpreter's own start-up is not counted
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = "import time; started = time.perf_counter(); {}; print((time.perf_counter() - started) * 1000)"
+    result = {}
+    for name, statement in STARTUP_IMPORTS.items():
+        runs = [float(subprocess.run([sys.executable, "-c", script.format(statement)], cwd=repo_dir, check=True,
+                                     capture_output=True, text=True).stdout) for _ in range(repeat)]
+        result[name] = {"median": statistics.median(runs), "min": min(runs)}
+    return result
+
+# --- Reporting ---
+def environment_info():
+    return {"python": platform.python_version(), "pillow": PIL.__version__, "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "created": datetime.datetime.now().isoformat(timespec="seconds")}
+
+def print_single(result):
+    stages = " ".join(f"{stage}={ms:.1f}" for stage, ms in result["stages_ms"].items())
+    print(f"{result['case']:<28} total={result['end_to_end_ms']['median']:8.1f}ms  rss={result['peak_rss_mb'] or 0:7.1f}MB  {stages}")
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f: baseline = json.load(f)
+    old = {r["case"]: r for r in baseline.get("single", [])}
+    old_batch = {r["case"]: r for r in baseline.get("batch", [])}
+    print(f"\n对比基线 {baseline_path} (比值 <1 表示更快/更省):")
+    for name, r in results.get("startup", {}).items():
+        if name in baseline.get("startup", {}):
+            print(f"  {'startup-' + name:<28} time x{r['median'] / baseline['startup'][name]['median']:.2f}")
+    for r in results["single"]:
+        if r["case"] not in old: continue
+        before = old[r["case"]]
+        time_ratio = r["end_to_end_ms"]["median"] / before["end_to_end_ms"]["median"]
+        rss_ratio = (r["peak_rss_mb"] / before["peak_rss_mb"]) if r["peak_rss_mb"] and before.get("peak_rss_mb") else float("nan")
+        print(f"  {r['case']:<28} time x{time_ratio:.2f}  rss x{rss_ratio:.2f}")
+    for r in results["batch"]:
+        if r["case"] in old_batch:
+            print(f"  {r['case']:<28} throughput x{r['images_per_second'] / old_batch[r['case']]['images_per_second']:.2f}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="水印处理性能基准测试")
+    parser.add_argument("--sizes", default="1,12,48", help="图片尺寸 (百万像素), 逗号分隔, 例如 1,12,48,100")
+    parser.add_argument("--formats", default="jpeg,png,bmp", help="输入格式: jpeg,png,bmp")
+    parser.add_argument("--modes", default="RGB,RGBA", help="颜色模式: RGB,RGBA")
+    parser.add_argument("--texts", default="latin,cjk", help="水印文字: latin,cjk")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数 (取中位数)")
+    parser.add_argument("--batch-size", type=int, default=24, help="批量测试的图片数量 (0 表示跳过)")
+    parser.add_argument("--batch-megapixels", type=float, default=12, help="批量测试的图片尺寸 (百万像素)")
+    parser.add_argument("--workers", type=int, default=None, help="批量测试的并行数 (默认: CPU核心数)")
+    parser.add_argument("--font", default=None, help="字体文件 (默认自动查找; 测试 CJK 文字需要支持中文的字体)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "watermark_bench"), help="生成的测试图片的缓存目录")
+    parser.add_argument("--no-isolate", action="store_true", help="所有用例在同一进程中运行 (更快, 但峰值内存不准确)")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果 JSON 对比")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    os.makedirs(args.workdir, exist_ok=True)
+    font_path = args.font or wm.find_font_path(log_callback=lambda m: None)
+    sizes = [float(s) if "." in s else int(s) for s in args.sizes.split(",")]
+    cases = list(case_matrix(sizes, args.formats.split(","), args.modes.split(","), args.texts.split(",")))
+    results = {"environment": dict(environment_info(), font=font_path), "single": [], "batch": []}
+
+    results["startup"] = measure_cold_start(max(args.repeat, 5))
+    print("冷启动导入耗时 (中位数): " + "  ".join(f"{name}={r['median']:.1f}ms" for name, r in results["startup"].items()))
+
+    print(f"单张图片: {len(cases)} 个用例, 每个重复 {args.repeat} 次 (字体: {font_path})")
+    for case in cases:
+        if args.no_isolate: result = run_single_case(case, args.workdir, font_path, args.repeat)
+        else: result = _isolated(run_single_case, case, args.workdir, font_path, args.repeat)
+        results["single"].append(result)
+        print_single(result)
+
+    if args.batch_size:
+        workers = args.workers or os.cpu_count() or 1
+        print(f"\n批量: {args.batch_size} 张 {args.batch_megapixels}MP JPEG")
+        engines = [("process", 1)] + ([("process", workers)] if workers > 1 else []) + [("pipeline", workers)]
+        for engine, engine_workers in engines:
+            result = _isolated(run_batch_case, args.workdir, font_path, args.batch_megapixels, args.batch_size, engine, engine_workers)
+            results["batch"].append(result)
+            print(f"{result['case']:<36} {result['images_per_second']:6.2f} 张/秒  {result['seconds']:7.2f}s  rss={result['peak_rss_mb'] or 0:.1f}MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+    if args.compare: compare(results, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+# The modules live in the repository root and are not installed as a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import watermark_engine as wm
+
+@pytest.fixture(scope="session")
+def font_path():
+    # Same lookup as the GUI and CLI; falls back to Pillow's default font where no bundled font exists
+    return wm.find_font_path(log_callback=lambda message: None)
+
+@pytest.fixture
+def make_photo():
+    # Noisy test images, so a misplaced or mis-blended watermark pixel shows up in comparisons
+    def make(size, mode="RGB"):
+        img = Image.merge("RGB", [Image.effect_noise(size, sigma) for sigma in (30, 50, 70)])
+        if mode == "RGBA": img.putalpha(Image.linear_gradient("L").resize(size))
+        return img
+    return make
@@ -0,0 +1,83 @@
+import datetime
+import io
+import os
+import random
+import tarfile
+import zipfile
+
+import pytest
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+INCREMENT = "random_1_5min"
+SAFE_NAMES = ["a.jpg", "site/b.png", "site/north/c.jpg"]
+UNSAFE_NAMES = ["../escape.jpg", "/etc/absolute.jpg", "site/../../up.jpg", "C:/drive.jpg", "\\\\server\\share.jpg"]
+
+def test_safe_member_name():
+    assert wm._safe_member_name("site/./north//c.jpg") == "site/north/c.jpg"
+    assert wm._safe_member_name("site\\north\\c.jpg") == "site/north/c.jpg"
+    for name in UNSAFE_NAMES + ["", "./"]: assert wm._safe_member_name(name) is None, name
+
+@pytest.fixture
+def photos(make_photo):
+    photos = {}
+    for i, name in enumerate(SAFE_NAMES):
+        buffer = io.BytesIO()
+        make_photo((160 + 16 * i, 120)).save(buffer, format=wm.output_format_for_path(name))
+        photos[name] = buffer.getvalue()
+    return photos
+
+def run(input_path, output_path, font_path):
+    archive = wm.ArchiveBatch(input_path, output_path)
+    try:
+        jobs = archive.plan_jobs(TIMESTAMP, INCREMENT, random.Random(3))
+        results = wm.run_archive_batch(archive, jobs, "Site Log", "", font_path=font_path, workers=2, log_callback=lambda message: None)
+    except BaseException:
+        archive.close(keep=False)
+        raise
+    archive.close()
+    return results
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as archive: return {name: archive.read(name) for name in archive.namelist()}
+
+def read_tar(path):
+    with tarfile.open(path) as archive: return {info.name: archive.extractfile(info).read() for info in archive.getmembers()}
+
+def test_zip_tar_round_trip_matches_folder_batch(tmp_path, photos, font_path):
+    with zipfile.ZipFile(tmp_path / "in.zip", "w") as archive:
+        for name in reversed(SAFE_NAMES): archive.writestr(name, photos[name]) # Storage order differs from name order
+        for name in UNSAFE_NAMES: archive.writestr(name, photos["a.jpg"])
+    folder = tmp_path / "in"
+    for name, data in photos.items():
+        (folder / name).parent.mkdir(parents=True, exist_ok=True)
+        (folder / name).write_bytes(data)
+
+    folder_results = run(str(folder), str(tmp_path / "out"), font_path)
+    zip_results = run(str(tmp_path / "in.zip"), str(tmp_path / "out.tar.gz"), font_path)
+    assert [r.timestamp_dt for r in zip_results] == [r.timestamp_dt for r in folder_results]
+    assert all(r.success for r in zip_results)
+
+    expected = {name: (tmp_path / "out" / name).read_bytes() for name in SAFE_NAMES} # Unsafe members are never written
+    assert read_tar(tmp_path / "out.tar.gz") == expected
+    assert not os.path.exists(tmp_path / "out.tar.gz.part")
+
+    tar_results = run(str(tmp_path / "out.tar.gz"), str(tmp_path / "again.zip"), font_path) # And back again
+    assert [r.input_path for r in tar_results] == SAFE_NAMES
+    assert sorted(read_zip(tmp_path / "again.zip")) == SAFE_NAMES
+
+def test_tar_with_unsafe_members_is_read_without_them(tmp_path, photos, font_path):
+    with tarfile.open(tmp_path / "in.tar", "w") as archive:
+        for name in SAFE_NAMES + UNSAFE_NAMES:
+            data = photos.get(name, photos["a.jpg"])
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    assert [member.name for member in wm.ArchiveReader(str(tmp_path / "in.tar")).members] == SAFE_NAMES
+
+    results = run(str(tmp_path / "in.tar"), str(tmp_path / "out"), font_path)
+    assert [r.input_path for r in results] == SAFE_NAMES
+    written = sorted(os.path.relpath(os.path.join(root, name), tmp_path).replace(os.sep, "/")
+                     for root, _, names in os.walk(tmp_path) for name in names if not name.startswith("in."))
+    assert written == ["out/" + name for name in SAFE_NAMES]
@@ -0,0 +1,71 @@
+import datetime
+import os
+import random
+
+import pytest
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+INCREMENT = "random_1_5min"
+
+@pytest.fixture
+def input_folder(tmp_path, make_photo):
+    folder = tmp_path / "in"
+    folder.mkdir()
+    for i in range(6): make_photo((160 + 8 * i, 120)).save(folder / f"photo_{i}.jpg", quality=90)
+    return str(folder)
+
+def build_jobs(input_folder, output_folder, seed=7):
+    return wm.build_batch_jobs(input_folder, output_folder, TIMESTAMP, INCREMENT, random.Random(seed))
+
+def run(jobs, font_path, **options):
+    return wm.run_batch(jobs, "Site Log", "", font_path=font_path, log_callback=lambda message: None, **options)
+
+def read_outputs(jobs):
+    outputs = {}
+    for job in jobs:
+        with open(job.output_path, "rb") as f: outputs[os.path.basename(job.output_path)] = f.read()
+    return outputs
+
+def test_process_engine_matches_serial_timestamps(input_folder, tmp_path, font_path):
+    rng, expected = random.Random(7), [TIMESTAMP]
+    for _ in range(5): expected.append(wm.next_batch_timestamp(expected[-1], INCREMENT, rng)) # The old serial loop
+
+    serial_jobs, process_jobs = build_jobs(input_folder, str(tmp_path / "serial")), build_jobs(input_folder, str(tmp_path / "process"))
+    serial, process = run(serial_jobs, font_path, workers=1), run(process_jobs, font_path, workers=3)
+    assert [r.timestamp_dt for r in serial] == expected
+    assert [r.timestamp_dt for r in process] == expected
+    assert [os.path.basename(r.input_path) for r in process] == [f"photo_{i}.jpg" for i in range(6)]
+    assert read_outputs(process_jobs) == read_outputs(serial_jobs) # Same timestamps drawn on the same photos
+
+def test_pipeline_engine_matches_process_engine(input_folder, tmp_path, font_path):
+    with open(os.path.join(input_folder, "photo_3.jpg"), "wb") as f: f.write(b"not a jpeg")
+    profiles = [wm.parse_output_profile(spec) for spec in ("full", "web:100", "thumb:64:png")]
+    process_jobs, pipeline_jobs = build_jobs(input_folder, str(tmp_path / "process")), build_jobs(input_folder, str(tmp_path / "pipeline"))
+    process = run(process_jobs, font_path, workers=2, profiles=profiles)
+    pipeline = run(pipeline_jobs, font_path, engine="pipeline", pipeline_options=dict(renderers=2), profiles=profiles)
+
+    assert [r.success for r in pipeline] == [r.success for r in process] == [True, True, True, False, True, True]
+    assert [r.timestamp_dt for r in pipeline] == [r.timestamp_dt for r in process]
+    assert "photo_3.jpg" in pipeline[3].messages[-1]
+    assert sorted(os.listdir(tmp_path / "pipeline")) == sorted(os.listdir(tmp_path / "process"))
+    for name in os.listdir(tmp_path / "process"):
+        assert (tmp_path / "pipeline" / name).read_bytes() == (tmp_path / "process" / name).read_bytes(), name
+
+class ScanError(Exception):
+    pass
+
+def test_pipeline_reraises_errors_from_the_job_feed(tmp_path, make_photo, font_path):
+    input_path = tmp_path / "photo.jpg"
+    make_photo((160, 120)).save(input_path, quality=90)
+    finished = []
+
+    def jobs(): # A streaming scan that fails after its first image
+        yield wm.BatchJob(str(input_path), str(tmp_path / "out" / "photo.jpg"), TIMESTAMP)
+        raise ScanError("scan failed")
+
+    with pytest.raises(ScanError):
+        wm.run_batch(jobs(), "Site Log", "", font_path=font_path, engine="pipeline", log_callback=lambda message: None,
+                     result_callback=finished.append)
+    assert [r.success for r in finished] == [True] # The image already read is still written
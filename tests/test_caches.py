@@ -0,0 +1,32 @@
+import datetime
+
+import watermark_engine as wm
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = wm.LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1 # "a" is now the most recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    cache.put("a", 10) # Replacing a key does not grow the cache
+    assert cache.get("a") == 10
+    assert cache.stats() == {"hits": 4, "misses": 1, "size": 2, "maxsize": 2, "hit_rate": 0.8}
+
+def test_lru_cache_clear_resets_counters():
+    cache = wm.LRUCache()
+    cache.put("a", 1)
+    cache.get("a"); cache.get("b", "default")
+    cache.clear()
+    assert cache.get("a", "default") == "default"
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 1
+
+def test_repeated_style_reuses_fonts_and_static_tile(make_photo, font_path):
+    for cache in (wm._font_cache, wm._text_size_cache, wm._static_tile_cache): cache.clear()
+    for minute in (0, 1): # Only the timestamp differs between the two photos
+        wm.watermark_pil_image(make_photo((400, 300)), "Site Log", "Block A", datetime.datetime(2024, 5, 1, 8, minute), "bottom_right",
+                               (10, 10), font_path, 20, lambda message: None)
+    tile_stats, font_stats = wm._static_tile_cache.stats(), wm._font_cache.stats()
+    assert (tile_stats["hits"], tile_stats["misses"], tile_stats["size"]) == (1, 1, 1)
+    assert font_stats["hits"] > 0 and font_stats["misses"] == font_stats["size"]
@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 30, 15)
+ANCHORS = ["top_left", "top_center", "top_right", "middle_left", "middle_center", "middle_right",
+           "bottom_left", "bottom_center", "bottom_right"]
+
+def baseline_watermark(img, title_text, location_text, timestamp_dt, anchor, padding, font_path, base_font_size):
+    # The original compositor: a full-frame transparent overlay, blended over the whole image
+    base_font, title_font = wm.load_watermark_fonts(font_path, base_font_size, lambda message: None)
+    img = img.convert("RGBA")
+    txt_layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(txt_layer)
+    time_str = timestamp_dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    def text_size(text, font_obj):
+        if not text: return 0, 0
+        bbox = draw.textbbox((0, 0), text, font=font_obj)
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    title_w, title_h = text_size(title_text, title_font)
+    time_w, time_h = text_size(time_str, base_font)
+    location_w, location_h = text_size(location_text, base_font)
+    h_pad, v_pad, v_gap = int(base_font_size * 0.6), int(base_font_size * 0.3), int(base_font_size * 0.15)
+    blue_h = v_pad * 2 + title_h + (v_gap if title_text and time_str else 0) + time_h + 10
+    white_h = v_pad * 10 + location_h
+    block_w = max(max(title_w, time_w) + h_pad * 2, location_w + h_pad * 2)
+    block_h = blue_h + white_h
+    (width, height), (pad_x, pad_y) = img.size, padding
+    xs = {"left": pad_x, "center": (width - block_w) // 2, "right": width - block_w - pad_x}
+    ys = {"top": pad_y, "middle": (height - block_h) // 2, "bottom": height - block_h - pad_y}
+    vertical, horizontal = anchor.split("_")
+    x, y = max(0, int(xs[horizontal])), max(0, int(ys[vertical]))
+
+    draw.rectangle([x, y, x + block_w, y + blue_h], fill=wm.COLOR_BLUE_BAR_BG)
+    if title_text: draw.text((x + h_pad, y + v_pad), title_text, font=title_font, fill=wm.COLOR_TITLE_TEXT)
+    draw.text((x + h_pad, y + v_pad + (title_h + v_gap if title_text else 0)), time_str, font=base_font, fill=wm.COLOR_TIME_TEXT)
+    draw.rectangle([x, y + blue_h, x + block_w, y + blue_h + white_h], fill=wm.COLOR_WHITE_BAR_BG)
+    if location_text: draw.text((x + h_pad, y + blue_h + v_pad), location_text, font=base_font, fill=wm.COLOR_LOCATION_TEXT)
+    return Image.alpha_composite(img, txt_layer)
+
+def assert_same_pixels(result, expected):
+    assert result.size == expected.size
+    assert ImageChops.difference(result, expected).getbbox() is None
+
+@pytest.mark.parametrize("anchor", ANCHORS)
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_region_composite_matches_full_frame_overlay(make_photo, font_path, anchor, mode):
+    img = make_photo((640, 480), mode)
+    expected = baseline_watermark(img, "Site Log", "Block B, level 3", TIMESTAMP, anchor, (30, 20), font_path, 24)
+    result, layout = wm.watermark_pil_image(img.copy(), "Site Log", "Block B, level 3", TIMESTAMP, anchor, (30, 20), font_path, 24,
+                                            log_callback=lambda message: None)
+    assert result.mode == mode # RGB inputs stay RGB instead of going through RGBA
+    assert_same_pixels(result, expected.convert(mode))
+
+@pytest.mark.parametrize("title_text, location_text", [("", "Block B"), ("Site Log", ""), ("", "")])
+def test_empty_texts_match(make_photo, font_path, title_text, location_text):
+    img = make_photo((320, 240))
+    expected = baseline_watermark(img, title_text, location_text, TIMESTAMP, "bottom_right", (10, 10), font_path, 20)
+    result, _ = wm.watermark_pil_image(img.copy(), title_text, location_text, TIMESTAMP, "bottom_right", (10, 10), font_path, 20,
+                                       log_callback=lambda message: None)
+    assert_same_pixels(result, expected.convert("RGB"))
+
+@pytest.mark.parametrize("anchor", ["top_left", "middle_center", "bottom_right"])
+def test_block_larger_than_image_is_clipped_the_same(make_photo, font_path, anchor):
+    img = make_photo((90, 60), "RGBA")
+    expected = baseline_watermark(img, "Site Log", "Block B, level 3", TIMESTAMP, anchor, (30, 30), font_path, 40)
+    result, _ = wm.watermark_pil_image(img.copy(), "Site Log", "Block B, level 3", TIMESTAMP, anchor, (30, 30), font_path, 40,
+                                       log_callback=lambda message: None)
+    assert_same_pixels(result, expected)
@@ -0,0 +1,59 @@
+import datetime
+import io
+
+import pytest
+from PIL import Image, ImageCms, JpegImagePlugin
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+ORIENTATION, MAKE = 0x0112, 0x010F
+
+@pytest.mark.parametrize("preset", sorted(wm.ENCODER_PRESETS))
+def test_preset_save_options(preset):
+    img = Image.new("RGB", (8, 8))
+    encoder = wm.EncoderSettings(preset)
+    for image_format, options in wm.ENCODER_PRESETS[preset].items():
+        assert wm.encoder_save_options(img, image_format, encoder) == options
+    assert wm.encoder_save_options(img, "MPO", encoder) == wm.ENCODER_PRESETS[preset]["JPEG"]
+    assert wm.encoder_save_options(img, "BMP", encoder) == {}
+    assert wm.encoder_save_options(img, "JPEG", encoder, {"quality": 70})["quality"] == 70 # Profile quality wins
+
+def test_unknown_preset_is_rejected():
+    with pytest.raises(ValueError): wm.encoder_save_options(Image.new("RGB", (8, 8)), "JPEG", wm.EncoderSettings("nosuchpreset"))
+
+def test_jpeg_presets_set_subsampling_and_progressive(make_photo):
+    for preset, subsampling, progressive in (("fast", 2, False), ("archival", 0, True)):
+        data = wm.encode_watermarked_image(make_photo((64, 48)), "photo.jpg", encoder=wm.EncoderSettings(preset))
+        with Image.open(io.BytesIO(data)) as img:
+            assert JpegImagePlugin.get_sampling(img) == subsampling
+            assert bool(img.info.get("progressive")) == progressive
+
+@pytest.fixture
+def rotated_photo(tmp_path, make_photo):
+    exif = Image.Exif()
+    exif[ORIENTATION], exif[MAKE] = 6, "TestCam"
+    icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    path = tmp_path / "photo.jpg"
+    make_photo((300, 200)).save(path, exif=exif.tobytes(), icc_profile=icc_profile)
+    return str(path), icc_profile
+
+@pytest.mark.parametrize("output_name", ["out.jpg", "out.png", "out.webp"])
+def test_metadata_is_kept_with_upright_orientation(tmp_path, rotated_photo, font_path, output_name):
+    path, icc_profile = rotated_photo
+    output_path = str(tmp_path / output_name)
+    assert wm.apply_modern_watermark(path, output_path, "Site Log", "", TIMESTAMP, font_path=font_path, log_callback=lambda message: None)
+    with Image.open(output_path) as img:
+        assert img.size == (300, 200) # Pixels are written as stored
+        assert img.info.get("icc_profile") == icc_profile
+        exif = img.getexif()
+        assert (exif.get(ORIENTATION), exif.get(MAKE)) == (1, "TestCam")
+
+def test_metadata_can_be_dropped(tmp_path, rotated_photo, font_path):
+    path, _ = rotated_photo
+    output_path = str(tmp_path / "out.jpg")
+    assert wm.apply_modern_watermark(path, output_path, "Site Log", "", TIMESTAMP, font_path=font_path, log_callback=lambda message: None,
+                                     encoder=wm.EncoderSettings("fast", keep_metadata=False))
+    with Image.open(output_path) as img:
+        assert not img.info.get("icc_profile")
+        assert not img.getexif()
@@ -0,0 +1,59 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import watermark_engine as wm
+
+SETTLE_SECONDS = 0.4
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline: time.sleep(0.02)
+    return condition()
+
+@pytest.mark.parametrize("use_inotify", [False, True], ids=["polling", "inotify"])
+def test_watcher_waits_for_files_to_settle(tmp_path, make_photo, use_inotify):
+    buffer = io.BytesIO()
+    make_photo((320, 240)).save(buffer, format="JPEG")
+    data = buffer.getvalue()
+    (tmp_path / "existing.jpg").write_bytes(data)
+    watcher = wm.FolderWatcher(str(tmp_path), settle_seconds=SETTLE_SECONDS, poll_interval=0.1, use_inotify=use_inotify,
+                               log_callback=lambda message: None)
+    # Closing or renaming a file (seen by inotify only) shortens the wait
+    min_settle = min(SETTLE_SECONDS, wm.CLOSED_SETTLE_SECONDS) if watcher.inotify else SETTLE_SECONDS
+    stop_event = threading.Event()
+    reported = [] # (file name, monotonic time)
+
+    def collect():
+        for path in watcher.ready_files(stop_event): reported.append((os.path.basename(path), time.monotonic()))
+
+    started = time.monotonic()
+    thread = threading.Thread(target=collect)
+    thread.start()
+    try:
+        (tmp_path / "upload.jpg.part").write_bytes(data) # Still being uploaded
+        (tmp_path / ".hidden.jpg").write_bytes(data)
+        chunk = len(data) // 4
+        for i in range(4): # A slow writer: the file keeps growing for longer than the settle period
+            with open(tmp_path / "growing.jpg", "ab") as f: f.write(data[i * chunk:(i + 1) * chunk])
+            last_write = time.monotonic()
+            time.sleep(0.15)
+        assert wait_for(lambda: "growing.jpg" in dict(reported))
+        assert "upload.jpg" not in dict(reported) and "upload.jpg.part" not in dict(reported)
+
+        os.rename(tmp_path / "upload.jpg.part", tmp_path / "upload.jpg") # Upload finished
+        renamed = time.monotonic()
+        assert wait_for(lambda: "upload.jpg" in dict(reported))
+        time.sleep(SETTLE_SECONDS)
+    finally:
+        stop_event.set()
+        thread.join(5)
+
+    times = dict(reported)
+    assert sorted(name for name, _ in reported) == ["existing.jpg", "growing.jpg", "upload.jpg"] # Each reported once
+    assert times["existing.jpg"] >= started + SETTLE_SECONDS
+    assert times["growing.jpg"] >= last_write + min_settle
+    assert times["upload.jpg"] >= renamed + min_settle
@@ -0,0 +1,87 @@
+import datetime
+import os
+import random
+import threading
+
+import pytest
+
+import watermark_engine as wm
+
+BASE_TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+INCREMENT = "random_1_5min"
+
+@pytest.fixture
+def folders(tmp_path, make_photo):
+    input_folder, output_folder = tmp_path / "in", tmp_path / "out"
+    input_folder.mkdir()
+    for i in range(5): make_photo((160, 120)).save(input_folder / f"photo_{i}.jpg", quality=90)
+    return str(input_folder), str(output_folder)
+
+def run(folders, font_path, seed, stop_after=None):
+    # One batch run with a journal; a different seed gives a different random increment sequence
+    input_folder, output_folder = folders
+    os.makedirs(output_folder, exist_ok=True)
+    journal = wm.BatchJournal(output_folder)
+    fingerprint = wm.watermark_fingerprint("Site Log", "", "bottom_right", (10, 10), font_path, 20, BASE_TIMESTAMP, INCREMENT)
+    jobs = wm.build_batch_jobs(input_folder, output_folder, BASE_TIMESTAMP, INCREMENT, random.Random(seed), journal, fingerprint)
+    journal.start_run(fingerprint, BASE_TIMESTAMP, INCREMENT)
+    stop_event = threading.Event()
+    finished = []
+
+    def on_result(result): # Simulates an interrupted run: no new images after stop_after
+        finished.append(result)
+        if stop_after and len(finished) >= stop_after: stop_event.set()
+
+    try:
+        results = wm.run_batch(jobs, "Site Log", "", font_path=font_path, workers=1, log_callback=lambda message: None,
+                               result_callback=on_result, journal=journal, fingerprint=fingerprint, stop_event=stop_event)
+    finally: journal.close()
+    return jobs, results
+
+def test_resume_keeps_recorded_timestamps(folders, font_path):
+    first_jobs, first_results = run(folders, font_path, seed=1, stop_after=2)
+    assert [r.success for r in first_results] == [True, True]
+
+    jobs, results = run(folders, font_path, seed=2)
+    assert [job.timestamp_dt for job in jobs[:2]] == [job.timestamp_dt for job in first_jobs[:2]]
+    assert [r.skipped for r in results] == [True, True, False, False, False]
+    assert all(r.success for r in results)
+
+    rerun_jobs, rerun_results = run(folders, font_path, seed=3)
+    assert [job.timestamp_dt for job in rerun_jobs] == [job.timestamp_dt for job in jobs]
+    assert all(r.skipped for r in rerun_results)
+
+def test_changed_input_is_redone_with_its_recorded_timestamp(folders, font_path, make_photo):
+    jobs, _ = run(folders, font_path, seed=1)
+    make_photo((200, 150)).save(jobs[2].input_path, quality=90)
+
+    rerun_jobs, results = run(folders, font_path, seed=2)
+    assert [job.timestamp_dt for job in rerun_jobs] == [job.timestamp_dt for job in jobs]
+    assert [r.skipped for r in results] == [True, True, False, True, True]
+
+class Interrupted(Exception):
+    pass
+
+def test_out_of_order_interruption_keeps_planned_timestamps(folders, font_path):
+    # The process pool dispatches every job up front; the run dies after whichever job finishes first,
+    # leaving the journal with gaps before and after it
+    input_folder, output_folder = folders
+    os.makedirs(output_folder)
+    journal = wm.BatchJournal(output_folder)
+    fingerprint = wm.watermark_fingerprint("Site Log", "", "bottom_right", (10, 10), font_path, 20, BASE_TIMESTAMP, INCREMENT)
+    first_jobs = wm.build_batch_jobs(input_folder, output_folder, BASE_TIMESTAMP, INCREMENT, random.Random(1), journal, fingerprint)
+    journal.start_run(fingerprint, BASE_TIMESTAMP, INCREMENT)
+
+    def interrupt(result): raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        wm.run_batch(first_jobs, "Site Log", "", font_path=font_path, workers=2, log_callback=lambda message: None,
+                     result_callback=interrupt, journal=journal, fingerprint=fingerprint)
+    journal.close()
+
+    jobs, results = run(folders, font_path, seed=2)
+    timestamps = [job.timestamp_dt for job in jobs]
+    assert timestamps == [job.timestamp_dt for job in first_jobs]
+    assert timestamps == sorted(timestamps)
+    assert sum(r.skipped for r in results) == 1
+    assert all(r.success for r in results)
@@ -0,0 +1,67 @@
+import datetime
+import struct
+
+import pytest
+from PIL import Image, ImageChops, TiffImagePlugin, TiffTags
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 30, 15)
+
+def save_tiled_tiff(img, path, tile=64):
+    # Pillow only writes stripped TIFFs: uncompressed and chunky, edge tiles padded to the full tile size
+    across, down = -(-img.width // tile), -(-img.height // tile)
+    padded = Image.new(img.mode, (across * tile, down * tile))
+    padded.paste(img)
+    tiles = [padded.crop((x * tile, y * tile, (x + 1) * tile, (y + 1) * tile)).tobytes() for y in range(down) for x in range(across)]
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b"II")
+    ifd[256], ifd[257], ifd[258], ifd[259], ifd[262] = img.width, img.height, (8,) * len(img.mode), 1, 2
+    ifd[277], ifd[284], ifd[322], ifd[323] = len(img.mode), 1, tile, tile
+    ifd[324] = tuple(8 + i * len(tiles[0]) for i in range(len(tiles)))
+    ifd[325] = tuple(len(data) for data in tiles)
+    if img.mode == "RGBA": ifd[338] = 2 # Unassociated alpha
+    for tag in (324, 325): ifd.tagtype[tag] = TiffTags.LONG
+    ifd_offset = 8 + sum(map(len, tiles))
+    with open(path, "wb") as f:
+        f.write(b"II*\x00" + struct.pack("<I", ifd_offset))
+        f.write(b"".join(tiles))
+        f.write(ifd.tobytes(ifd_offset))
+
+def save_stripped_tiff(img, path):
+    img.save(path, tiffinfo={TiffImagePlugin.ROWSPERSTRIP: 16}) # Uncompressed, many strips
+
+CASES = { # extension, mode of the generated photo, mode of the saved file, writer
+    "png-rgb": ("png", "RGB", "RGB", Image.Image.save),
+    "png-rgba": ("png", "RGBA", "RGBA", Image.Image.save),
+    "bmp-24bit": ("bmp", "RGB", "RGB", Image.Image.save),
+    "bmp-32bit": ("bmp", "RGBA", "RGB", Image.Image.save), # Pillow writes RGBA as BGRX
+    "tiff-strips-rgb": ("tif", "RGB", "RGB", save_stripped_tiff),
+    "tiff-strips-rgba": ("tif", "RGBA", "RGBA", save_stripped_tiff),
+    "tiff-tiles-rgb": ("tif", "RGB", "RGB", save_tiled_tiff),
+    "tiff-tiles-rgba": ("tif", "RGBA", "RGBA", save_tiled_tiff),
+}
+
+@pytest.mark.parametrize("anchor", ["bottom_right", "middle_center", "top_left"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_strip_processing_matches_full_decode(tmp_path, make_photo, font_path, case, anchor):
+    extension, photo_mode, mode, save = CASES[case]
+    input_path = str(tmp_path / f"input.{extension}")
+    save(make_photo((400, 300), photo_mode), input_path)
+    info = wm.read_large_image_info(input_path)
+    assert info is not None and info.mode == mode
+    if extension == "tif": assert len(info.layout) > 1
+
+    outputs = {}
+    for low_memory in (False, True): # low_memory=True takes the strip/tile route even for a small image
+        output_path = str(tmp_path / f"out_{low_memory}.{extension}")
+        timer = wm.StageTimer()
+        assert wm.apply_modern_watermark(input_path, output_path, "Site Log", "Block B, level 3", TIMESTAMP, anchor, (10, 10),
+                                         font_path, 20, log_callback=lambda message: None, timer=timer, low_memory=low_memory)
+        assert ("decode" in timer.stages) != low_memory
+        with Image.open(output_path) as result:
+            result.load()
+            outputs[low_memory] = result
+
+    full, streamed = outputs[False], outputs[True]
+    assert (streamed.mode, streamed.size) == (full.mode, full.size) == (mode, (400, 300))
+    assert ImageChops.difference(streamed, full).getbbox() is None
@@ -0,0 +1,61 @@
+import datetime
+import threading
+
+import watermark_engine as wm
+
+def test_jobs_are_admitted_while_they_fit():
+    budget = wm.MemoryBudget(100)
+    assert budget.try_acquire(60)
+    assert budget.try_acquire(40)
+    assert not budget.try_acquire(1)
+    budget.release(60)
+    assert budget.try_acquire(50)
+    assert budget.stats() == {"budget_bytes": 100, "peak_in_use_bytes": 100, "oversized_jobs": 0}
+
+def test_oversized_job_runs_alone():
+    budget = wm.MemoryBudget(100)
+    assert budget.try_acquire(10)
+    assert not budget.try_acquire(500) # Waits for the running job
+    budget.release(10)
+    assert budget.try_acquire(500)
+    assert not budget.try_acquire(1) # Nothing else starts next to it
+    budget.release(500)
+    assert budget.try_acquire(1)
+    assert budget.stats()["oversized_jobs"] == 1
+
+def test_acquire_waits_for_release_in_arrival_order():
+    budget = wm.MemoryBudget(100)
+    budget.acquire(80)
+    admitted = []
+
+    def waiter(name, cost):
+        budget.acquire(cost)
+        admitted.append(name)
+
+    large = threading.Thread(target=waiter, args=("large", 90))
+    large.start()
+    while not budget._waiting: pass # The large job is queued first
+    small = threading.Thread(target=waiter, args=("small", 20))
+    small.start()
+    assert not budget.try_acquire(5) # Fits, but may not overtake the waiters
+    budget.release(80)
+    large.join(5)
+    assert admitted == ["large"]
+    budget.release(90)
+    small.join(5)
+    assert admitted == ["large", "small"]
+
+def test_batch_over_budget_runs_one_image_at_a_time(tmp_path, make_photo, font_path):
+    jobs = []
+    for i in range(4):
+        make_photo((200, 150)).save(tmp_path / f"photo_{i}.png")
+        jobs.append(wm.BatchJob(str(tmp_path / f"photo_{i}.png"), str(tmp_path / "out" / f"photo_{i}.png"), datetime.datetime(2024, 5, 1)))
+    budget = wm.MemoryBudget(1024) # Smaller than any single image
+    costs = [wm.plan_job_memory(job, budget) for job in jobs]
+    assert all(low_memory for _, low_memory in costs)
+
+    results = wm.run_batch(jobs, "Site Log", "", font_path=font_path, workers=3, memory_budget=budget, log_callback=lambda message: None)
+    assert all(r.success for r in results)
+    assert budget.stats()["peak_in_use_bytes"] == max(cost for cost, _ in costs)
+    assert budget.stats()["oversized_jobs"] == 4
+    assert budget.in_use == 0
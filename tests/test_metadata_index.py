@@ -0,0 +1,37 @@
+import os
+
+import watermark_engine as wm
+
+def test_metadata_index_reuses_unchanged_headers(tmp_path, make_photo, monkeypatch):
+    photo = tmp_path / "photo.png"
+    make_photo((120, 80)).save(photo)
+    reads = []
+    read_image_header = wm.read_image_header
+    monkeypatch.setattr(wm, "read_image_header", lambda path: reads.append(path) or read_image_header(path))
+
+    index = wm.MetadataIndex(str(tmp_path / "index.sqlite3"))
+    assert index.header(str(photo))[:4] == (120, 80, "RGB", "PNG")
+    assert index.header(str(photo))[:4] == (120, 80, "RGB", "PNG")
+    assert len(reads) == 1 and index.stats()["hits"] == 1
+    index.close()
+
+    reopened = wm.MetadataIndex(str(tmp_path / "index.sqlite3")) # Entries persist between runs
+    assert reopened.header(str(photo)).width == 120
+    assert len(reads) == 1
+
+    make_photo((60, 40)).save(photo)
+    st = os.stat(photo)
+    os.utime(photo, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9)) # Make sure the mtime moves on coarse clocks
+    assert reopened.header(str(photo))[:2] == (60, 40)
+    assert len(reads) == 2
+    assert reopened.header(str(photo))[:2] == (60, 40)
+    assert len(reads) == 2 and reopened.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+    reopened.close()
+
+def test_metadata_index_skips_unreadable_files(tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not a jpeg")
+    index = wm.MetadataIndex(str(tmp_path / "index.sqlite3"))
+    assert index.header(str(broken)) is None
+    assert index.header(str(tmp_path / "missing.jpg")) is None
+    index.close()
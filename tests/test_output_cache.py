@@ -0,0 +1,60 @@
+import datetime
+import hashlib
+import os
+import shutil
+
+import pytest
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+
+def run(input_path, output_path, font_path, cache, location_text="", **options):
+    job = wm.BatchJob(str(input_path), str(output_path), TIMESTAMP)
+    return wm.run_batch([job], "Site Log", location_text, font_path=font_path, log_callback=lambda message: None, output_cache=cache, **options)[0]
+
+@pytest.mark.parametrize("options", [dict(workers=1), dict(engine="pipeline")], ids=["serial", "pipeline"])
+def test_cache_hit_writes_identical_output(tmp_path, make_photo, font_path, options):
+    make_photo((240, 180)).save(tmp_path / "photo.jpg", quality=90)
+    os.makedirs(tmp_path / "elsewhere")
+    shutil.copyfile(tmp_path / "photo.jpg", tmp_path / "elsewhere" / "renamed.jpg")
+    cache = wm.OutputCache(str(tmp_path / "cache"))
+
+    first = run(tmp_path / "photo.jpg", tmp_path / "out" / "photo.jpg", font_path, cache, **options)
+    second = run(tmp_path / "elsewhere" / "renamed.jpg", tmp_path / "out2" / "renamed.jpg", font_path, cache, **options)
+    assert (first.success, first.cache, second.success, second.cache) == (True, "miss", True, "hit")
+    assert (tmp_path / "out2" / "renamed.jpg").read_bytes() == (tmp_path / "out" / "photo.jpg").read_bytes()
+    assert "decode" not in second.stages # Served without decoding the photo
+
+    changed = run(tmp_path / "photo.jpg", tmp_path / "out3" / "photo.jpg", font_path, cache, **options, location_text="Block B")
+    assert changed.cache == "miss" # Other settings, other key
+
+def test_cache_entry_survives_rewriting_a_hardlinked_output(tmp_path, make_photo, font_path):
+    make_photo((240, 180)).save(tmp_path / "photo.jpg", quality=90)
+    cache = wm.OutputCache(str(tmp_path / "cache"))
+    run(tmp_path / "photo.jpg", tmp_path / "out" / "photo.jpg", font_path, cache, workers=1)
+    expected = (tmp_path / "out" / "photo.jpg").read_bytes()
+    assert run(tmp_path / "photo.jpg", tmp_path / "out" / "photo.jpg", font_path, cache, workers=1).cache == "hit"
+
+    wm.save_watermarked_image(make_photo((10, 10)), str(tmp_path / "out" / "photo.jpg")) # Must not write through the link
+    assert run(tmp_path / "photo.jpg", tmp_path / "out2" / "photo.jpg", font_path, cache, workers=1).cache == "hit"
+    assert (tmp_path / "out2" / "photo.jpg").read_bytes() == expected
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    cache = wm.OutputCache(str(tmp_path / "cache"), max_bytes=2500)
+    keys = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(3)]
+    outputs = []
+    for i, key in enumerate(keys):
+        outputs.append(str(tmp_path / f"output_{i}.bin"))
+        with open(outputs[-1], "wb") as f: f.write(bytes([i]) * 1000)
+
+    assert cache.store(keys[0], outputs[0]) == 0
+    assert cache.store(keys[1], outputs[1]) == 0
+    assert cache.fetch([(keys[0], str(tmp_path / "fetched_0.bin"))]) # keys[1] is now the least recently used
+    assert cache.store(keys[2], outputs[2]) == 1
+    assert not cache.fetch([(keys[1], str(tmp_path / "fetched_1.bin"))])
+    assert cache.fetch([(keys[2], str(tmp_path / "fetched_2.bin"))])
+    assert not os.path.exists(os.path.join(tmp_path, "cache", keys[1][:2])) # Empty shard removed
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"], stats["hits"], stats["misses"]) == (2, 2000, 1, 2, 1)
+    cache.close()
@@ -0,0 +1,32 @@
+import datetime
+
+import pytest
+from PIL import Image
+
+import watermark_engine as wm
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 8, 0, 0)
+
+def test_parse_output_profile():
+    assert wm.parse_output_profile("full") == wm.OutputProfile("full", None, None, None)
+    assert wm.parse_output_profile("web:2048") == wm.OutputProfile("web", 2048, None, None)
+    assert wm.parse_output_profile("thumb:320:WEBP:75") == wm.OutputProfile("thumb", 320, "webp", 75)
+    assert wm.parse_output_profile("print:full:png") == wm.OutputProfile("print", None, "png", None)
+    for spec in ("", "web:abc", "thumb:320:nosuchformat", "a:1:jpg:80:extra"):
+        with pytest.raises(ValueError): wm.parse_output_profile(spec)
+
+def test_profile_output_paths():
+    profiles = [wm.parse_output_profile(spec) for spec in ("full", "web:2048", "thumb:320:webp")]
+    assert [wm.profile_output_path("out/photo.jpg", profile) for profile in profiles] == ["out/photo.jpg", "out/photo_web.jpg",
+                                                                                          "out/photo_thumb.webp"]
+
+@pytest.mark.parametrize("low_memory", [False, True])
+def test_every_profile_gets_its_size_and_format(tmp_path, make_photo, font_path, low_memory):
+    make_photo((1200, 800)).save(tmp_path / "photo.jpg", quality=90)
+    profiles = [wm.parse_output_profile(spec) for spec in ("full", "web:600", "small:600:png", "thumb:150:webp:60", "huge:4000")]
+    assert wm.apply_modern_watermark(str(tmp_path / "photo.jpg"), str(tmp_path / "out" / "photo.jpg"), "Site Log", "", TIMESTAMP,
+                                     font_path=font_path, log_callback=lambda message: None, profiles=profiles, low_memory=low_memory)
+    expected = {"photo.jpg": ((1200, 800), "JPEG"), "photo_web.jpg": ((600, 400), "JPEG"), "photo_small.png": ((600, 400), "PNG"),
+                "photo_thumb.webp": ((150, 100), "WEBP"), "photo_huge.jpg": ((1200, 800), "JPEG")} # Never upscaled
+    for name, (size, image_format) in expected.items():
+        with Image.open(tmp_path / "out" / name) as img: assert (name, img.size, img.format) == (name, size, image_format)
@@ -0,0 +1,45 @@
+import datetime
+import os
+
+import pytest
+
+import watermark_engine as wm
+
+FILES = ("a.jpg", "B.png", "notes.txt", "2024/e.jpg", "2024/f_thumb.jpg", "raw/c.jpg", "raw/skip/d.jpg")
+
+@pytest.fixture
+def tree(tmp_path, make_photo):
+    folder = tmp_path / "in"
+    for name in FILES:
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if name.endswith(".txt"): path.write_text("not an image")
+        else: make_photo((96, 64)).save(path)
+    return str(folder)
+
+def scan(folder, **options):
+    return [os.path.relpath(path, folder).replace(os.sep, "/") for path in wm.iter_image_files(folder, **options)]
+
+def test_scan_lists_images_in_path_order(tree):
+    assert scan(tree) == ["2024/e.jpg", "2024/f_thumb.jpg", "a.jpg", "B.png", "raw/c.jpg", "raw/skip/d.jpg"]
+    assert scan(tree, recursive=False) == ["a.jpg", "B.png"]
+    assert sorted(scan(tree, order="none")) == sorted(scan(tree))
+
+def test_include_and_exclude_globs(tree):
+    assert scan(tree, include=["*.jpg"]) == ["2024/e.jpg", "2024/f_thumb.jpg", "a.jpg", "raw/c.jpg", "raw/skip/d.jpg"]
+    assert scan(tree, include=["*.jpg"], exclude=["*_thumb.jpg", "raw/skip"]) == ["2024/e.jpg", "a.jpg", "raw/c.jpg"]
+    assert scan(tree, include=["raw/*"]) == ["raw/c.jpg", "raw/skip/d.jpg"] # "/" separators; fnmatch's "*" spans folders
+    assert scan(tree, exclude=["raw"]) == ["2024/e.jpg", "2024/f_thumb.jpg", "a.jpg", "B.png"]
+
+def test_output_tree_mirrors_input(tree, make_photo, font_path):
+    output_folder = os.path.join(tree, "out") # Inside the input folder: must not be scanned as input
+    make_photo((96, 64)).save(os.path.join(tree, "out.jpg"))
+    os.makedirs(output_folder)
+    make_photo((96, 64)).save(os.path.join(output_folder, "old.jpg"))
+
+    jobs = wm.build_batch_jobs(tree, output_folder, datetime.datetime(2024, 5, 1, 8, 0), exclude=["*_thumb.jpg"])
+    results = wm.run_batch(jobs, "Site Log", "", font_path=font_path, workers=1, log_callback=lambda message: None)
+    assert all(r.success for r in results)
+    written = sorted(os.path.relpath(os.path.join(root, name), output_folder).replace(os.sep, "/")
+                     for root, _, names in os.walk(output_folder) for name in names)
+    assert written == ["2024/e.jpg", "B.png", "a.jpg", "old.jpg", "out.jpg", "raw/c.jpg", "raw/skip/d.jpg"]
@@ -0,0 +1,57 @@
+import http.client
+import io
+import json
+import threading
+
+import pytest
+from PIL import Image
+
+from watermark_service import WatermarkService, create_watermark_server
+
+@pytest.fixture
+def start_server(font_path):
+    started = []
+
+    def start(**options):
+        service = WatermarkService(font_path, workers=2, log_callback=lambda message: None, **options)
+        server = create_watermark_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append((server, service))
+        return server.server_address[1]
+
+    yield start
+    for server, service in started:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+def post(port, body, query=""):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("POST", "/watermark" + query, body=body)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally: conn.close()
+
+def jpeg_bytes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+def test_watermarks_posted_jpeg(start_server, make_photo):
+    port = start_server()
+    status, headers, body = post(port, jpeg_bytes(make_photo((320, 240))), "?title=Test&location=Here&time=2024-05-01T08:00:00")
+    assert status == 200
+    assert headers["Content-Type"] == "image/jpeg"
+    with Image.open(io.BytesIO(body)) as result:
+        assert (result.format, result.size) == ("JPEG", (320, 240))
+
+def test_unreadable_body_is_rejected(start_server):
+    status, headers, body = post(start_server(), b"not an image")
+    assert status == 400
+    assert "error" in json.loads(body)
+
+def test_full_queue_returns_503(start_server, make_photo):
+    status, headers, body = post(start_server(max_queue=0), jpeg_bytes(make_photo((64, 48))))
+    assert status == 503
+    assert headers["Retry-After"] == "1"
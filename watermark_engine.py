@@ -0,0 +1,2381 @@
+"""Watermark rendering, encoding and the headless batch engine; imports neither Qt nor the HTTP service."""
+import sys
+import os
+import collections
+import contextlib
+import datetime
+import fnmatch
+import hashlib
+import io
+import json
+import random
+import shutil
+import struct
+import threading
+import time
+import traceback
+import zlib
+
+from PIL import Image, ImageDraw, ImageFont
+
+# --- Style Colors ---
+COLOR_BLUE_BAR_BG = (20, 120, 220, 255)  # Opaque Blue
+COLOR_TITLE_TEXT = (255, 255, 255, 255) # White
+COLOR_TIME_TEXT = (240, 240, 240, 255)  # Slightly off-white
+COLOR_WHITE_BAR_BG = (255, 255, 255, 128) # 50% Transparent White
+COLOR_LOCATION_TEXT = (0, 0, 0, 255)    # Black
+
+WatermarkLayout = collections.namedtuple(
+    "WatermarkLayout",
+    "anchor final_x final_y block_width block_height blue_bar_total_h white_bar_total_h "
+    "h_padding_inside_bars v_padding_bar_ends title_pos time_pos location_pos"
+)
+
+# --- Caches (fonts, text metrics, static watermark tiles) ---
+class LRUCache:
+    """Small thread-safe LRU mapping with hit/miss counters."""
+    _MISSING = object()
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear(); self.hits = 0; self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+_font_cache = LRUCache(maxsize=32)         # (font_path, size) -> FreeTypeFont, or None if loading failed
+_font_path_cache = LRUCache(maxsize=4)     # base_path -> resolved font path
+_text_size_cache = LRUCache(maxsize=512)   # (font, text) -> (w, h, ink bbox at origin)
+_static_tile_cache = LRUCache(maxsize=64)  # content + style + geometry -> tile without the timestamp
+
+def get_font(font_path, size):
+    # Returns a cached FreeTypeFont, or None if the font cannot be loaded (failures are cached too)
+    key = (font_path, size)
+    font_obj = _font_cache.get(key, LRUCache._MISSING)
+    if font_obj is LRUCache._MISSING:
+        try: font_obj = ImageFont.truetype(font_path, size)
+        except IOError: font_obj = None
+        _font_cache.put(key, font_obj)
+    return font_obj
+
+def get_cache_stats():
+    return {"fonts": _font_cache.stats(), "font_paths": _font_path_cache.stats(),
+            "text_sizes": _text_size_cache.stats(), "static_tiles": _static_tile_cache.stats()}
+
+def clear_watermark_caches():
+    for cache in (_font_cache, _font_path_cache, _text_size_cache, _static_tile_cache): cache.clear()
+
+# --- Metrics (per-stage timings and counters) ---
+class StageTimer:
+    """Per-image stage wall times (ms) and byte counts, filled in by the watermarking functions."""
+    def __init__(self):
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.encodes = {} # "preset/FORMAT" -> [count, total_ms, bytes]
+        self.cache = None # "hit" / "miss" when an OutputCache was consulted
+        self.cache_evictions = 0 # OutputCache entries deleted to make room for this image's outputs
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try: yield
+        finally: self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def _stage(timer, name):
+    return timer.stage(name) if timer else contextlib.nullcontext()
+
+class BatchMetrics:
+    """Thread-safe counters, per-stage aggregates and per-image timing events for one batch run."""
+    def __init__(self, max_events=100000):
+        self.started = time.time()
+        self._started_perf = time.perf_counter()
+        self.counters = {"processed": 0, "failed": 0, "skipped": 0, "bytes_read": 0, "bytes_written": 0, "cache_hits": 0, "cache_misses": 0,
+                         "cache_evictions": 0}
+        self.stage_totals = {} # stage -> [count, total_ms, min_ms, max_ms]
+        self.encoder_totals = {} # "preset/FORMAT" -> [count, total_ms, bytes]
+        self.events = collections.deque(maxlen=max_events) # Oldest events are dropped on very long runs
+        self._lock = threading.Lock()
+
+    def record(self, input_path, success, stages=None, bytes_read=0, bytes_written=0, skipped=False, encodes=None, cache=None,
+               cache_evictions=0):
+        stages = stages or {}
+        with self._lock:
+            self.counters["skipped" if skipped else "processed" if success else "failed"] += 1
+            if cache: self.counters["cache_hits" if cache == "hit" else "cache_misses"] += 1
+            self.counters["cache_evictions"] += cache_evictions
+            self.counters["bytes_read"] += bytes_read
+            self.counters["bytes_written"] += bytes_written
+            for name, ms in stages.items():
+                totals = self.stage_totals.setdefault(name, [0, 0.0, ms, ms])
+                totals[0] += 1; totals[1] += ms; totals[2] = min(totals[2], ms); totals[3] = max(totals[3], ms)
+            for label, (count, ms, size) in (encodes or {}).items():
+                totals = self.encoder_totals.setdefault(label, [0, 0.0, 0])
+                totals[0] += count; totals[1] += ms; totals[2] += size
+            self.events.append({"input": input_path, "success": success, "skipped": skipped, "stages_ms": dict(stages),
+                                "total_ms": sum(stages.values()), "bytes_read": bytes_read, "bytes_written": bytes_written,
+                                "cache": cache, "at": round(time.perf_counter() - self._started_perf, 4)})
+
+    def record_result(self, result):
+        self.record(result.input_path, result.success, result.stages, result.bytes_read, result.bytes_written, result.skipped,
+                    result.encodes, result.cache, result.cache_evictions)
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self._started_perf
+            done = self.counters["processed"] + self.counters["failed"]
+            return {
+                "elapsed_s": elapsed, "images_per_second": done / elapsed if elapsed else 0.0, "counters": dict(self.counters),
+                "stages": {name: {"count": c, "total_ms": total, "mean_ms": total / c, "min_ms": lo, "max_ms": hi}
+                           for name, (c, total, lo, hi) in self.stage_totals.items()},
+                "encoders": {label: {"count": c, "total_ms": total, "mean_ms": total / c, "bytes": size, "mean_bytes": size / c}
+                             for label, (c, total, size) in self.encoder_totals.items()},
+            }
+
+    def to_dict(self, include_events=True):
+        data = dict(self.snapshot(), started=datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"))
+        if include_events:
+            with self._lock: data["events"] = list(self.events)
+        return data
+
+    def dump_json(self, path, include_events=True):
+        with open(path, "w", encoding="utf-8") as f: json.dump(self.to_dict(include_events), f, ensure_ascii=False, indent=2)
+
+    def summary_lines(self):
+        snap = self.snapshot()
+        c = snap["counters"]
+        lines = [f"成功: {c['processed']}, 失败: {c['failed']}, 跳过: {c['skipped']}, 耗时: {snap['elapsed_s']:.2f}s "
+                 f"({snap['images_per_second']:.2f} 张/秒), 读取: {c['bytes_read'] / 1e6:.1f}MB, 写入: {c['bytes_written'] / 1e6:.1f}MB"]
+        for name, s in sorted(snap["stages"].items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(f"  {name:<10} 平均 {s['mean_ms']:8.1f}ms  最大 {s['max_ms']:8.1f}ms  合计 {s['total_ms'] / 1000:8.2f}s")
+        for label, e in sorted(snap["encoders"].items()):
+            lines.append(f"  编码 {label:<16} {e['count']:6d} 张  平均 {e['mean_ms']:8.1f}ms  {e['mean_bytes'] / 1e3:8.1f}KB/张  "
+                         f"合计 {e['bytes'] / 1e6:.1f}MB")
+        lookups = c["cache_hits"] + c["cache_misses"]
+        if lookups: lines.append(f"  输出缓存 命中 {c['cache_hits']} / {lookups} 张 ({c['cache_hits'] / lookups:.0%}), 命中的图片未解码, "
+                                 f"删除 {c['cache_evictions']} 个最久未使用的条目")
+        return lines
+
+# --- Helper to get text dimensions ---
+def get_text_size(text, font_obj, context_draw):
+    if not text: return 0,0 # Handle empty strings
+    if hasattr(context_draw, 'textbbox'):
+        try: # Pillow 9.0.0+ textbbox takes xy, older versions don't
+            bbox = context_draw.textbbox((0,0), text, font=font_obj)
+        except TypeError: # Older Pillow, try without xy
+            bbox = context_draw.textbbox(text, font=font_obj)
+
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+    else:
+        return context_draw.textsize(text, font=font_obj)
+
+_measure_draw_local = threading.local()
+
+def _measure_draw():
+    # A per-thread 1x1 draw context used only for text measurement
+    draw = getattr(_measure_draw_local, "draw", None)
+    if draw is None: draw = _measure_draw_local.draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    return draw
+
+def _measure_text(text, font_obj, context_draw):
+    # (w, h, ink box at origin); cached per font object and string
+    key = (font_obj, text)
+    metrics = _text_size_cache.get(key)
+    if metrics is None:
+        w, h = get_text_size(text, font_obj, context_draw)
+        ink = (0, 0, w, h) # Old Pillow without textbbox: assume the measured size starts at the origin
+        if hasattr(context_draw, 'textbbox'):
+            try: ink = context_draw.textbbox((0, 0), text, font=font_obj)
+            except TypeError: pass
+        metrics = (w, h, tuple(ink))
+        _text_size_cache.put(key, metrics)
+    return metrics
+
+def _text_ink_box(context_draw, xy, text, font_obj):
+    # Pixel box actually touched by draw.text
+    ink = _measure_text(text, font_obj, context_draw)[2]
+    return xy[0] + ink[0], xy[1] + ink[1], xy[0] + ink[2], xy[1] + ink[3]
+
+def load_watermark_fonts(font_path, base_font_size, log_callback=print):
+    base_font = get_font(font_path, base_font_size)
+    title_font_size = int(base_font_size * 1.4) # Title font is larger
+    title_font = get_font(font_path, title_font_size)
+    if base_font is None or title_font is None:
+        log_callback(f"警告: 字体 '{font_path}' 未找到, 使用默认字体。")
+        default_font = _font_cache.get(("<default>", None))
+        if default_font is None:
+            default_font = ImageFont.load_default()
+            _font_cache.put(("<default>", None), default_font)
+        base_font = title_font = default_font # Fallback for title too
+    return base_font, title_font
+
+def compute_watermark_layout(img_size, title_text, time_str, location_text, anchor, padding,
+                             base_font_size, base_font, title_font, context_draw):
+    img_width, img_height = img_size
+
+    # --- Calculate Text Dimensions ---
+    title_w, title_h = _measure_text(title_text, title_font, context_draw)[:2] if title_text else (0, 0)
+    time_w, time_h = _measure_text(time_str, base_font, context_draw)[:2] if time_str else (0, 0)
+    location_w, location_h = _measure_text(location_text, base_font, context_draw)[:2] if location_text else (0, 0)
+
+    # --- Define Internal Paddings & Spacings (relative to base_font_size for scalability) ---
+    h_padding_inside_bars = int(base_font_size * 0.6)
+    v_padding_bar_ends = int(base_font_size * 0.3) # Top of title bar, bottom of location bar
+    v_padding_title_time = int(base_font_size * 0.15) # Between title and time
+
+    # --- Calculate Dimensions of Each Bar ---
+    # Blue (Top) Bar
+    blue_bar_content_h = title_h + (v_padding_title_time if title_text and time_str else 0) + time_h
+    blue_bar_total_h = (v_padding_bar_ends * 2) + blue_bar_content_h + 10
+    blue_bar_width = max(title_w, time_w) + (h_padding_inside_bars * 2)
+
+    # White (Bottom) Bar
+    white_bar_content_h = location_h
+    white_bar_total_h = (v_padding_bar_ends * 10) + white_bar_content_h
+    white_bar_width = location_w + (h_padding_inside_bars * 2)
+
+    # Overall Watermark Block Dimensions
+    watermark_block_width = max(blue_bar_width, white_bar_width)
+    watermark_block_height = blue_bar_total_h + white_bar_total_h # Bars are stacked directly
+
+    # --- Calculate Overall (final_x, final_y) for the top-left of the watermark block ---
+    # This uses the anchor and padding parameters for the entire block
+    pad_x_abs, pad_y_abs = padding
+
+    if anchor == "top_left": final_x, final_y = pad_x_abs, pad_y_abs
+    elif anchor == "top_center": final_x, final_y = (img_width - watermark_block_width) // 2, pad_y_abs
+    elif anchor == "top_right": final_x, final_y = img_width - watermark_block_width - pad_x_abs, pad_y_abs
+    elif anchor == "middle_left": final_x, final_y = pad_x_abs, (img_height - watermark_block_height) // 2
+    elif anchor == "middle_center": final_x, final_y = (img_width - watermark_block_width) // 2, (img_height - watermark_block_height) // 2
+    elif anchor == "middle_right": final_x, final_y = img_width - watermark_block_width - pad_x_abs, (img_height - watermark_block_height) // 2
+    elif anchor == "bottom_left": final_x, final_y = pad_x_abs, img_height - watermark_block_height - pad_y_abs
+    elif anchor == "bottom_center": final_x, final_y = (img_width - watermark_block_width) // 2, img_height - watermark_block_height - pad_y_abs
+    else:  # Default bottom_right
+        anchor = "bottom_right"
+        final_x, final_y = img_width - watermark_block_width - pad_x_abs, img_height - watermark_block_height - pad_y_abs
+
+    final_x = max(0, int(final_x))
+    final_y = max(0, int(final_y))
+
+    title_pos = (final_x + h_padding_inside_bars, final_y + v_padding_bar_ends)
+    time_pos = (final_x + h_padding_inside_bars, final_y + v_padding_bar_ends + (title_h + v_padding_title_time if title_text else 0))
+    location_pos = (final_x + h_padding_inside_bars, final_y + blue_bar_total_h + v_padding_bar_ends)
+
+    return WatermarkLayout(anchor, final_x, final_y, watermark_block_width, watermark_block_height,
+                           blue_bar_total_h, white_bar_total_h, h_padding_inside_bars, v_padding_bar_ends,
+                           title_pos, time_pos, location_pos)
+
+def _draw_watermark_parts(tile_size, layout, ox, oy, title_text, time_str, location_text, base_font, title_font):
+    tile = Image.new("RGBA", tile_size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(tile)
+    x0 = layout.final_x - ox
+
+    # --- Draw Elements ---
+    current_y_offset = layout.final_y - oy
+
+    # 1. Blue Bar (Top)
+    draw.rectangle(
+        [x0, current_y_offset, x0 + layout.block_width, current_y_offset + layout.blue_bar_total_h],
+        fill=COLOR_BLUE_BAR_BG
+    )
+    # Title Text
+    if title_text:
+        draw.text((layout.title_pos[0] - ox, layout.title_pos[1] - oy), title_text, font=title_font, fill=COLOR_TITLE_TEXT)
+    # Timestamp Text (below title)
+    if time_str:
+        draw.text((layout.time_pos[0] - ox, layout.time_pos[1] - oy), time_str, font=base_font, fill=COLOR_TIME_TEXT)
+    current_y_offset += layout.blue_bar_total_h
+
+    # 2. White Transparent Bar (Bottom)
+    draw.rectangle(
+        [x0, current_y_offset, x0 + layout.block_width, current_y_offset + layout.white_bar_total_h],
+        fill=COLOR_WHITE_BAR_BG
+    )
+    # Location Text
+    if location_text:
+        draw.text((layout.location_pos[0] - ox, layout.location_pos[1] - oy), location_text, font=base_font, fill=COLOR_LOCATION_TEXT)
+    return tile
+
+def render_watermark_tile(img_size, layout, title_text, time_str, location_text, base_font, title_font, context_draw, style_key=None):
+    # Draws the bars and text into a tile covering only the watermark block (clipped to the image).
+    # Returns (tile, box); box is the tile's (left, top, right, bottom) in image coordinates.
+    # With a style_key, everything except the timestamp comes from the static tile cache.
+    x0, y0 = layout.final_x, layout.final_y
+    # Rectangles are inclusive of their end coordinates, hence the +1
+    left, top, right, bottom = x0, y0, x0 + layout.block_width + 1, y0 + layout.block_height + 1
+    ink_boxes = {}
+    for name, text, pos, font_obj in (("title", title_text, layout.title_pos, title_font), ("time", time_str, layout.time_pos, base_font),
+                                      ("location", location_text, layout.location_pos, base_font)):
+        if text:
+            ink = ink_boxes[name] = _text_ink_box(context_draw, pos, text, font_obj)
+            left, top, right, bottom = min(left, ink[0]), min(top, ink[1]), max(right, ink[2]), max(bottom, ink[3])
+    box = (max(0, left), max(0, top), min(img_size[0], right), min(img_size[1], bottom))
+    if box[2] <= box[0] or box[3] <= box[1]: return None, box # Block lies entirely outside the image
+
+    ox, oy = box[0], box[1]
+    tile_size = (box[2] - box[0], box[3] - box[1])
+
+    # The cached tile gets the timestamp drawn last, which only matches the normal drawing order
+    # (timestamp before the white bar and location) while the timestamp ink stays clear of both.
+    time_ink = ink_boxes.get("time")
+    cacheable = style_key is not None and (
+        time_ink is None or (time_ink[3] <= y0 + layout.blue_bar_total_h and
+                             ("location" not in ink_boxes or time_ink[3] <= ink_boxes["location"][1])))
+    if not cacheable:
+        return _draw_watermark_parts(tile_size, layout, ox, oy, title_text, time_str, location_text, base_font, title_font), box
+
+    static_key = (style_key, COLOR_BLUE_BAR_BG, COLOR_TITLE_TEXT, COLOR_WHITE_BAR_BG, COLOR_LOCATION_TEXT,
+                  title_text, location_text, tile_size, x0 - ox, y0 - oy, layout.block_width,
+                  layout.blue_bar_total_h, layout.white_bar_total_h,
+                  (layout.title_pos[0] - ox, layout.title_pos[1] - oy), (layout.location_pos[0] - ox, layout.location_pos[1] - oy))
+    static_tile = _static_tile_cache.get(static_key)
+    if static_tile is None:
+        static_tile = _draw_watermark_parts(tile_size, layout, ox, oy, title_text, None, location_text, base_font, title_font)
+        _static_tile_cache.put(static_key, static_tile)
+
+    tile = static_tile.copy() # Cached tiles are shared and never drawn on
+    if time_str:
+        ImageDraw.Draw(tile).text((layout.time_pos[0] - ox, layout.time_pos[1] - oy), time_str, font=base_font, fill=COLOR_TIME_TEXT)
+    return tile, box
+
+def composite_watermark_region(img, tile, box):
+    # Blends the tile into img in place, touching only the pixels under box
+    if tile is None: return img
+    if img.mode == "RGBA":
+        img.alpha_composite(tile, dest=(box[0], box[1]))
+    else: # RGB: blend the region in RGBA and paste it back, so the rest of the frame is never converted
+        region = img.crop(box).convert("RGBA")
+        region.alpha_composite(tile)
+        img.paste(region.convert(img.mode), box[:2])
+    return img
+
+def _working_mode(img):
+    # Keep RGB inputs in RGB; anything carrying transparency is handled as RGBA
+    if img.mode in ("RGB", "RGBA"): return img.mode
+    if img.mode in ("LA", "PA") or (img.mode == "P" and "transparency" in img.info): return "RGBA"
+    return "RGB"
+
+def watermark_pil_image(img, title_text, location_text, timestamp_dt, anchor="bottom_right", padding=(10, 10),
+                        font_path="arial.ttf", base_font_size=20, log_callback=print, timer=None):
+    """Watermark a PIL image in place (after converting it to RGB/RGBA). Returns (image, layout)."""
+    if img.mode != _working_mode(img):
+        with _stage(timer, "convert"): img = img.convert(_working_mode(img))
+    tile, box, layout = render_watermark(img.size, title_text, location_text, timestamp_dt, anchor, padding,
+                                         font_path, base_font_size, log_callback, timer)
+    with _stage(timer, "composite"): img = composite_watermark_region(img, tile, box)
+    return img, layout
+
+def render_watermark(img_size, title_text, location_text, timestamp_dt, anchor="bottom_right", padding=(10, 10),
+                     font_path="arial.ttf", base_font_size=20, log_callback=print, timer=None):
+    """Watermark tile for an image of img_size, without touching any pixels. Returns (tile, box, layout)."""
+    with _stage(timer, "fonts"): base_font, title_font = load_watermark_fonts(font_path, base_font_size, log_callback)
+    time_str = timestamp_dt.strftime("%Y-%m-%d %H:%M:%S")
+    context_draw = _measure_draw()
+
+    with _stage(timer, "layout"):
+        layout = compute_watermark_layout(img_size, title_text, time_str, location_text, anchor, padding,
+                                          base_font_size, base_font, title_font, context_draw)
+    with _stage(timer, "draw"):
+        tile, box = render_watermark_tile(img_size, layout, title_text, time_str, location_text, base_font, title_font,
+                                          context_draw, style_key=(font_path, base_font_size))
+    return tile, box, layout
+
+# --- Encoding ---
+def output_format_for_path(output_path):
+    ext = os.path.splitext(output_path)[1].lower()
+    image_format = Image.registered_extensions().get(ext)
+    if image_format is None: raise ValueError(f"不支持的输出格式: {ext or output_path}")
+    return image_format
+
+def prepare_for_output(img, output_path):
+    # JPEG has no alpha channel. Callers rebind their own reference so the RGBA copy can be freed right away.
+    if output_path.lower().endswith(('.jpg', '.jpeg')) and img.mode != "RGB": img = img.convert("RGB")
+    return img
+
+# Encoder settings per preset and Pillow format; formats not listed use Pillow's defaults
+ENCODER_PRESETS = {
+    "fast": {"JPEG": dict(quality=85, subsampling=2, optimize=False, progressive=False), "PNG": dict(compress_level=1),
+             "WEBP": dict(quality=80, method=0)},
+    "balanced": {"JPEG": dict(quality=90, subsampling=2, optimize=True), "PNG": dict(compress_level=6),
+                 "WEBP": dict(quality=85, method=4)},
+    "archival": {"JPEG": dict(quality=95, subsampling=0, optimize=True, progressive=True), "PNG": dict(compress_level=9),
+                 "WEBP": dict(lossless=True, quality=100, method=6)},
+}
+DEFAULT_ENCODER_PRESET = "balanced"
+EncoderSettings = collections.namedtuple("EncoderSettings", "preset keep_metadata", defaults=(DEFAULT_ENCODER_PRESET, True))
+DEFAULT_ENCODER = EncoderSettings()
+_EXIF_ORIENTATION = 0x0112
+
+def _upright_exif(exif):
+    # Pixels are written as stored, so viewers must not rotate them again: reset the EXIF orientation
+    exif_tags = Image.Exif()
+    exif_tags.load(exif)
+    if exif_tags.get(_EXIF_ORIENTATION, 1) == 1: return exif
+    exif_tags[_EXIF_ORIENTATION] = 1
+    return exif_tags.tobytes()
+
+def _metadata_save_options(img):
+    # EXIF and ICC profile of the decoded source; img.info survives convert() and resize(), so nothing is re-read
+    options = {}
+    if img.info.get("icc_profile"): options["icc_profile"] = img.info["icc_profile"]
+    if img.info.get("exif"): options["exif"] = _upright_exif(img.info["exif"])
+    return options
+
+def encoder_save_options(img, image_format, encoder=None, overrides=None):
+    """Keyword arguments for img.save(): the preset's settings for image_format, the source metadata, then overrides."""
+    encoder = encoder or DEFAULT_ENCODER
+    if encoder.preset not in ENCODER_PRESETS: raise ValueError(f"未知的编码预设: {encoder.preset}")
+    options = dict(ENCODER_PRESETS[encoder.preset].get({"MPO": "JPEG"}.get(image_format, image_format), {}))
+    if encoder.keep_metadata: options.update(_metadata_save_options(img))
+    options.update(overrides or {})
+    return options
+
+def _record_encode(timer, encoder, image_format, started, size):
+    # Per preset/format encode counters: label -> [count, total ms, bytes]
+    if not timer: return
+    totals = timer.encodes.setdefault(f"{(encoder or DEFAULT_ENCODER).preset}/{image_format}", [0, 0.0, 0])
+    totals[0] += 1; totals[1] += (time.perf_counter() - started) * 1000; totals[2] += size
+
+def encode_watermarked_image(img, output_path, save_options=None, encoder=None, timer=None):
+    # Encodes in memory (format picked from the extension) so the file itself is written in one go.
+    # Holds no shared state, so several images can be encoded at once from a thread pool (Pillow releases the GIL).
+    img = prepare_for_output(img, output_path)
+    image_format = output_format_for_path(output_path)
+    started = time.perf_counter()
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, **encoder_save_options(img, image_format, encoder, save_options))
+    _record_encode(timer, encoder, image_format, started, buffer.tell())
+    return buffer.getvalue()
+
+def _prepare_output_path(output_path):
+    output_dir = os.path.dirname(output_path)
+    if output_dir: os.makedirs(output_dir, exist_ok=True) # Mirrored subfolders
+    _unshare_output(output_path)
+
+def write_output_bytes(output_path, data, timer=None):
+    # Writes an output encoded by encode_watermarked_image
+    _prepare_output_path(output_path)
+    with _stage(timer, "write"):
+        with open(output_path, "wb") as f: f.write(data)
+    if timer: timer.bytes_written += len(data)
+    return len(data)
+
+def save_watermarked_image(img, output_path, timer=None, low_memory=False, save_options=None, encoder=None):
+    if not low_memory:
+        with _stage(timer, "encode"): data = encode_watermarked_image(img, output_path, save_options, encoder, timer)
+        return write_output_bytes(output_path, data, timer)
+    # Stream the encoder straight into the file instead of holding the whole encoded output in memory
+    _prepare_output_path(output_path)
+    with _stage(timer, "encode"):
+        img = prepare_for_output(img, output_path)
+        image_format = output_format_for_path(output_path)
+        started = time.perf_counter()
+        img.save(output_path, format=image_format, **encoder_save_options(img, image_format, encoder, save_options))
+    size = os.path.getsize(output_path)
+    _record_encode(timer, encoder, image_format, started, size)
+    if timer: timer.bytes_written += size
+    return size
+
+# --- Output Profiles (several sizes from one decode) ---
+OutputProfile = collections.namedtuple("OutputProfile", "name max_size format quality", defaults=(None, None, None))
+FULL_PROFILE_NAME = "full" # The profile whose output keeps the plain output file name
+FULL_OUTPUT_PROFILE = OutputProfile(FULL_PROFILE_NAME)
+
+def parse_output_profile(spec):
+    """'full', 'web:2048' or 'thumb:320:webp:75' (name:long edge:format:quality) -> OutputProfile."""
+    parts = spec.split(":")
+    if not parts[0] or len(parts) > 4: raise ValueError(f"无效的输出规格: {spec}")
+    max_size = int(parts[1]) if len(parts) > 1 and parts[1] not in ("", "0", FULL_PROFILE_NAME) else None
+    image_format = parts[2].lower() if len(parts) > 2 and parts[2] else None
+    if image_format: output_format_for_path("profile." + image_format) # Fail before the batch starts
+    return OutputProfile(parts[0], max_size, image_format, int(parts[3]) if len(parts) > 3 and parts[3] else None)
+
+def parse_output_format(text):
+    # "webp" / ".JPG" -> "webp"; the extension must be one Pillow can write
+    image_format = text.lower().lstrip(".")
+    output_format_for_path("profile." + image_format)
+    return image_format
+
+def with_output_format(profiles, image_format):
+    # Profiles without their own format are written as image_format; no profiles means the full-size output only
+    return [profile if profile.format else profile._replace(format=image_format) for profile in profiles or (FULL_OUTPUT_PROFILE,)]
+
+def profile_output_path(output_path, profile):
+    # photo.jpg -> photo.jpg for "full", photo_web.jpg / photo_thumb.webp for the others
+    stem, ext = os.path.splitext(output_path)
+    if profile.format: ext = "." + profile.format
+    return (stem if profile.name == FULL_PROFILE_NAME else f"{stem}_{profile.name}") + ext
+
+def profile_target_size(full_size, profile):
+    if not profile.max_size or max(full_size) <= profile.max_size: return tuple(full_size)
+    scale = profile.max_size / max(full_size)
+    return max(1, round(full_size[0] * scale)), max(1, round(full_size[1] * scale))
+
+def decode_for_profiles(source, profiles, timer=None):
+    """Decode an image once for all profiles. Returns (image, full size).
+
+    When no profile needs the full resolution, JPEGs are decoded with draft() at the smallest DCT scale
+    (1/2, 1/4, 1/8) that still covers the largest output.
+    """
+    with _stage(timer, "decode"):
+        img = Image.open(source)
+        full_size = img.size
+        if img.format == "JPEG" and all(profile.max_size for profile in profiles):
+            img.draft(img.mode, max((profile_target_size(full_size, profile) for profile in profiles), key=lambda size: size[0]))
+        img.load()
+    return img, full_size
+
+def iter_profile_outputs(img, full_size, output_path, profiles, title_text, location_text, timestamp_dt, anchor="bottom_right",
+                         padding=(10, 10), font_path="arial.ttf", base_font_size=20, log_callback=print, timer=None):
+    """Watermark a decoded image for every profile; yields (path, image, layout, save_options).
+
+    Each distinct size is resized from the clean decode and watermarked once, with the font size and padding
+    scaled from base_font_size so every copy looks the same. Sizes are produced smallest first and the largest
+    one is drawn onto `img` itself, so the decode is never copied for it.
+    """
+    if img.mode != _working_mode(img):
+        with _stage(timer, "convert"): img = img.convert(_working_mode(img)) # Resizing palette images would use NEAREST
+    by_size = collections.OrderedDict()
+    for profile in profiles: by_size.setdefault(profile_target_size(full_size, profile), []).append(profile)
+    for size in sorted(by_size, key=lambda size: size[0] * size[1]):
+        if size == img.size: sized = img # Always the last (largest) size
+        else:
+            with _stage(timer, "resize"): sized = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        font_size, scaled_padding = scale_watermark_style(base_font_size, padding, size[0] / full_size[0])
+        sized, layout = watermark_pil_image(sized, title_text, location_text, timestamp_dt, anchor, scaled_padding,
+                                            font_path, font_size, log_callback, timer)
+        for profile in by_size[size]:
+            yield profile_output_path(output_path, profile), sized, layout, {"quality": profile.quality} if profile.quality else {}
+
+# --- Large Images (strip/tile processing) ---
+# Pixels above which an image is processed in strips instead of being decoded whole (Pillow's own size warning)
+LARGE_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS or 89478485
+_STRIP_BYTES = 16 * 1024 * 1024 # Decoded bytes per strip
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_IDAT_BYTES = 1024 * 1024 # Size of the IDAT chunks written
+_PNG_METADATA_CHUNKS = (b"eXIf", b"iCCP", b"tEXt", b"zTXt", b"iTXt")
+
+# layout: PNG -> (color type, row bytes incl. filter byte);
+# BMP/TIFF -> [(box, offset of the box's first row, row stride (negative when stored bottom-up), rawmode)]
+LargeImageInfo = collections.namedtuple("LargeImageInfo", "format width height mode layout")
+
+def _read_png_info(f):
+    head = f.read(33)
+    if head[:8] != _PNG_SIGNATURE or head[12:16] != b"IHDR": return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", head[16:29])
+    if bit_depth != 8 or color_type not in (2, 6) or interlace: return None # 8-bit RGB/RGBA, not interlaced
+    mode = "RGB" if color_type == 2 else "RGBA"
+    return LargeImageInfo("PNG", width, height, mode, (color_type, 1 + width * len(mode)))
+
+def _read_bmp_info(f):
+    head = f.read(34)
+    if head[:2] != b"BM" or len(head) < 34: return None
+    data_offset, dib_size, width, height, _, bit_count, compression = struct.unpack("<I I i i H H I", head[10:34])
+    if dib_size < 40 or compression != 0 or bit_count not in (24, 32) or width <= 0 or not height: return None
+    stride = (width * bit_count // 8 + 3) & ~3 # Rows are padded to 4 bytes
+    rawmode = "BGR" if bit_count == 24 else "BGRX"
+    if height < 0: return LargeImageInfo("BMP", width, -height, "RGB", [((0, 0, width, -height), data_offset, stride, rawmode)])
+    return LargeImageInfo("BMP", width, height, "RGB", [((0, 0, width, height), data_offset + (height - 1) * stride, -stride, rawmode)])
+
+def _read_tiff_info(f):
+    from PIL import TiffImagePlugin
+    head = f.read(8)
+    if head[:4] not in (b"II*\x00", b"MM\x00*"): return None # Classic TIFF only, not BigTIFF
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(head)
+    f.seek(struct.unpack(("<" if head[:2] == b"II" else ">") + "I", head[4:8])[0])
+    ifd.load(f)
+    tag = lambda number, default=None: (lambda value: value if isinstance(value, tuple) else (value,))(ifd.get(number, default))
+    width, height = tag(256)[0], tag(257)[0]
+    samples, extra = tag(277, 1)[0], tag(338, ())
+    if tag(259, 1)[0] != 1 or tag(284, 1)[0] != 1 or tag(262)[0] != 2 or set(tag(258)) != {8}: return None # Uncompressed, chunky 8-bit RGB
+    if samples == 3: mode, rawmode = "RGB", "RGB"
+    elif samples == 4 and extra in ((2,), (0,)): mode, rawmode = ("RGBA", "RGBA") if extra == (2,) else ("RGB", "RGBX")
+    else: return None
+    if 322 in ifd: # Tiled; edge tiles are stored at full tile size
+        tile_w, tile_h, offsets = tag(322)[0], tag(323)[0], tag(324)
+        across = (width + tile_w - 1) // tile_w
+        chunks = [((x, y, min(width, x + tile_w), min(height, y + tile_h)), offset, tile_w * samples, rawmode)
+                  for offset, (x, y) in zip(offsets, ((i % across * tile_w, i // across * tile_h) for i in range(len(offsets))))]
+    else:
+        rows_per_strip = min(tag(278, height)[0], height)
+        chunks = [((0, i * rows_per_strip, width, min(height, (i + 1) * rows_per_strip)), offset, width * samples, rawmode)
+                  for i, offset in enumerate(tag(273))]
+    return LargeImageInfo("TIFF", width, height, mode, chunks)
+
+def read_large_image_info(path):
+    """Header-only LargeImageInfo for inputs that can be processed in strips, else None.
+
+    Supported: 8-bit RGB/RGBA non-interlaced PNG, uncompressed 24/32-bit BMP and uncompressed chunky RGB/RGBA TIFF
+    (stripped or tiled). Pillow's Image.open is not used, so its decompression-bomb limit does not apply.
+    """
+    try:
+        with open(path, "rb") as f:
+            for reader in (_read_png_info, _read_bmp_info, _read_tiff_info):
+                f.seek(0)
+                info = reader(f)
+                if info: return info
+    except (OSError, SyntaxError, ValueError, KeyError, IndexError, struct.error): pass
+    return None
+
+def large_image_streamable(input_path, output_path, profiles=None, low_memory=False):
+    """LargeImageInfo when this job should be processed in strips, else None.
+
+    Only for a single full-size output in the input's own format, and only when the image is larger than
+    LARGE_IMAGE_PIXELS or low_memory is set (it does not fit the memory budget).
+    """
+    if not input_path.lower().endswith((".png", ".bmp", ".tif", ".tiff")): return None
+    if profiles and (len(profiles) > 1 or profiles[0].max_size): return None
+    try: output_format = output_format_for_path(profile_output_path(output_path, profiles[0]) if profiles else output_path)
+    except ValueError: return None
+    info = read_large_image_info(input_path)
+    if not info or info.format != output_format: return None
+    return info if low_memory or info.width * info.height > LARGE_IMAGE_PIXELS else None
+
+def estimate_streaming_memory(info):
+    # A strip, its synthetic PNG copy and the decoded strip, whatever the image height
+    return 3 * max(_STRIP_BYTES, 2 * info.width * 4) + _MEMORY_OVERHEAD
+
+def _composite_part(img, origin, tile, box):
+    # Blends the part of tile (placed at box in full-image coordinates) that falls on img, whose top-left is origin
+    part = (max(box[0], origin[0]), max(box[1], origin[1]), min(box[2], origin[0] + img.width), min(box[3], origin[1] + img.height))
+    if tile is None or part[2] <= part[0] or part[3] <= part[1]: return img
+    tile_part = tile.crop((part[0] - box[0], part[1] - box[1], part[2] - box[0], part[3] - box[1]))
+    return composite_watermark_region(img, tile_part, (part[0] - origin[0], part[1] - origin[1], part[2] - origin[0], part[3] - origin[1]))
+
+def _patch_raw_image(path, info, tile, box):
+    # Rewrites, in place, only the stored rows of each strip/tile that the watermark block covers
+    bytes_per_pixel = len(info.layout[0][3])
+    with open(path, "r+b") as f:
+        for chunk_box, offset, stride, rawmode in info.layout:
+            left, top = max(box[0], chunk_box[0]), max(box[1], chunk_box[1])
+            right, bottom = min(box[2], chunk_box[2]), min(box[3], chunk_box[3])
+            if right <= left or bottom <= top: continue
+            row_offsets = [offset + (y - chunk_box[1]) * stride + (left - chunk_box[0]) * bytes_per_pixel for y in range(top, bottom)]
+            row_bytes = (right - left) * bytes_per_pixel
+            data = bytearray()
+            for row_offset in row_offsets:
+                f.seek(row_offset)
+                data += f.read(row_bytes)
+            region = Image.frombytes(info.mode, (right - left, bottom - top), bytes(data), "raw", rawmode)
+            data = _composite_part(region, (left, top), tile, box).tobytes("raw", rawmode)
+            for i, row_offset in enumerate(row_offsets):
+                f.seek(row_offset)
+                f.write(data[i * row_bytes:(i + 1) * row_bytes])
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)))
+
+def _iter_png_chunks(f):
+    f.seek(len(_PNG_SIGNATURE))
+    while True:
+        head = f.read(8)
+        if len(head) < 8: raise ValueError("PNG 文件不完整")
+        length, chunk_type = struct.unpack(">I4s", head)
+        data = f.read(length)
+        f.read(4) # CRC
+        yield chunk_type, data
+        if chunk_type == b"IEND": return
+
+def _unfilter_png_rows(info, rows, previous_row):
+    # Undoes the PNG row filters in C: the rows are wrapped in a small PNG, preceded by the previous
+    # (already reconstructed) row stored unfiltered so Up/Average/Paeth see the right values
+    color_type, _ = info.layout
+    data = (b"\x00" + previous_row if previous_row else b"") + b"".join(rows)
+    height = len(rows) + (1 if previous_row else 0)
+    png = (_PNG_SIGNATURE + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", info.width, height, 8, color_type, 0, 0, 0)) +
+           _png_chunk(b"IDAT", zlib.compress(data, 0)) + _png_chunk(b"IEND", b""))
+    strip = Image.open(io.BytesIO(png))
+    strip.load()
+    return strip.crop((0, 1, info.width, height)) if previous_row else strip
+
+def _stream_png(input_path, output_path, info, tile, box, compress_level=6, keep_metadata=True):
+    """Copies a PNG, re-filtering only the rows under the watermark block.
+
+    Rows are reconstructed strip by strip down to the block (filters depend on the row above). Rows above the
+    block keep their original filter bytes; the block and the row below it are written unfiltered.
+    Everything is recompressed on the fly. Returns the number of bytes written.
+    """
+    _, row_len = info.layout
+    top, bottom = box[1], box[3]
+    reconstruct_until = min(info.height, bottom + 1) if tile is not None else 0
+    strip_rows = max(1, _STRIP_BYTES // row_len)
+    decompressor, compressor = zlib.decompressobj(), zlib.compressobj(compress_level)
+    pending, compressed, rows = bytearray(), bytearray(), []
+    state = {"y": 0, "previous_row": None, "written": 0}
+
+    def emit(out, data, flush=False):
+        compressed.extend(compressor.compress(data))
+        if flush: compressed.extend(compressor.flush())
+        while len(compressed) >= _PNG_IDAT_BYTES or (flush and compressed):
+            out.write(_png_chunk(b"IDAT", bytes(compressed[:_PNG_IDAT_BYTES])))
+            del compressed[:_PNG_IDAT_BYTES]
+
+    def process_strip(out):
+        y0 = state["y"]
+        strip = _unfilter_png_rows(info, rows, state["previous_row"])
+        state["previous_row"] = strip.crop((0, strip.height - 1, info.width, strip.height)).tobytes()
+        first_changed = max(top, y0) - y0
+        for row in rows[:first_changed]: emit(out, row) # Above the block: original filtered bytes
+        if first_changed < len(rows):
+            changed = _composite_part(strip.crop((0, first_changed, info.width, strip.height)), (0, y0 + first_changed), tile, box)
+            raw = changed.tobytes()
+            for i in range(changed.height): emit(out, b"\x00" + raw[i * (row_len - 1):(i + 1) * (row_len - 1)])
+        state["y"] += len(rows)
+        rows.clear()
+
+    def take_rows(out):
+        while len(pending) >= row_len and state["y"] + len(rows) < info.height:
+            row = bytes(pending[:row_len])
+            del pending[:row_len]
+            if state["y"] + len(rows) < reconstruct_until:
+                rows.append(row)
+                if len(rows) == strip_rows or state["y"] + len(rows) == reconstruct_until: process_strip(out)
+            else:
+                emit(out, row) # Below the block: passed through
+                state["y"] += 1
+
+    with open(input_path, "rb") as f, open(output_path, "wb") as out:
+        out.write(_PNG_SIGNATURE)
+        in_idat = done_idat = False
+        for chunk_type, data in _iter_png_chunks(f):
+            if chunk_type == b"IDAT" and not done_idat:
+                in_idat = True
+                pending.extend(decompressor.decompress(data))
+                take_rows(out)
+                continue
+            if in_idat and not done_idat:
+                pending.extend(decompressor.flush())
+                take_rows(out)
+                if state["y"] != info.height: raise ValueError("PNG 图像数据不完整")
+                emit(out, b"", flush=True)
+                done_idat = True
+            if chunk_type in _PNG_METADATA_CHUNKS and not keep_metadata: continue
+            if chunk_type == b"eXIf": data = _upright_exif(data).removeprefix(b"Exif\x00\x00")
+            out.write(_png_chunk(chunk_type, data))
+        return out.tell()
+
+def watermark_large_image(image_path, output_path, info, title_text, location_text, timestamp_dt, anchor="bottom_right",
+                          padding=(10, 10), font_path="arial.ttf", base_font_size=20, log_callback=print, timer=None, encoder=None):
+    """Watermark an image described by `info` (see read_large_image_info) without decoding it whole. Returns the layout.
+
+    Only the watermark block is drawn; its position follows from the image size alone. Uncompressed BMP/TIFF
+    files are copied and the covered rows of each strip or tile are rewritten in place; PNGs are streamed
+    (see _stream_png). Peak memory depends on the image width and the block size, not on the image height.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    size = (info.width, info.height)
+    tile, box, layout = render_watermark(size, title_text, location_text, timestamp_dt, anchor, padding, font_path,
+                                         base_font_size, log_callback, timer)
+    output_dir = os.path.dirname(output_path)
+    if output_dir: os.makedirs(output_dir, exist_ok=True)
+    _unshare_output(output_path)
+    started = time.perf_counter()
+    if info.format == "PNG":
+        compress_level = ENCODER_PRESETS.get(encoder.preset, {}).get("PNG", {}).get("compress_level", 6)
+        with _stage(timer, "stream"): written = _stream_png(image_path, output_path, info, tile, box, compress_level, encoder.keep_metadata)
+        _record_encode(timer, encoder, "PNG", started, written)
+    else:
+        with _stage(timer, "copy"): shutil.copyfile(image_path, output_path)
+        if tile is not None:
+            with _stage(timer, "composite"): _patch_raw_image(output_path, info, tile, box)
+        written = os.path.getsize(output_path)
+    if timer:
+        timer.bytes_read += os.path.getsize(image_path)
+        timer.bytes_written += written
+    return layout
+
+# --- Core Watermarking Function with New Modern Style ---
+def apply_modern_watermark(
+        image_path,
+        output_path,
+        title_text, # New: Custom title
+        location_text,
+        timestamp_dt,
+        anchor="bottom_right",
+        padding=(10, 10),
+        font_path="arial.ttf",
+        base_font_size=20, # Base size for time/location
+        log_callback=print,
+        timer=None, # Optional StageTimer for per-stage timings
+        low_memory=False, # Encode straight to disk; used for images too large to buffer (see MemoryBudget)
+        profiles=None, # OutputProfiles to write from this one decode; default: output_path only, full size
+        encoder=None, # EncoderSettings (preset, keep EXIF/ICC); default: balanced preset with metadata
+        output_cache=None # OutputCache: identical input bytes with identical settings and timestamp are written from it
+):
+    try:
+        cache_keys = {}
+        if output_cache:
+            cache_keys, hit = _consult_output_cache(output_cache, image_path, output_path, profiles, timestamp_dt, encoder, timer,
+                                                    log_callback, title_text, location_text, anchor, padding, font_path, base_font_size)
+            if hit: return True
+        large_info = large_image_streamable(image_path, output_path, profiles, low_memory)
+        if large_info: # Too large to decode whole: strips/tiles, only the watermark rows are touched
+            output_path = profile_output_path(output_path, profiles[0]) if profiles else output_path
+            layout = watermark_large_image(image_path, output_path, large_info, title_text, location_text, timestamp_dt, anchor,
+                                           padding, font_path, base_font_size, log_callback, timer, encoder)
+            if output_path in cache_keys: _store_in_output_cache(output_cache, cache_keys[output_path], output_path, timer)
+            log_callback(f"现代样式水印已添加到: {output_path} (分块处理 {large_info.width}x{large_info.height}, "
+                         f"锚点: {layout.anchor}, 坐标: ({layout.final_x},{layout.final_y}))")
+            return True
+        profiles = profiles or (FULL_OUTPUT_PROFILE,)
+        img, full_size = decode_for_profiles(image_path, profiles, timer)
+        if timer: timer.bytes_read += os.path.getsize(image_path)
+        # Only the watermark block is blended; no full-frame overlay is allocated.
+        # Images are rebound at each step so at most two full-frame copies are alive at any time.
+        outputs = iter_profile_outputs(img, full_size, output_path, profiles, title_text, location_text, timestamp_dt,
+                                       anchor, padding, font_path, base_font_size, log_callback, timer)
+        del img
+        for path, out_img, layout, save_options in outputs:
+            with _stage(timer, "convert"): out_img = prepare_for_output(out_img, path)
+            save_watermarked_image(out_img, path, timer, low_memory, save_options, encoder)
+            if path in cache_keys: _store_in_output_cache(output_cache, cache_keys[path], path, timer)
+            log_callback(f"现代样式水印已添加到: {path} (锚点: {layout.anchor}, 坐标: ({layout.final_x},{layout.final_y}))")
+        return True
+
+    except Exception as e:
+        log_callback(f"处理图片 {image_path} 时出错: {e}\n{traceback.format_exc()}")
+        return False
+
+# --- Preview Rendering (proxy resolution) ---
+def scale_watermark_style(base_font_size, padding, scale):
+    # Font size and padding for drawing the same-looking watermark on an image resized by `scale`
+    return max(1, int(round(base_font_size * scale))), (int(round(padding[0] * scale)), int(round(padding[1] * scale)))
+
+def load_preview_proxy(image_path, max_size):
+    """Decode image_path just large enough to fit max_size. Returns (proxy, scale), scale = proxy width / full width."""
+    with Image.open(image_path) as img:
+        full_width = img.width
+        if img.format == "JPEG": img.draft("RGB", max_size) # DCT scaling: decode at 1/2, 1/4 or 1/8 resolution
+        img.load()
+        proxy = img.copy() if img.width <= max_size[0] and img.height <= max_size[1] else img
+        proxy.thumbnail(max_size, Image.BILINEAR)
+    return proxy, proxy.width / full_width
+
+def render_preview_overlay(proxy_size, scale, title_text, location_text, timestamp_dt, anchor, padding, font_path, base_font_size):
+    """Watermark tile for a preview proxy of proxy_size, drawn over the proxy instead of into it. Returns (tile, box)."""
+    preview_font_size, preview_padding = scale_watermark_style(base_font_size, padding, scale)
+    tile, box, _ = render_watermark(proxy_size, title_text, location_text, timestamp_dt, anchor, preview_padding,
+                                    font_path, preview_font_size, log_callback=lambda message: None)
+    return tile, box
+
+# --- Font Discovery ---
+def find_font_path(log_callback=print): # Module level so the headless engine can share it with the GUI
+    if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
+        base_path = sys._MEIPASS
+    else:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+
+    font_path = _font_path_cache.get(base_path)
+    if font_path is None: # Probe once; later calls (e.g. every preview refresh) reuse the result
+        font_path = _probe_font_path(base_path, log_callback)
+        _font_path_cache.put(base_path, font_path)
+    return font_path
+
+def _probe_font_path(base_path, log_callback):
+    bundled_font_paths = [os.path.join(base_path, "msyh.ttc"), os.path.join(base_path, "arial.ttf")]
+    for font_path in bundled_font_paths:
+        if os.path.exists(font_path):
+            if get_font(font_path, 10) is not None: return font_path
+            log_callback(f"捆绑字体 {font_path} 存在但加载失败。")
+
+    if os.name == 'nt':
+        system_font_paths = ["C:/Windows/Fonts/msyh.ttc", "C:/Windows/Fonts/simsun.ttc", "C:/Windows/Fonts/arialuni.ttf", "C:/Windows/Fonts/arial.ttf"]
+        for font_path in system_font_paths:
+            if os.path.exists(font_path):
+                if get_font(font_path, 10) is not None: return font_path
+    # Add more OS-specific font paths if needed for Linux/macOS packaging
+    log_callback("警告: 未找到合适的字体，将回退到Pillow的默认字体。")
+    return "arial.ttf" # Default fallback
+
+# --- Headless Batch Engine (no Qt, multi-process) ---
+SUPPORTED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+# Random seconds added between consecutive images, keyed by increment code
+TIME_INCREMENT_RANGES = {
+    "1min": (61, 89),
+    "none": None,
+    "2min": (117, 139),
+    "5min": (311, 325),
+    "10min": (607, 611),
+    "random_1_5min": (60, 300),
+}
+
+BatchJob = collections.namedtuple("BatchJob", "input_path output_path timestamp_dt")
+BatchResult = collections.namedtuple("BatchResult", "input_path output_path timestamp_dt success messages skipped "
+                                     "stages bytes_read bytes_written encodes cache cache_evictions",
+                                     defaults=(False, None, 0, 0, None, None, 0))
+
+def next_batch_timestamp(current_dt, increment, rng=random):
+    seconds_range = TIME_INCREMENT_RANGES.get(increment)
+    if not seconds_range: return current_dt
+    return current_dt + datetime.timedelta(seconds=rng.randint(*seconds_range))
+
+def iter_batch_jobs(image_paths, input_folder, output_folder, base_timestamp_dt, increment="1min", rng=random, journal=None, fingerprint=None,
+                    timestamp_source="sequence", metadata_index=None):
+    # Timestamps are assigned here, in file order, before any work is dispatched.
+    # This reproduces the exact sequence of the old serial loop regardless of which worker finishes first.
+    # Files already recorded in the journal for the same run settings keep their recorded timestamp,
+    # and the sequence continues from there. With timestamp_source="exif" each photo's own capture time
+    # is used, and the increment scheme only fills in for photos without one. Outputs mirror the input tree.
+    current_timestamp_dt = base_timestamp_dt
+    for i, input_path in enumerate(image_paths):
+        output_path = os.path.join(output_folder, os.path.relpath(input_path, input_folder))
+        recorded_dt = journal.recorded_timestamp(output_path, fingerprint) if journal else None
+        capture_dt = None
+        if not recorded_dt and timestamp_source == "exif":
+            capture_dt = metadata_index.capture_time(input_path) if metadata_index else read_capture_time(input_path)
+        if recorded_dt or capture_dt: current_timestamp_dt = recorded_dt or capture_dt
+        elif i > 0: current_timestamp_dt = next_batch_timestamp(current_timestamp_dt, increment, rng)
+        yield BatchJob(input_path, output_path, current_timestamp_dt)
+
+def build_batch_jobs(input_folder, output_folder, base_timestamp_dt, increment="1min", rng=random, journal=None, fingerprint=None,
+                     timestamp_source="sequence", metadata_index=None, **scan_options):
+    image_paths = iter_image_files(input_folder, skip_dirs=[output_folder], metadata_index=metadata_index, **scan_options)
+    return list(iter_batch_jobs(image_paths, input_folder, output_folder, base_timestamp_dt, increment, rng, journal, fingerprint,
+                                timestamp_source, metadata_index))
+
+# --- Directory Scanning ---
+SCAN_ORDERS = ("name", "mtime", "capture_time", "none")
+
+def _matches_any(rel_path, name, patterns):
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+def _walk_image_entries(folder, rel_folder, recursive, include, exclude, sort_names, skip_dirs):
+    try: entries = list(os.scandir(folder))
+    except OSError: return # Unreadable subfolder: skip it rather than abort the batch
+    if sort_names: entries.sort(key=lambda entry: (entry.name.casefold(), entry.name))
+    for entry in entries:
+        rel_path = f"{rel_folder}/{entry.name}" if rel_folder else entry.name
+        try: is_dir = entry.is_dir()
+        except OSError: continue
+        if is_dir:
+            if recursive and not _matches_any(rel_path, entry.name, exclude) and os.path.realpath(entry.path) not in skip_dirs:
+                yield from _walk_image_entries(entry.path, rel_path, recursive, include, exclude, sort_names, skip_dirs)
+        elif entry.name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+            if include and not _matches_any(rel_path, entry.name, include): continue
+            if exclude and _matches_any(rel_path, entry.name, exclude): continue
+            yield entry
+
+# --- Image Metadata (header-only, with a persistent SQLite index) ---
+DEFAULT_METADATA_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".cache", "auto_photo_watermarker", "metadata.sqlite3")
+TIMESTAMP_SOURCES = ("sequence", "exif")
+
+ImageHeader = collections.namedtuple("ImageHeader", "width height mode format capture_time")
+
+def _parse_exif_datetime(value):
+    if not value: return None
+    try: return datetime.datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError: return None # e.g. "0000:00:00 00:00:00" from some cameras
+
+def read_image_header(path):
+    # Image.open only parses the header; pixels are never decoded here. `path` may also be a binary file object.
+    try: img = Image.open(path)
+    except Image.DecompressionBombError: # Beyond Pillow's size limit: only strip processing can handle it anyway
+        # Strip processing reads files by path, so an oversized file object (e.g. an archive member) is simply unsupported
+        info = read_large_image_info(path) if isinstance(path, (str, os.PathLike)) else None
+        if info is None: raise ValueError(f"图片过大且不支持分块处理: {getattr(path, 'name', path)}")
+        return ImageHeader(info.width, info.height, info.mode, info.format, None)
+    with img:
+        exif = img.getexif()
+        capture_time = _parse_exif_datetime(exif.get_ifd(0x8769).get(36867) or exif.get(306)) # DateTimeOriginal, else DateTime
+        return ImageHeader(img.width, img.height, img.mode, img.format, capture_time)
+
+def read_capture_time(path):
+    try: return read_image_header(path).capture_time
+    except (OSError, SyntaxError, ValueError): return None
+
+class MetadataIndex:
+    """Persistent cache of image headers keyed by absolute path and validated by size + mtime.
+
+    Repeat scans of a large folder (sorting by capture time, EXIF timestamps, memory estimates) then
+    only stat the files instead of opening them.
+    """
+    _COMMIT_EVERY = 500
+
+    def __init__(self, path=DEFAULT_METADATA_INDEX_PATH):
+        import sqlite3
+        self.path = path
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        # Shared by the scanner and pipeline reader threads; every access goes through _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS headers (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                               "width INTEGER, height INTEGER, mode TEXT, format TEXT, capture_time TEXT)")
+            self._conn.commit()
+
+    def header(self, path, stat_result=None):
+        """ImageHeader for path (None if it cannot be read), from the index when the file is unchanged."""
+        path = os.path.abspath(path)
+        try: st = stat_result or os.stat(path)
+        except OSError: return None
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, width, height, mode, format, capture_time FROM headers WHERE path = ?",
+                                     (path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                self.hits += 1
+                return ImageHeader(row[2], row[3], row[4], row[5], datetime.datetime.fromisoformat(row[6]) if row[6] else None)
+            self.misses += 1
+
+        try: header = read_image_header(path)
+        except (OSError, SyntaxError, ValueError): return None
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (path, st.st_size, st.st_mtime_ns, header.width, header.height, header.mode, header.format,
+                                header.capture_time.isoformat() if header.capture_time else None))
+            self._uncommitted += 1
+            if self._uncommitted >= self._COMMIT_EVERY: self._conn.commit(); self._uncommitted = 0
+        return header
+
+    def capture_time(self, path, stat_result=None):
+        header = self.header(path, stat_result)
+        return header.capture_time if header else None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+def iter_image_files(input_folder, recursive=True, include=None, exclude=None, order="name", skip_dirs=(), metadata_index=None):
+    """Yield supported image paths under input_folder, optionally filtered by include/exclude globs.
+
+    "name" (path order) and "none" (filesystem order) stream results while the scan is still running;
+    "mtime" and "capture_time" have to list everything before sorting. Globs are matched against both the
+    file name and the path relative to input_folder (with "/" separators); excluded folders are pruned.
+    Capture times come from metadata_index when given, so re-sorting a known folder does not reopen files.
+    """
+    if order not in SCAN_ORDERS: raise ValueError(f"未知的排序方式: {order}")
+    skip_dirs = {os.path.realpath(d) for d in skip_dirs} - {os.path.realpath(input_folder)}
+    entries = _walk_image_entries(input_folder, "", recursive, include or (), exclude or (), order == "name", skip_dirs)
+    if order in ("name", "none"): return (entry.path for entry in entries)
+
+    keyed = []
+    for entry in entries:
+        st = entry.stat()
+        sort_time = st.st_mtime
+        if order == "capture_time":
+            capture_dt = metadata_index.capture_time(entry.path, st) if metadata_index else read_capture_time(entry.path)
+            if capture_dt: sort_time = capture_dt.timestamp()
+        keyed.append((sort_time, entry.path.casefold(), entry.path))
+    keyed.sort()
+    return iter([path for _, _, path in keyed])
+
+# --- Batch Journal (resumable, incremental runs) ---
+JOURNAL_FILENAME = ".watermark_journal.jsonl"
+
+def watermark_fingerprint(title_text, location_text, anchor, padding, font_path, base_font_size, base_timestamp_dt, increment,
+                          timestamp_source="sequence", profiles=None, encoder=None):
+    # Identifies a batch configuration; journal records are only reused by runs with the same fingerprint
+    fields = [title_text, location_text, anchor, list(padding), font_path, base_font_size, base_timestamp_dt.isoformat(), increment]
+    if timestamp_source != "sequence": fields.append(timestamp_source) # Keeps fingerprints of older journals valid
+    if profiles: fields.append([list(profile) for profile in profiles])
+    if encoder and encoder != DEFAULT_ENCODER: fields.append(list(encoder))
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def _file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+class BatchJournal:
+    """Append-only JSON-lines log of batch runs, kept in the output folder.
+
+    Each file gets a "planned" record with its assigned timestamp when it is dispatched, so a resumed run
+    reuses that timestamp even if later files finished first. Once processed, the record adds its input
+    size/mtime (and optionally sha256) and the output's size/mtime. The newest record per output wins.
+    With output profiles, the output checked is the one written for the first profile.
+    """
+    def __init__(self, output_folder, use_hash=False, profiles=None):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, JOURNAL_FILENAME)
+        self.use_hash = use_hash
+        self.primary_profile = profiles[0] if profiles else None
+        self.records = {}
+        self.runs = []
+        self._line_count = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                self._line_count += 1
+                try: entry = json.loads(line)
+                except ValueError: continue # Torn last line after an interrupted run
+                if entry.get("type") == "run": self.runs.append(entry)
+                elif entry.get("type") == "file": self.records[entry["key"]] = entry
+
+    def key(self, output_path):
+        return os.path.relpath(output_path, self.output_folder).replace(os.sep, "/")
+
+    def last_run(self):
+        return self.runs[-1] if self.runs else None
+
+    def _primary_output(self, job):
+        return profile_output_path(job.output_path, self.primary_profile) if self.primary_profile else job.output_path
+
+    def recorded_timestamp(self, output_path, fingerprint=None):
+        # fingerprint=None accepts a record from any run settings
+        record = self.records.get(self.key(output_path))
+        if record and fingerprint in (None, record["fingerprint"]): return datetime.datetime.fromisoformat(record["timestamp"])
+        return None
+
+    def latest_timestamp(self):
+        timestamps = [record["timestamp"] for record in self.records.values()]
+        return datetime.datetime.fromisoformat(max(timestamps)) if timestamps else None
+
+    def is_up_to_date(self, job, fingerprint):
+        record = self.records.get(self.key(job.output_path))
+        if not record or record["fingerprint"] != fingerprint or record["status"] != "ok": return False
+        if record["timestamp"] != job.timestamp_dt.isoformat(): return False
+        try: in_stat, out_stat = os.stat(job.input_path), os.stat(self._primary_output(job))
+        except OSError: return False
+        if (out_stat.st_size, out_stat.st_mtime_ns) != (record["output_size"], record["output_mtime_ns"]): return False
+        if (in_stat.st_size, in_stat.st_mtime_ns) == (record["input_size"], record["input_mtime_ns"]): return True
+        # Touched but maybe unchanged: compare content hashes when enabled, and refresh the stat fields on a match
+        if not (self.use_hash and record.get("input_sha256") and in_stat.st_size == record["input_size"]): return False
+        if _file_sha256(job.input_path) != record["input_sha256"]: return False
+        self._append(dict(record, input_mtime_ns=in_stat.st_mtime_ns))
+        return True
+
+    def start_run(self, fingerprint, base_timestamp_dt, increment, timestamp_source="sequence"):
+        with self._lock:
+            if self._line_count > 2 * (len(self.records) + 1): self._compact()
+        self._append({"type": "run", "fingerprint": fingerprint, "base_timestamp": base_timestamp_dt.isoformat(),
+                      "increment": increment, "timestamp_source": timestamp_source,
+                      "started": datetime.datetime.now().isoformat(timespec="seconds")})
+
+    def plan(self, job, fingerprint):
+        record = self.records.get(self.key(job.output_path))
+        if record and record["fingerprint"] == fingerprint and record["timestamp"] == job.timestamp_dt.isoformat(): return
+        self._append({"type": "file", "key": self.key(job.output_path), "input": job.input_path, "fingerprint": fingerprint,
+                      "timestamp": job.timestamp_dt.isoformat(), "status": "planned"})
+
+    def record(self, job, fingerprint, success):
+        entry = {"type": "file", "key": self.key(job.output_path), "input": job.input_path, "fingerprint": fingerprint,
+                 "timestamp": job.timestamp_dt.isoformat(), "status": "ok" if success else "failed"}
+        try:
+            in_stat = os.stat(job.input_path)
+            entry.update(input_size=in_stat.st_size, input_mtime_ns=in_stat.st_mtime_ns)
+            if self.use_hash: entry["input_sha256"] = _file_sha256(job.input_path)
+            if success:
+                out_stat = os.stat(self._primary_output(job))
+                entry.update(output_size=out_stat.st_size, output_mtime_ns=out_stat.st_mtime_ns)
+        except OSError:
+            entry["status"] = "failed"
+        self._append(entry)
+
+    def _append(self, entry):
+        with self._lock:
+            if self._file is None: self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush() # One line per file, so an interrupted run loses at most the file in flight
+            self._line_count += 1
+            if entry["type"] == "run": self.runs.append(entry)
+            else: self.records[entry["key"]] = entry
+
+    def _compact(self):
+        # Rewrite the journal with only the newest record per output (called with the lock held)
+        if self._file: self._file.close(); self._file = None
+        entries = self.runs[-1:] + list(self.records.values())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries: f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self.runs = self.runs[-1:]
+        self._line_count = len(entries)
+
+    def close(self):
+        with self._lock:
+            if self._file: self._file.close(); self._file = None
+
+# --- Output Cache (content-addressed, for photos submitted more than once) ---
+DEFAULT_OUTPUT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "auto_photo_watermarker", "outputs")
+DEFAULT_OUTPUT_CACHE_BYTES = 2 * 1024 ** 3
+_OUTPUT_CACHE_VERSION = 1 # Part of every key: bump when rendering or encoding changes so older outputs are never reused
+
+def output_cache_key(input_sha256, output_path, timestamp_dt, title_text, location_text, anchor="bottom_right", padding=(10, 10),
+                     font_path="arial.ttf", base_font_size=20, profile=None, encoder=None):
+    # Everything that decides the output bytes: input content, watermark settings, assigned timestamp, size, format and encoder.
+    # The file names and the profile name are not part of it, so renamed or copied photos share one entry.
+    profile = profile or FULL_OUTPUT_PROFILE
+    fields = [_OUTPUT_CACHE_VERSION, input_sha256, output_format_for_path(output_path), timestamp_dt.isoformat(), title_text,
+              location_text, anchor, list(padding), font_path, base_font_size, [profile.max_size, profile.quality],
+              list(encoder or DEFAULT_ENCODER)]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _unshare_output(path):
+    # Outputs served from the OutputCache may be hardlinks to a cache entry: never write through one in place
+    try:
+        if os.stat(path).st_nlink > 1: os.remove(path)
+    except OSError: pass
+
+_open_output_caches = {} # (directory, max_bytes, link) -> OutputCache, one per process
+
+def _shared_output_cache(directory, max_bytes, link):
+    key = (directory, max_bytes, link)
+    if key not in _open_output_caches: _open_output_caches[key] = OutputCache(directory, max_bytes, link)
+    return _open_output_caches[key]
+
+class OutputCache:
+    """Finished outputs keyed by output_cache_key, so a photo that was processed before (under any name, in any
+    folder) with the same settings and timestamp is written again without being decoded.
+
+    Entries are plain files under `directory`, listed in a SQLite index with their size, mtime and last use; an
+    entry whose file no longer matches is dropped. Once the entries add up to more than max_bytes, the least
+    recently used are deleted. Hits are hardlinked into place (link=False, or another file system: copied).
+    Pickles to its settings and reopens once per worker process, so it can be passed to run_batch's process pool.
+    """
+    def __init__(self, directory=DEFAULT_OUTPUT_CACHE_PATH, max_bytes=DEFAULT_OUTPUT_CACHE_BYTES, link=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def __reduce__(self):
+        return _shared_output_cache, (self.directory, self.max_bytes, self.link)
+
+    def _db(self):
+        # Opened on first use, with _lock held. Autocommit: other processes share the index, so no write lock is kept
+        if self._conn is None:
+            import sqlite3
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, last_used REAL)")
+        return self._conn
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _drop(self, db, key):
+        db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        entry_path = self._entry_path(key)
+        with contextlib.suppress(OSError): os.remove(entry_path)
+        with contextlib.suppress(OSError): os.rmdir(os.path.dirname(entry_path)) # Only succeeds once the shard is empty
+
+    def fetch(self, outputs):
+        """Write every (key, output_path) from the cache. Returns False, and counts a miss, unless all of them are cached."""
+        with self._lock:
+            db = self._db()
+            for key, _ in outputs:
+                row = db.execute("SELECT size, mtime_ns FROM entries WHERE key = ?", (key,)).fetchone()
+                try: st = os.stat(self._entry_path(key)) if row else None
+                except OSError: st = None
+                if not st or (st.st_size, st.st_mtime_ns) != tuple(row): # Missing, or edited in place through a hardlinked output
+                    if row: self._drop(db, key)
+                    self.misses += 1
+                    return False
+            db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(time.time(), key) for key, _ in outputs])
+        try:
+            for key, output_path in outputs: self._materialize(self._entry_path(key), output_path)
+        except OSError: # Evicted by another process in the meantime: the caller writes the outputs itself
+            with self._lock: self.misses += 1
+            return False
+        with self._lock: self.hits += 1
+        return True
+
+    def _materialize(self, entry_path, output_path):
+        output_dir = os.path.dirname(output_path)
+        if output_dir: os.makedirs(output_dir, exist_ok=True)
+        temp_path = output_path + ".cache-part"
+        with contextlib.suppress(FileNotFoundError): os.remove(temp_path)
+        if self.link:
+            try: os.link(entry_path, temp_path); os.replace(temp_path, output_path); return
+            except FileNotFoundError: raise
+            except OSError: # Other file system, or no hardlinks there
+                with contextlib.suppress(FileNotFoundError): os.remove(temp_path)
+        shutil.copyfile(entry_path, temp_path)
+        os.replace(temp_path, output_path)
+
+    def store(self, key, output_path):
+        """Copy a freshly written output into the cache, then evict least recently used entries over max_bytes.
+        Returns the number of entries evicted.
+
+        Best effort: if the copy fails (e.g. the cache disk is full) nothing is stored; the output itself is unaffected.
+        """
+        entry_path = self._entry_path(key)
+        temp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            shutil.copyfile(output_path, temp_path) # A copy, not a link: the output may be rewritten by a later run
+            os.replace(temp_path, entry_path)
+            st = os.stat(entry_path)
+        except OSError:
+            with contextlib.suppress(OSError): os.remove(temp_path)
+            return 0
+        evicted = 0
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, st.st_size, st.st_mtime_ns, time.time()))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes: break
+                    self._drop(db, old_key)
+                    total -= size
+                    evicted += 1
+            self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        # hits, misses and evictions count this object's calls only; worker processes keep their own (see BatchMetrics)
+        with self._lock: entries, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions, "entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None: self._conn.close(); self._conn = None
+
+def _store_in_output_cache(output_cache, key, output_path, timer):
+    evicted = output_cache.store(key, output_path)
+    if timer: timer.cache_evictions += evicted
+
+def _consult_output_cache(output_cache, image_path, output_path, profiles, timestamp_dt, encoder, timer, log_callback,
+                          title_text, location_text, anchor="bottom_right", padding=(10, 10), font_path="arial.ttf", base_font_size=20):
+    """Returns ({output path: cache key}, hit). On a hit, every output of the job has been written from the cache."""
+    with _stage(timer, "hash"): input_sha256 = _file_sha256(image_path)
+    if timer: timer.bytes_read += os.path.getsize(image_path)
+    entries = [(output_cache_key(input_sha256, path, timestamp_dt, title_text, location_text, anchor, padding, font_path,
+                                 base_font_size, profile, encoder), path)
+               for profile in profiles or (FULL_OUTPUT_PROFILE,) for path in [profile_output_path(output_path, profile)]]
+    with _stage(timer, "cache"): hit = output_cache.fetch(entries)
+    if timer: timer.cache = "hit" if hit else "miss"
+    if hit:
+        for _, path in entries:
+            if timer: timer.bytes_written += os.path.getsize(path)
+            log_callback(f"已从输出缓存写入: {path} (与之前处理过的图片内容和设置相同)")
+    return {path: key for key, path in entries}, hit
+
+# --- Memory-Budgeted Scheduling ---
+_BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16L": 2, "I;16B": 2} # Pillow stores RGB, RGBA, CMYK, LA, I, F... in 4 bytes
+_MEMORY_OVERHEAD = 8 * 1024 * 1024 # Fonts, tiles, decoder state
+
+def estimate_job_memory(header, output_path, input_size=0, low_memory=False):
+    """Rough peak bytes needed to watermark one image, from its header (ImageHeader) alone."""
+    pixels = header.width * header.height
+    decoded = pixels * _BYTES_PER_PIXEL.get(header.mode, 4)
+    has_alpha = header.mode in ("RGBA", "LA", "PA", "P")
+    working = 0 if header.mode in ("RGB", "RGBA") else pixels * 4 # Conversion to RGB/RGBA
+    jpeg_output = output_path.lower().endswith(('.jpg', '.jpeg'))
+    out_convert = pixels * 4 if jpeg_output and has_alpha else 0
+    # The source is released after each conversion, so only two full frames coexist at any step
+    peak = max(decoded + working, (working or decoded) + out_convert)
+    if not low_memory:
+        peak += input_size # Pipeline readers hold the file bytes while decoding
+        peak += pixels * 3 // (8 if jpeg_output else 1) # Encoded output buffered in memory
+    return peak + _MEMORY_OVERHEAD
+
+def default_memory_budget():
+    # Half of physical memory where the OS reports it, otherwise unlimited
+    try: return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+    except (AttributeError, ValueError, OSError): return None
+
+def parse_size(text):
+    # "512M", "4G", "1500000000" -> bytes
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    text = str(text).strip().upper().rstrip("B")
+    return int(float(text[:-1]) * units[text[-1]]) if text and text[-1] in units else int(text)
+
+class MemoryBudget:
+    """Admits jobs while the sum of their estimated footprints stays under budget_bytes.
+
+    A job larger than the whole budget is admitted only when nothing else is running, and nothing else is
+    admitted until it finishes. Waiters are served in arrival order so large jobs are not starved.
+    """
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.oversized = 0
+        self._waiting = collections.deque()
+        self._cond = threading.Condition()
+
+    def is_oversized(self, cost):
+        return cost > self.budget
+
+    def _admit(self, cost):
+        if self.in_use and self.in_use + cost > self.budget: return False
+        self.in_use += cost
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        if self.is_oversized(cost): self.oversized += 1
+        return True
+
+    def try_acquire(self, cost):
+        with self._cond:
+            return not self._waiting and self._admit(cost)
+
+    def acquire(self, cost):
+        with self._cond:
+            ticket = object()
+            self._waiting.append(ticket)
+            self._cond.wait_for(lambda: self._waiting[0] is ticket and (not self.in_use or self.in_use + cost <= self.budget))
+            self._waiting.popleft()
+            self._admit(cost)
+            self._cond.notify_all()
+
+    def release(self, cost):
+        with self._cond:
+            self.in_use -= cost
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"budget_bytes": self.budget, "peak_in_use_bytes": self.peak_in_use, "oversized_jobs": self.oversized}
+
+def plan_job_memory(job, budget, metadata_index=None, profiles=None):
+    """(estimated bytes, low_memory) for a job. Oversized jobs switch to strip processing where the input
+    allows it (see large_image_streamable), otherwise to the reduced-copy path."""
+    try:
+        input_size = os.path.getsize(job.input_path)
+        header = metadata_index.header(job.input_path) if metadata_index else read_image_header(job.input_path)
+    except (OSError, SyntaxError, ValueError):
+        header = None
+    if header is None: return _MEMORY_OVERHEAD, False # Unreadable: the worker will report the error
+    cost = estimate_job_memory(header, job.output_path, input_size)
+    if budget.is_oversized(cost) or header.width * header.height > LARGE_IMAGE_PIXELS:
+        large_info = large_image_streamable(job.input_path, job.output_path, profiles, low_memory=True)
+        if large_info: return estimate_streaming_memory(large_info), True
+    if budget.is_oversized(cost): return estimate_job_memory(header, job.output_path, input_size, low_memory=True), True
+    return cost, False
+
+def _run_batch_job(job, watermark_kwargs, low_memory=False):
+    # Runs inside a worker process: collect log lines and hand them back to the parent with the result
+    messages = []
+    timer = StageTimer()
+    success = apply_modern_watermark(job.input_path, job.output_path, timestamp_dt=job.timestamp_dt,
+                                     log_callback=messages.append, timer=timer, low_memory=low_memory, **watermark_kwargs)
+    return BatchResult(job.input_path, job.output_path, job.timestamp_dt, success, messages,
+                       stages=timer.stages, bytes_read=timer.bytes_read, bytes_written=timer.bytes_written, encodes=timer.encodes,
+                       cache=timer.cache, cache_evictions=timer.cache_evictions)
+
+# --- Pipelined Engine (read/decode -> render/encode -> write threads) ---
+_PIPELINE_STOP = object()
+
+def _start_stage_threads(name, count, loop, on_all_done):
+    # Starts `count` threads running `loop`; the last one to finish calls on_all_done()
+    remaining = [count]
+    lock = threading.Lock()
+
+    def run():
+        try: loop()
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last: on_all_done()
+
+    for i in range(count): threading.Thread(target=run, name=f"watermark-{name}-{i}", daemon=True).start()
+
+def iter_pipeline_results(planned_jobs, watermark_kwargs, readers=2, renderers=None, writers=2, queue_size=4,
+                          memory_budget=None, metadata_index=None):
+    """Process (index, job, skip) items through a threaded decode -> render/encode -> write pipeline.
+
+    Yields (index, job, BatchResult) as outputs are written; skipped jobs are passed straight through.
+    `planned_jobs` is consumed lazily by the reader threads, so a streaming scan overlaps with processing;
+    an exception raised by it is re-raised here after the images already read have been written.
+    The render threads encode each output as soon as it is drawn, so only encoded bytes wait for the writers and
+    the decoded images held in memory are capped at roughly queue_size + renderers; with a MemoryBudget, readers
+    also wait until the estimated
+    footprint of the next image fits. Pillow releases the GIL while decoding and encoding, so file
+    I/O, codecs and drawing overlap.
+    """
+    renderers = renderers or os.cpu_count() or 1
+    watermark_kwargs = dict(watermark_kwargs)
+    profiles = watermark_kwargs.pop("profiles", None) or (FULL_OUTPUT_PROFILE,)
+    encoder = watermark_kwargs.pop("encoder", None)
+    output_cache = watermark_kwargs.pop("output_cache", None)
+    import queue
+    feed = iter(planned_jobs)
+    feed_lock = threading.Lock()
+    decoded_q = queue.Queue(maxsize=queue_size)
+    rendered_q = queue.Queue(maxsize=queue_size)
+    results_q = queue.Queue()
+    reserved = {} # index -> (bytes reserved in memory_budget, low_memory)
+    cache_keys = {} # index -> {output path: OutputCache key}
+    feed_errors = [] # Raised by planned_jobs itself (e.g. a failing scan): re-raised once the images in flight are done
+
+    def result(index, job, success, messages, timer):
+        cost, _ = reserved.pop(index, (0, False))
+        cache_keys.pop(index, None)
+        if memory_budget: memory_budget.release(cost)
+        return index, job, BatchResult(job.input_path, job.output_path, job.timestamp_dt, success, messages,
+                                       stages=timer.stages, bytes_read=timer.bytes_read, bytes_written=timer.bytes_written,
+                                       encodes=timer.encodes, cache=timer.cache, cache_evictions=timer.cache_evictions)
+
+    def fail(index, job, messages, timer, e):
+        messages.append(f"处理图片 {job.input_path} 时出错: {e}\n{traceback.format_exc()}")
+        results_q.put(result(index, job, False, messages, timer))
+
+    def read_loop():
+        while True:
+            try:
+                with feed_lock: item = next(feed, None)
+            except Exception as e:
+                feed_errors.append(e)
+                return
+            if item is None: return
+            index, job, skip = item
+            if skip: results_q.put((index, job, _skipped_result(job))); continue
+            messages, timer = [], StageTimer()
+            try:
+                if output_cache:
+                    cache_keys[index], hit = _consult_output_cache(output_cache, job.input_path, job.output_path, profiles, job.timestamp_dt,
+                                                                   encoder, timer, messages.append, **watermark_kwargs)
+                    if hit: results_q.put(result(index, job, True, messages, timer)); continue
+                low_memory = False
+                if memory_budget:
+                    cost, low_memory = reserved[index] = plan_job_memory(job, memory_budget, metadata_index, profiles)
+                    with timer.stage("wait_memory"): memory_budget.acquire(cost)
+                large_info = large_image_streamable(job.input_path, job.output_path, profiles, low_memory)
+                if large_info: # Processed in strips right here; nothing full-size goes through the queues
+                    output_path = profile_output_path(job.output_path, profiles[0])
+                    layout = watermark_large_image(job.input_path, output_path, large_info, timestamp_dt=job.timestamp_dt,
+                                                   log_callback=messages.append, timer=timer, encoder=encoder, **watermark_kwargs)
+                    if output_path in cache_keys.get(index, ()): _store_in_output_cache(output_cache, cache_keys[index][output_path], output_path, timer)
+                    messages.append(f"现代样式水印已添加到: {output_path} (分块处理 {large_info.width}x{large_info.height}, "
+                                    f"锚点: {layout.anchor}, 坐标: ({layout.final_x},{layout.final_y}))")
+                    results_q.put(result(index, job, True, messages, timer))
+                    continue
+                if low_memory: # Let the decoder read from disk instead of holding the file bytes as well
+                    img, full_size = decode_for_profiles(job.input_path, profiles, timer)
+                    timer.bytes_read += os.path.getsize(job.input_path)
+                else:
+                    with timer.stage("read"):
+                        with open(job.input_path, "rb") as f: data = f.read()
+                    timer.bytes_read += len(data)
+                    img, full_size = decode_for_profiles(io.BytesIO(data), profiles, timer)
+                    del data
+                decoded_q.put((index, job, img, full_size, messages, timer))
+            except Exception as e: fail(index, job, messages, timer, e)
+
+    def render_loop():
+        while True:
+            item = decoded_q.get()
+            if item is _PIPELINE_STOP: return
+            index, job, img, full_size, messages, timer = item
+            try:
+                low_memory = reserved.get(index, (0, False))[1]
+                encoded = [] # (path, bytes or None when already written, layout)
+                for path, sized, layout, save_options in iter_profile_outputs(img, full_size, job.output_path, profiles,
+                                                                              timestamp_dt=job.timestamp_dt, log_callback=messages.append,
+                                                                              timer=timer, **watermark_kwargs):
+                    if low_memory: # Streamed to the file right away instead of holding the encoded output
+                        save_watermarked_image(sized, path, timer, True, save_options, encoder)
+                        encoded.append((path, None, layout))
+                        continue
+                    with timer.stage("convert"): sized = prepare_for_output(sized, path)
+                    with timer.stage("encode"): encoded.append((path, encode_watermarked_image(sized, path, save_options, encoder, timer), layout))
+                del img, sized
+                rendered_q.put((index, job, encoded, messages, timer))
+            except Exception as e: fail(index, job, messages, timer, e)
+
+    def write_loop():
+        while True:
+            item = rendered_q.get()
+            if item is _PIPELINE_STOP: return
+            index, job, encoded, messages, timer = item
+            try:
+                while encoded:
+                    path, data, layout = encoded.pop(0)
+                    if data is not None: write_output_bytes(path, data, timer)
+                    del data
+                    if path in cache_keys.get(index, ()): _store_in_output_cache(output_cache, cache_keys[index][path], path, timer)
+                    messages.append(f"现代样式水印已添加到: {path} (锚点: {layout.anchor}, 坐标: ({layout.final_x},{layout.final_y}))")
+                results_q.put(result(index, job, True, messages, timer))
+            except Exception as e: fail(index, job, messages, timer, e)
+
+    _start_stage_threads("write", writers, write_loop, lambda: results_q.put(_PIPELINE_STOP))
+    _start_stage_threads("render", renderers, render_loop, lambda: [rendered_q.put(_PIPELINE_STOP) for _ in range(writers)])
+    _start_stage_threads("read", readers, read_loop, lambda: [decoded_q.put(_PIPELINE_STOP) for _ in range(renderers)])
+
+    while True:
+        item = results_q.get()
+        if item is _PIPELINE_STOP: break
+        yield item
+    if feed_errors: raise feed_errors[0]
+
+def _skipped_result(job):
+    return BatchResult(job.input_path, job.output_path, job.timestamp_dt, True, [], skipped=True)
+
+def _failed_result(job, e):
+    return BatchResult(job.input_path, job.output_path, job.timestamp_dt, False, [f"处理图片 {job.input_path} 时出错: {e}"])
+
+def _future_result(future, job):
+    try: return future.result()
+    except Exception as e: return _failed_result(job, e) # e.g. a worker process died
+
+def run_batch(jobs, title_text, location_text, anchor="bottom_right", padding=(10, 10),
+              font_path="arial.ttf", base_font_size=20, workers=None, log_callback=print, result_callback=None,
+              journal=None, fingerprint=None, engine="process", pipeline_options=None, metrics=None,
+              memory_budget=None, metadata_index=None, profiles=None, encoder=None, stop_event=None, output_cache=None):
+    """Watermark every job, spreading the work over a process pool. Returns BatchResults in job order.
+
+    `jobs` may be a lazy iterable (see iter_batch_jobs): work starts as soon as the first job is known.
+    With a journal, jobs whose output is already up to date are skipped and every result is recorded.
+    engine="pipeline" runs a single-process threaded pipeline instead (see iter_pipeline_results).
+    Per-image stage timings and byte counts are recorded into `metrics` (a BatchMetrics) when given.
+    With a MemoryBudget, images are only started while their estimated footprint fits; images that
+    would not fit even alone run one at a time in low-memory mode.
+    With OutputProfiles, every image is decoded once and written once per profile (see apply_modern_watermark).
+    `encoder` (EncoderSettings) picks the encoder preset and whether EXIF/ICC metadata is kept.
+    With an OutputCache, photos whose bytes, settings and timestamp match an earlier output are written from it.
+    Once `stop_event` (a threading.Event) is set, no further jobs are started; images already in flight are finished
+    and recorded, and only their results are returned.
+    """
+    watermark_kwargs = dict(title_text=title_text, location_text=location_text, anchor=anchor,
+                            padding=tuple(padding), font_path=font_path, base_font_size=base_font_size)
+    if profiles: watermark_kwargs["profiles"] = tuple(profiles)
+    if encoder: watermark_kwargs["encoder"] = encoder
+    if output_cache: watermark_kwargs["output_cache"] = output_cache # Pickled to its settings for worker processes
+    workers = workers or os.cpu_count() or 1
+    results = []
+    skipped_count = [0]
+
+    def planned():
+        for index, job in enumerate(jobs):
+            if stop_event and stop_event.is_set(): return
+            results.append(None)
+            skip = bool(journal and journal.is_up_to_date(job, fingerprint))
+            if journal and not skip: journal.plan(job, fingerprint) # Before dispatch: jobs may finish out of order
+            yield index, job, skip
+
+    def collect(index, job, result):
+        results[index] = result
+        if result.skipped: skipped_count[0] += 1
+        elif journal: journal.record(job, fingerprint, result.success)
+        if metrics: metrics.record_result(result)
+        for message in result.messages: log_callback(message)
+        if result_callback: result_callback(result)
+
+    def plan(job):
+        return plan_job_memory(job, memory_budget, metadata_index, profiles) if memory_budget else (0, False)
+
+    if engine == "pipeline":
+        options = dict(pipeline_options or {}, memory_budget=memory_budget, metadata_index=metadata_index)
+        for index, job, result in iter_pipeline_results(planned(), watermark_kwargs, **options):
+            collect(index, job, result)
+    elif workers == 1:
+        for index, job, skip in planned():
+            if skip: collect(index, job, _skipped_result(job)); continue
+            cost, low_memory = plan(job)
+            if memory_budget: memory_budget.acquire(cost) # One job at a time: only keeps the stats honest
+            try: result = _run_batch_job(job, watermark_kwargs, low_memory)
+            finally:
+                if memory_budget: memory_budget.release(cost)
+            collect(index, job, result)
+    else:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = {} # Bounded, so a huge streaming scan never queues everything at once
+            # With a budget, only submit what can run now: queued futures would not hold memory yet
+            max_in_flight = workers if memory_budget else workers * 4
+
+            def drain_one():
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, job, cost = in_flight.pop(future)
+                    if memory_budget: memory_budget.release(cost)
+                    collect(index, job, _future_result(future, job))
+
+            for index, job, skip in planned():
+                if skip: collect(index, job, _skipped_result(job)); continue
+                cost, low_memory = plan(job)
+                if memory_budget:
+                    while in_flight and not memory_budget.try_acquire(cost): drain_one()
+                    if not in_flight: memory_budget.acquire(cost)
+                in_flight[executor.submit(_run_batch_job, job, watermark_kwargs, low_memory)] = (index, job, cost)
+                if len(in_flight) >= max_in_flight: drain_one()
+            while in_flight: drain_one()
+
+    if skipped_count[0]: log_callback(f"跳过 {skipped_count[0]} 张未变化的图片 (日志: {journal.path})")
+    if stop_event and stop_event.is_set(): log_callback(f"批量处理已取消, 已完成 {len(results)} 张, 其余图片未处理。")
+    if memory_budget:
+        stats = memory_budget.stats()
+        log_callback(f"内存预算 {stats['budget_bytes'] / 2**20:.0f}MB, 峰值占用 {stats['peak_in_use_bytes'] / 2**20:.0f}MB, "
+                     f"超出预算(低内存模式) {stats['oversized_jobs']} 张")
+    return results
+
+# --- Watch-Folder Mode ---
+WATCH_IGNORE_PATTERNS = (".*", "*.part", "*.partial", "*.tmp", "*.crdownload", "*~") # Names of uploads still in progress
+CLOSED_SETTLE_SECONDS = 0.25 # Quiet period once the writer has closed (or renamed) the file
+
+class _Inotify:
+    # Minimal ctypes binding for Linux inotify; raises OSError where it is not available
+    IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x8, 0x80, 0x100
+    IN_Q_OVERFLOW, IN_ISDIR = 0x4000, 0x40000000
+    _EVENT = struct.Struct("iIII") # wd, mask, cookie, len; followed by the NUL-padded name
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"): raise OSError("inotify 仅支持 Linux")
+        import ctypes
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.paths = {}
+
+    def add_watch(self, path):
+        import ctypes
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+        if wd < 0: raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        self.paths[wd] = path
+
+    def read_events(self, timeout):
+        # [(path, mask)], waiting at most `timeout` seconds for the first one
+        import select
+        if not select.select([self.fd], [], [], timeout)[0]: return []
+        try: data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError: return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, name_len = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            folder = self.paths.get(wd)
+            if folder and name: events.append((os.path.join(folder, name), mask))
+            elif mask & self.IN_Q_OVERFLOW: events.append((None, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class FolderWatcher:
+    """Reports image files under a folder once they exist and have stopped changing.
+
+    Uses inotify on Linux and otherwise rescans the tree every poll_interval seconds. A file is reported once its
+    size and mtime have stayed the same for settle_seconds (or briefly after the uploader closed or renamed it),
+    so partial uploads are not picked up. A file that changes again after being reported is reported again.
+    """
+    def __init__(self, folder, recursive=True, include=None, exclude=None, skip_dirs=(), settle_seconds=2.0,
+                 poll_interval=1.0, use_inotify=True, log_callback=print):
+        self.folder = folder
+        self.recursive = recursive
+        self.include = tuple(include or ())
+        self.exclude = tuple(exclude or ()) + WATCH_IGNORE_PATTERNS
+        self.skip_dirs = {os.path.realpath(d) for d in skip_dirs} - {os.path.realpath(folder)}
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.log_callback = log_callback
+        self.pending = {} # path -> (size/mtime signature, monotonic time of the last change, settle seconds)
+        self.reported = {} # path -> signature when it was last reported
+        self.inotify = None
+        if use_inotify:
+            try: self.inotify = _Inotify()
+            except (OSError, AttributeError) as e: log_callback(f"无法使用 inotify ({e}), 改为每 {poll_interval} 秒扫描一次。")
+
+    def _rel_path(self, path):
+        rel_path = os.path.relpath(path, self.folder).replace(os.sep, "/")
+        return "" if rel_path == "." else rel_path
+
+    def _is_candidate(self, path):
+        rel_path, name = self._rel_path(path), os.path.basename(path)
+        if not name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS) or _matches_any(rel_path, name, self.exclude): return False
+        if self.include and not _matches_any(rel_path, name, self.include): return False
+        return self.recursive or "/" not in rel_path
+
+    def _is_watched_dir(self, path):
+        return not _matches_any(self._rel_path(path), os.path.basename(path), self.exclude) and os.path.realpath(path) not in self.skip_dirs
+
+    def _scan(self, folder=None):
+        # Queue every image under folder (default: the whole tree). Folders are watched first so nothing slips in between.
+        folder = folder or self.folder
+        if self.inotify:
+            for root, dirs, _ in os.walk(folder):
+                try: self.inotify.add_watch(root)
+                except OSError as e: self.log_callback(f"无法监视文件夹 {root}: {e}")
+                dirs[:] = [d for d in dirs if self.recursive and self._is_watched_dir(os.path.join(root, d))]
+        for entry in _walk_image_entries(folder, self._rel_path(folder), self.recursive, self.include, self.exclude, False, self.skip_dirs):
+            self._touch(entry.path)
+
+    def _touch(self, path, settle_seconds=None):
+        try: st = os.stat(path)
+        except OSError: self.pending.pop(path, None); return
+        signature = (st.st_size, st.st_mtime_ns)
+        if self.reported.get(path) == signature: return
+        settle_seconds = self.settle_seconds if settle_seconds is None else min(settle_seconds, self.settle_seconds)
+        previous = self.pending.get(path)
+        changed_at = previous[1] if previous and previous[0] == signature else time.monotonic()
+        self.pending[path] = (signature, changed_at, settle_seconds)
+
+    def _handle_events(self, events):
+        for path, mask in events:
+            if mask & _Inotify.IN_Q_OVERFLOW: self._scan(); continue # The kernel dropped events: rescan everything
+            if mask & _Inotify.IN_ISDIR:
+                if self.recursive and self._is_watched_dir(path): self._scan(path)
+            elif self._is_candidate(path):
+                self._touch(path, CLOSED_SETTLE_SECONDS if mask & (_Inotify.IN_CLOSE_WRITE | _Inotify.IN_MOVED_TO) else None)
+
+    def _take_ready(self):
+        now, ready = time.monotonic(), []
+        for path, (signature, changed_at, settle_seconds) in list(self.pending.items()):
+            try: st = os.stat(path)
+            except OSError: del self.pending[path]; continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != signature: self.pending[path] = (current, now, self.settle_seconds)
+            elif now - changed_at >= settle_seconds:
+                del self.pending[path]
+                self.reported[path] = signature
+                ready.append(path)
+        return sorted(ready, key=lambda path: (path.casefold(), path))
+
+    def ready_files(self, stop_event=None):
+        """Yield settled image paths (existing ones first) until stop_event is set."""
+        self._scan()
+        next_poll = time.monotonic() + self.poll_interval
+        tick = max(0.05, min(0.5, self.settle_seconds / 4))
+        try:
+            while not (stop_event and stop_event.is_set()):
+                if self.inotify: self._handle_events(self.inotify.read_events(tick))
+                else:
+                    if stop_event: stop_event.wait(tick)
+                    else: time.sleep(tick)
+                    if time.monotonic() >= next_poll:
+                        self._scan()
+                        next_poll = time.monotonic() + self.poll_interval
+                yield from self._take_ready()
+        finally:
+            if self.inotify: self.inotify.close()
+
+def watch_folder(watcher, input_folder, output_folder, title_text, location_text, anchor="bottom_right", padding=(10, 10),
+                 font_path="arial.ttf", base_font_size=20, start_timestamp_dt=None, increment="1min", rng=random, journal=None,
+                 fingerprint=None, timestamp_source="sequence", metadata_index=None, log_callback=print, metrics=None, stop_event=None,
+                 profiles=None, encoder=None, output_cache=None):
+    """Watermark photos as the watcher reports them, until stop_event is set.
+
+    Runs in this process so fonts and the rendered static watermark parts stay cached between files. New photos
+    continue the journal's timestamp sequence, so a restarted watcher carries on where the last one stopped;
+    a photo that is re-uploaded keeps its recorded timestamp.
+    """
+    watermark_kwargs = dict(title_text=title_text, location_text=location_text, anchor=anchor,
+                            padding=tuple(padding), font_path=font_path, base_font_size=base_font_size)
+    if profiles: watermark_kwargs["profiles"] = tuple(profiles)
+    if encoder: watermark_kwargs["encoder"] = encoder
+    if output_cache: watermark_kwargs["output_cache"] = output_cache
+    load_watermark_fonts(font_path, base_font_size, log_callback) # Warm the font cache before the first photo arrives
+    last_timestamp_dt = journal.latest_timestamp() if journal else None
+    for input_path in watcher.ready_files(stop_event):
+        output_path = os.path.join(output_folder, os.path.relpath(input_path, input_folder))
+        timestamp_dt = journal.recorded_timestamp(output_path) if journal else None
+        if timestamp_dt is None and timestamp_source == "exif":
+            timestamp_dt = metadata_index.capture_time(input_path) if metadata_index else read_capture_time(input_path)
+        if timestamp_dt is None:
+            timestamp_dt = next_batch_timestamp(last_timestamp_dt, increment, rng) if last_timestamp_dt else start_timestamp_dt or datetime.datetime.now().replace(microsecond=0)
+        last_timestamp_dt = max(last_timestamp_dt or timestamp_dt, timestamp_dt)
+        job = BatchJob(input_path, output_path, timestamp_dt)
+        if journal and journal.is_up_to_date(job, fingerprint): continue
+
+        started = time.perf_counter()
+        result = _run_batch_job(job, watermark_kwargs)
+        if journal: journal.record(job, fingerprint, result.success)
+        if metrics: metrics.record_result(result)
+        for message in result.messages: log_callback(message)
+        if result.success: log_callback(f"{os.path.relpath(input_path, input_folder)}: 时间 {timestamp_dt}, 耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+
+# --- Archive Input/Output (zip/tar, no extraction to disk) ---
+# Longest suffix first, so "photos.tar.gz" is not taken for a plain ".tar"
+ARCHIVE_SUFFIXES = ((".tar.gz", "w:gz"), (".tgz", "w:gz"), (".tar.bz2", "w:bz2"), (".tbz2", "w:bz2"),
+                    (".tar.xz", "w:xz"), (".txz", "w:xz"), (".tar", "w"), (".zip", "zip"))
+_STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp") # Already compressed: deflating them again only costs CPU
+
+ArchiveMember = collections.namedtuple("ArchiveMember", "name size mtime")
+
+def archive_write_mode(path):
+    # "zip", a tarfile write mode ("w", "w:gz", ...) or None for anything that is not an archive name
+    lower = path.lower()
+    for suffix, mode in ARCHIVE_SUFFIXES:
+        if lower.endswith(suffix): return mode
+    return None
+
+def is_archive_path(path):
+    return archive_write_mode(path) is not None
+
+def is_archive_batch(input_path, output_path):
+    # True when a batch must go through ArchiveBatch: archive input, archive output or both
+    return is_archive_path(output_path) or (os.path.isfile(input_path) and is_archive_path(input_path))
+
+def _safe_member_name(name):
+    # Normalized "/"-separated member path, or None for absolute paths and paths escaping the archive root
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or ".." in parts or name.startswith(("/", "\\")) or ":" in parts[0]: return None
+    return "/".join(parts)
+
+def _member_sort_key(name):
+    # Same order as the folder scan: entries sorted by name within each folder, depth first
+    return [(part.casefold(), part) for part in name.split("/")]
+
+class ArchiveReader:
+    """Image members of a zip or tar archive, read one at a time into memory; nothing is extracted to disk.
+
+    `members` lists the regular files in storage order. Compressed tars can only be read forwards cheaply,
+    so jobs are reordered to storage order before reading (see ArchiveBatch.plan_jobs).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._zip = self._tar = None
+        if archive_write_mode(path) == "zip":
+            import zipfile
+            self._zip = zipfile.ZipFile(path)
+            entries = [(info.filename, info.file_size, _zip_mtime(info), info) for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            import tarfile
+            self._tar = tarfile.open(path, "r:*")
+            entries = [(info.name, info.size, info.mtime, info) for info in self._tar.getmembers() if info.isfile()]
+        self._infos = {}
+        self.members = []
+        for name, size, mtime, info in entries:
+            safe_name = _safe_member_name(name)
+            if safe_name is None or safe_name in self._infos: continue # Unsafe or duplicate path: never written out
+            self._infos[safe_name] = info
+            self.members.append(ArchiveMember(safe_name, size, mtime))
+
+    def open(self, name):
+        return self._zip.open(self._infos[name]) if self._zip else self._tar.extractfile(self._infos[name])
+
+    def read(self, name):
+        with self.open(name) as f: return f.read()
+
+    def capture_time(self, name):
+        # Header only: Image.open reads just the first few KB of the member
+        try:
+            with self.open(name) as f: return read_image_header(f).capture_time
+        except (OSError, SyntaxError, ValueError): return None
+
+    def close(self):
+        (self._zip or self._tar).close()
+
+def _zip_mtime(info):
+    try: return datetime.datetime(*info.date_time).timestamp()
+    except ValueError: return 0.0
+
+class ArchiveWriter:
+    """Writes outputs into a zip or tar archive as they are produced.
+
+    The archive is built as `<path>.part` and only renamed into place by close(), so an interrupted run never
+    leaves a truncated archive under the final name.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".part"
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        mode = archive_write_mode(path)
+        self._zip = self._tar = None
+        if mode == "zip":
+            import zipfile
+            self._zipfile = zipfile
+            self._zip = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_DEFLATED)
+        else:
+            import tarfile
+            self._tarfile = tarfile
+            self._tar = tarfile.open(self.tmp_path, mode)
+
+    def write(self, name, data):
+        if self._zip:
+            info = self._zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = self._zipfile.ZIP_STORED if name.lower().endswith(_STORED_EXTENSIONS) else self._zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, data)
+        else:
+            info = self._tarfile.TarInfo(name)
+            info.size, info.mtime, info.mode = len(data), time.time(), 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self, keep=True):
+        (self._zip or self._tar).close()
+        if keep: os.replace(self.tmp_path, self.path)
+        else: os.remove(self.tmp_path)
+
+class ArchiveBatch:
+    """A batch whose input and/or output is an archive. Folder input and output work as usual on the other side.
+
+    Jobs use "/"-separated member paths (input) and output names relative to the output root, so timestamps,
+    output profiles and names come out exactly as for a folder-to-folder batch.
+    """
+    def __init__(self, input_path, output_path):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.reader = ArchiveReader(input_path) if os.path.isfile(input_path) and is_archive_path(input_path) else None
+        self.writer = ArchiveWriter(output_path) if is_archive_path(output_path) else None
+
+    def plan_jobs(self, base_timestamp_dt, increment="1min", rng=random, timestamp_source="sequence", recursive=True,
+                  include=None, exclude=None, order="name", metadata_index=None):
+        """BatchJobs in the order their inputs will be read. Timestamps follow `order`, as in iter_batch_jobs."""
+        if not self.reader:
+            image_paths = iter_image_files(self.input_path, recursive, include, exclude, order, metadata_index=metadata_index)
+            return list(iter_batch_jobs(image_paths, self.input_path, "", base_timestamp_dt, increment, rng,
+                                        timestamp_source=timestamp_source, metadata_index=metadata_index))
+        if order not in SCAN_ORDERS: raise ValueError(f"未知的排序方式: {order}")
+        members = [member for member in self.reader.members if _archive_member_selected(member.name, recursive, include or (), exclude or ())]
+        capture_times = {}
+        if timestamp_source == "exif" or order == "capture_time": # Read in storage order: forward-only, even in a .tar.gz
+            capture_times = {member.name: self.reader.capture_time(member.name) for member in members}
+        storage_index = {member.name: i for i, member in enumerate(members)}
+        if order == "name": members.sort(key=lambda member: _member_sort_key(member.name))
+        elif order in ("mtime", "capture_time"):
+            def sort_time(member):
+                capture_dt = capture_times.get(member.name) if order == "capture_time" else None
+                return capture_dt.timestamp() if capture_dt else member.mtime
+            members.sort(key=lambda member: (sort_time(member), member.name.casefold(), member.name))
+
+        jobs = []
+        current_timestamp_dt = base_timestamp_dt
+        for i, member in enumerate(members):
+            capture_dt = capture_times.get(member.name) if timestamp_source == "exif" else None
+            if capture_dt: current_timestamp_dt = capture_dt
+            elif i > 0: current_timestamp_dt = next_batch_timestamp(current_timestamp_dt, increment, rng)
+            jobs.append(BatchJob(member.name, member.name, current_timestamp_dt))
+        if self.reader._tar: jobs.sort(key=lambda job: storage_index[job.input_path]) # Timestamps are already assigned
+        return jobs
+
+    def read(self, job):
+        if self.reader: return self.reader.read(job.input_path)
+        with open(job.input_path, "rb") as f: return f.read()
+
+    def write(self, name, data):
+        name = name.replace(os.sep, "/")
+        if self.writer: self.writer.write(name, data); return
+        path = os.path.join(self.output_path, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _unshare_output(path)
+        with open(path, "wb") as f: f.write(data)
+
+    def close(self, keep=True):
+        # keep=False discards a partly written output archive (e.g. after an error)
+        if self.reader: self.reader.close()
+        if self.writer: self.writer.close(keep)
+
+def _archive_member_selected(name, recursive, include, exclude):
+    # The folder scan's filters applied to a member path: globs match the path and the file name, excluded folders are pruned
+    folder, _, base = name.rpartition("/")
+    if not base.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS): return False
+    if folder and not recursive: return False
+    parts = folder.split("/") if folder else []
+    if exclude and any(_matches_any("/".join(parts[:i + 1]), parts[i], exclude) for i in range(len(parts))): return False
+    if include and not _matches_any(name, base, include): return False
+    return not (exclude and _matches_any(name, base, exclude))
+
+def _watermark_archive_job(job, data, watermark_kwargs, profiles, encoder):
+    # Runs in a worker: decode once, watermark and encode every profile in memory. Returns ([(name, bytes)], BatchResult).
+    messages, timer, outputs = [], StageTimer(), []
+    try:
+        timer.bytes_read += len(data)
+        img, full_size = decode_for_profiles(io.BytesIO(data), profiles, timer)
+        del data
+        for name, out_img, layout, save_options in iter_profile_outputs(img, full_size, job.output_path, profiles, timestamp_dt=job.timestamp_dt,
+                                                                        log_callback=messages.append, timer=timer, **watermark_kwargs):
+            with _stage(timer, "encode"): encoded = encode_watermarked_image(out_img, name, save_options, encoder, timer)
+            timer.bytes_written += len(encoded)
+            outputs.append((name, encoded))
+            messages.append(f"现代样式水印已添加到: {name} (锚点: {layout.anchor}, 坐标: ({layout.final_x},{layout.final_y}))")
+        success = True
+    except Exception as e:
+        messages.append(f"处理图片 {job.input_path} 时出错: {e}")
+        outputs, success = [], False
+    return outputs, BatchResult(job.input_path, job.output_path, job.timestamp_dt, success, messages, stages=timer.stages,
+                                bytes_read=timer.bytes_read, bytes_written=timer.bytes_written, encodes=timer.encodes)
+
+def _archive_job_cost(job, data):
+    try: header = read_image_header(io.BytesIO(data))
+    except (OSError, SyntaxError, ValueError): return len(data) + _MEMORY_OVERHEAD
+    return estimate_job_memory(header, job.output_path, len(data))
+
+def run_archive_batch(archive, jobs, title_text, location_text, anchor="bottom_right", padding=(10, 10),
+                      font_path="arial.ttf", base_font_size=20, workers=None, log_callback=print, result_callback=None,
+                      engine="process", metrics=None, memory_budget=None, profiles=None, encoder=None, stop_event=None):
+    """Watermark the jobs of an ArchiveBatch. Returns BatchResults in job order.
+
+    Inputs are read one at a time on this thread, watermarked in memory on a process pool (engine="process")
+    or thread pool (engine="pipeline") and written to the output in job order, so no more than 2 * workers
+    inputs and their encoded outputs are held at once; with a MemoryBudget, also no more than their estimated
+    footprint. `stop_event` stops starting new jobs, as in run_batch.
+    """
+    watermark_kwargs = dict(title_text=title_text, location_text=location_text, anchor=anchor,
+                            padding=tuple(padding), font_path=font_path, base_font_size=base_font_size)
+    profiles = tuple(profiles) if profiles else (FULL_OUTPUT_PROFILE,)
+    workers = workers or os.cpu_count() or 1
+    results = []
+
+    def collect(outputs, result):
+        for name, data in outputs: archive.write(name, data)
+        results.append(result)
+        if metrics: metrics.record_result(result)
+        for message in result.messages: log_callback(message)
+        if result_callback: result_callback(result)
+
+    if workers == 1:
+        for job in jobs:
+            if stop_event and stop_event.is_set(): break
+            collect(*_watermark_archive_job(job, archive.read(job), watermark_kwargs, profiles, encoder))
+    else:
+        import concurrent.futures
+        executor_class = concurrent.futures.ThreadPoolExecutor if engine == "pipeline" else concurrent.futures.ProcessPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            in_flight = collections.deque() # (future, job, cost), oldest first: outputs are written in job order
+
+            def drain_one():
+                future, job, cost = in_flight.popleft()
+                try: outputs, result = future.result()
+                except Exception as e: # e.g. a worker process died: the job fails, the rest of the archive is still written
+                    outputs, result = [], _failed_result(job, e)
+                if memory_budget: memory_budget.release(cost)
+                collect(outputs, result)
+
+            for job in jobs:
+                if stop_event and stop_event.is_set(): break
+                data = archive.read(job)
+                cost = _archive_job_cost(job, data) if memory_budget else 0
+                if memory_budget:
+                    while in_flight and not memory_budget.try_acquire(cost): drain_one()
+                    if not in_flight: memory_budget.acquire(cost)
+                try: future = executor.submit(_watermark_archive_job, job, data, watermark_kwargs, profiles, encoder)
+                except Exception as e: # A broken pool refuses new work
+                    if memory_budget: memory_budget.release(cost)
+                    collect([], _failed_result(job, e)); continue
+                in_flight.append((future, job, cost))
+                del data
+                if len(in_flight) >= 2 * workers: drain_one()
+            while in_flight: drain_one()
+
+    if stop_event and stop_event.is_set(): log_callback(f"批量处理已取消, 已完成 {len(results)} 张, 其余图片未处理。")
+    if memory_budget:
+        stats = memory_budget.stats()
+        log_callback(f"内存预算 {stats['budget_bytes'] / 2**20:.0f}MB, 峰值占用 {stats['peak_in_use_bytes'] / 2**20:.0f}MB")
+    return results
+
+# --- In-Memory Watermarking (bytes in, bytes out) ---
+def watermark_image_bytes(data, title_text, location_text, timestamp_dt, anchor="bottom_right", padding=(10, 10),
+                          font_path="arial.ttf", base_font_size=20, output_format=None, encoder=None, log_callback=print, timer=None):
+    """Watermark an encoded image held in memory. Returns (encoded bytes, format); the format defaults to the input's."""
+    with _stage(timer, "decode"):
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    if timer: timer.bytes_read += len(data)
+    if output_format: image_format = Image.registered_extensions().get("." + output_format.lower(), output_format.upper())
+    else: image_format = {"MPO": "JPEG"}.get(img.format, img.format or "PNG") # Camera JPEGs with a preview frame
+    if image_format not in Image.SAVE: raise ValueError(f"不支持的输出格式: {output_format or image_format}")
+    img, _ = watermark_pil_image(img, title_text, location_text, timestamp_dt, anchor, padding, font_path, base_font_size,
+                                 log_callback, timer)
+    if image_format == "JPEG" and img.mode != "RGB":
+        with _stage(timer, "convert"): img = img.convert("RGB")
+    with _stage(timer, "encode"):
+        started = time.perf_counter()
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, **encoder_save_options(img, image_format, encoder))
+    _record_encode(timer, encoder, image_format, started, buffer.tell())
+    if timer: timer.bytes_written += buffer.tell()
+    return buffer.getvalue(), image_format
+
+def _parse_cli_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="照片批量加水印工具 (命令行模式)")
+    parser.add_argument("input_folder", help="输入图片文件夹, 或 zip / tar (.tar.gz 等) 压缩包")
+    parser.add_argument("output_folder", help="输出文件夹, 或以 .zip / .tar / .tar.gz 等结尾的压缩包文件名 (直接写入压缩包)")
+    parser.add_argument("--title", default="施工记录", help="标题文字")
+    parser.add_argument("--location", default="", help="拍摄地点")
+    parser.add_argument("--start-time", default=None, help="起始拍摄时间, 格式 'YYYY-MM-DD HH:MM:SS' (默认: 当前时间)")
+    parser.add_argument("--increment", default="1min", choices=list(TIME_INCREMENT_RANGES), help="时间递增方式")
+    parser.add_argument("--no-recursive", action="store_true", help="不处理子文件夹")
+    parser.add_argument("--include", action="append", default=None, metavar="GLOB", help="只处理匹配的文件 (可重复), 例如 '*.jpg' 或 '2024-*/*'")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB", help="跳过匹配的文件或文件夹 (可重复)")
+    parser.add_argument("--order", default="name", choices=SCAN_ORDERS, help="处理顺序 (决定时间戳顺序): 文件名 / 修改时间 / 拍摄时间 / 文件系统顺序")
+    parser.add_argument("--timestamp-source", default="sequence", choices=TIMESTAMP_SOURCES,
+                        help="sequence: 起始时间加递增; exif: 使用照片的拍摄时间 (没有EXIF时按递增规则)")
+    parser.add_argument("--metadata-index", default=DEFAULT_METADATA_INDEX_PATH, help="图片元数据索引 (SQLite) 的位置")
+    parser.add_argument("--no-metadata-index", action="store_true", help="不使用持久化的元数据索引")
+    parser.add_argument("--seed", type=int, default=None, help="随机递增的种子, 用于复现时间序列")
+    parser.add_argument("--anchor", default="bottom_left", help="水印锚点, 例如 bottom_left / top_right")
+    parser.add_argument("--padding", type=int, nargs=2, default=(30, 30), metavar=("X", "Y"), help="整体边距")
+    parser.add_argument("--font-size", type=int, default=40, help="基础字体大小")
+    parser.add_argument("--font", default=None, help="字体文件路径 (默认自动查找)")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数 (默认: CPU核心数)")
+    parser.add_argument("--engine", default="process", choices=["process", "pipeline"],
+                        help="process: 多进程并行; pipeline: 单进程多线程流水线 (读取/解码、绘制、编码/写入重叠执行)")
+    parser.add_argument("--io-threads", type=int, default=2, help="流水线模式下读取线程和写入线程的数量")
+    parser.add_argument("--queue-size", type=int, default=4, help="流水线模式下各阶段之间的队列长度 (限制内存占用)")
+    parser.add_argument("--profile", action="append", default=None, type=parse_output_profile, metavar="NAME[:SIZE[:FORMAT[:QUALITY]]]",
+                        help="输出规格 (可重复), 每张图片只解码一次并按每个规格各输出一份, 例如 --profile full --profile web:2048 "
+                             "--profile thumb:320:webp:75 (SIZE 为长边像素; 'full' 使用原文件名, 其他规格在文件名后加 _NAME)")
+    parser.add_argument("--output-format", default=None, type=parse_output_format, metavar="EXT",
+                        help="输出格式, 例如 jpg / png / webp (默认与输入文件相同; 指定了格式的 --profile 不受影响)")
+    parser.add_argument("--preset", default=DEFAULT_ENCODER_PRESET, choices=list(ENCODER_PRESETS),
+                        help="编码预设: fast (速度优先) / balanced (默认) / archival (质量优先, JPEG 4:4:4, WebP 无损)")
+    parser.add_argument("--strip-metadata", action="store_true", help="不保留原图的 EXIF 和 ICC 色彩配置")
+    parser.add_argument("--memory-budget", default=None, metavar="SIZE",
+                        help="同时处理的图片的估计内存上限, 例如 2G / 512M (默认: 物理内存的一半; 0 表示不限制)")
+    parser.add_argument("--output-cache", nargs="?", const=DEFAULT_OUTPUT_CACHE_PATH, default=None, metavar="DIR",
+                        help="输出缓存: 内容相同的照片 (改名或在多个文件夹中重复出现) 在相同设置和时间下直接复用之前的输出, 不再解码 "
+                             f"(默认位置: {DEFAULT_OUTPUT_CACHE_PATH})")
+    parser.add_argument("--output-cache-size", default="2G", metavar="SIZE", help="输出缓存的容量上限, 超出时删除最久未使用的条目 (默认: 2G)")
+    parser.add_argument("--output-cache-copy", action="store_true", help="从输出缓存复制文件, 而不是创建硬链接")
+    parser.add_argument("--watch", action="store_true", help="持续监视输入文件夹, 新照片上传完成后立即加水印 (Ctrl+C 退出)")
+    parser.add_argument("--settle-seconds", type=float, default=2.0, help="监视模式: 文件大小保持不变多少秒后视为上传完成")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="监视模式: 无法使用 inotify 时的扫描间隔 (秒)")
+    parser.add_argument("--polling", action="store_true", help="监视模式: 不使用 inotify, 始终定时扫描")
+    parser.add_argument("--metrics-json", default=None, help="将计数器和每张图片各阶段耗时写入 JSON 文件")
+    parser.add_argument("--no-journal", action="store_true", help="不写入/不使用输出文件夹中的批量日志 (每次全部重新处理)")
+    parser.add_argument("--resume", action="store_true", help="沿用上次批量日志中的起始时间和递增方式, 继续未完成的任务")
+    parser.add_argument("--hash", action="store_true", help="修改时间变化时按内容哈希判断输入是否真的改变")
+    return parser.parse_args(argv)
+
+def run_cli(argv):
+    args = _parse_cli_args(argv)
+    if os.path.abspath(args.input_folder) == os.path.abspath(args.output_folder):
+        print("输入和输出文件夹不能相同。"); return 2
+    start_dt = datetime.datetime.strptime(args.start_time, "%Y-%m-%d %H:%M:%S") if args.start_time else datetime.datetime.now().replace(microsecond=0)
+    increment = args.increment
+    rng = random.Random(args.seed) if args.seed is not None else random
+    if args.output_format: args.profile = with_output_format(args.profile, args.output_format)
+    encoder = EncoderSettings(args.preset, not args.strip_metadata)
+    # Archive input and/or output: members are streamed through memory; the journal lives in output folders only
+    archive_mode = is_archive_batch(args.input_folder, args.output_folder)
+    if archive_mode and args.watch: print("监视模式不支持压缩包输入或输出。"); return 2
+
+    if not archive_mode: os.makedirs(args.output_folder, exist_ok=True)
+    journal = None if args.no_journal or archive_mode else BatchJournal(args.output_folder, use_hash=args.hash, profiles=args.profile)
+    timestamp_source = args.timestamp_source
+    # A watcher restarted without --start-time continues the previous sequence, like --resume
+    if (args.resume or (args.watch and not args.start_time)) and journal and journal.last_run():
+        last_run = journal.last_run()
+        start_dt, increment = datetime.datetime.fromisoformat(last_run["base_timestamp"]), last_run["increment"]
+        timestamp_source = last_run.get("timestamp_source", "sequence")
+        print(f"继续上次的批量任务: 起始时间 {start_dt}, 递增 {increment}, 时间来源 {timestamp_source}")
+    font_path = args.font or find_font_path()
+    padding = tuple(args.padding)
+    fingerprint = watermark_fingerprint(args.title, args.location, args.anchor, padding, font_path, args.font_size, start_dt, increment,
+                                        timestamp_source, args.profile, encoder)
+    needs_metadata = timestamp_source == "exif" or args.order == "capture_time"
+    metadata_index = MetadataIndex(args.metadata_index) if needs_metadata and not args.no_metadata_index else None
+    if args.output_cache and archive_mode: print("压缩包模式不使用输出缓存。")
+    output_cache = OutputCache(args.output_cache, parse_size(args.output_cache_size), link=not args.output_cache_copy) \
+        if args.output_cache and not archive_mode else None
+    if args.watch:
+        return _run_cli_watch(args, font_path, padding, start_dt, increment, rng, journal, fingerprint, timestamp_source, metadata_index,
+                              encoder, output_cache)
+    budget_bytes = parse_size(args.memory_budget) if args.memory_budget is not None else default_memory_budget()
+    memory_budget = MemoryBudget(budget_bytes) if budget_bytes else None
+    if archive_mode:
+        return _run_cli_archive(args, font_path, padding, start_dt, increment, rng, timestamp_source, metadata_index, encoder, memory_budget)
+
+    # Streaming scan: with the default name order, processing starts while the folder tree is still being read
+    image_paths = iter_image_files(args.input_folder, recursive=not args.no_recursive, include=args.include,
+                                   exclude=args.exclude, order=args.order, skip_dirs=[args.output_folder], metadata_index=metadata_index)
+    jobs = iter_batch_jobs(image_paths, args.input_folder, args.output_folder, start_dt, increment, rng, journal, fingerprint,
+                           timestamp_source, metadata_index)
+
+    print(f"开始批量处理 (引擎: {args.engine}, 并行数: {args.workers or os.cpu_count()}, 排序: {args.order}, 编码: {args.preset})...")
+    if journal: journal.start_run(fingerprint, start_dt, increment, timestamp_source)
+    metrics = BatchMetrics()
+    try:
+        results = run_batch(jobs, args.title, args.location, args.anchor, padding, font_path, args.font_size,
+                            workers=args.workers, journal=journal, fingerprint=fingerprint, engine=args.engine,
+                            pipeline_options=dict(readers=args.io_threads, renderers=args.workers, writers=args.io_threads, queue_size=args.queue_size),
+                            metrics=metrics, memory_budget=memory_budget, metadata_index=metadata_index, profiles=args.profile,
+                            encoder=encoder, output_cache=output_cache)
+    finally:
+        if journal: journal.close()
+        if metadata_index: metadata_index.close()
+
+    if not results: print("输入文件夹中没有找到支持的图片文件。"); return 1
+    failed = [r for r in results if not r.success]
+    for r in failed: print(f"失败: {r.input_path}")
+    print("批量处理完成。" + "\n".join(metrics.summary_lines()))
+    if output_cache: _print_output_cache_stats(output_cache)
+    if args.metrics_json: metrics.dump_json(args.metrics_json); print(f"统计数据已写入: {args.metrics_json}")
+    return 0 if not failed else 1
+
+def _run_cli_archive(args, font_path, padding, start_dt, increment, rng, timestamp_source, metadata_index, encoder, memory_budget):
+    metrics = BatchMetrics()
+    archive = ArchiveBatch(args.input_folder, args.output_folder)
+    keep_output = False
+    try:
+        jobs = archive.plan_jobs(start_dt, increment, rng, timestamp_source, recursive=not args.no_recursive, include=args.include,
+                                 exclude=args.exclude, order=args.order, metadata_index=metadata_index)
+        print(f"开始批量处理 {len(jobs)} 张图片 ({args.input_folder} -> {args.output_folder}, 引擎: {args.engine}, "
+              f"并行数: {args.workers or os.cpu_count()}, 排序: {args.order}, 编码: {args.preset})...")
+        results = run_archive_batch(archive, jobs, args.title, args.location, args.anchor, padding, font_path, args.font_size,
+                                    workers=args.workers, engine=args.engine, metrics=metrics, memory_budget=memory_budget,
+                                    profiles=args.profile, encoder=encoder)
+        keep_output = bool(results)
+    finally:
+        archive.close(keep_output)
+        if metadata_index: metadata_index.close()
+
+    if not results: print("输入中没有找到支持的图片文件。"); return 1
+    failed = [r for r in results if not r.success]
+    for r in failed: print(f"失败: {r.input_path}")
+    print("批量处理完成。" + "\n".join(metrics.summary_lines()))
+    if args.metrics_json: metrics.dump_json(args.metrics_json); print(f"统计数据已写入: {args.metrics_json}")
+    return 0 if not failed else 1
+
+def _print_output_cache_stats(output_cache):
+    stats = output_cache.stats()
+    print(f"输出缓存 {output_cache.directory}: {stats['entries']} 个条目, {stats['bytes'] / 2**20:.1f}MB / "
+          f"{stats['max_bytes'] / 2**20:.0f}MB")
+    output_cache.close()
+
+def _run_cli_watch(args, font_path, padding, start_dt, increment, rng, journal, fingerprint, timestamp_source, metadata_index, encoder=None,
+                   output_cache=None):
+    watcher = FolderWatcher(args.input_folder, recursive=not args.no_recursive, include=args.include, exclude=args.exclude,
+                            skip_dirs=[args.output_folder], settle_seconds=args.settle_seconds, poll_interval=args.poll_interval,
+                            use_inotify=not args.polling)
+    print(f"开始监视 {args.input_folder} ({'inotify' if watcher.inotify else '定时扫描'}), 按 Ctrl+C 退出...")
+    if journal: journal.start_run(fingerprint, start_dt, increment, timestamp_source)
+    metrics = BatchMetrics()
+    try:
+        watch_folder(watcher, args.input_folder, args.output_folder, args.title, args.location, args.anchor, padding, font_path,
+                     args.font_size, start_dt, increment, rng, journal, fingerprint, timestamp_source, metadata_index, metrics=metrics,
+                     profiles=args.profile, encoder=encoder, output_cache=output_cache)
+    except KeyboardInterrupt:
+        print("停止监视。")
+    finally:
+        if journal: journal.close()
+        if metadata_index: metadata_index.close()
+    print("\n".join(metrics.summary_lines()))
+    if output_cache: _print_output_cache_stats(output_cache)
+    if args.metrics_json: metrics.dump_json(args.metrics_json); print(f"统计数据已写入: {args.metrics_json}")
+    return 0
@@ -0,0 +1,605 @@
+"""PyQt user interface: live preview and batch processing on top of watermark_engine."""
+import os
+import collections
+import datetime
+import threading
+import time
+import traceback
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
+                             QLabel, QLineEdit, QPushButton, QFileDialog,
+                             QComboBox, QSpinBox, QDateTimeEdit, QGroupBox,
+                             QMessageBox, QTextEdit, QCheckBox,
+                             QPlainTextEdit, QProgressBar, QGraphicsScene, QGraphicsView)
+from PyQt5.QtGui import QPixmap, QImage
+from PyQt5.QtCore import QDateTime, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+
+from PIL import Image
+
+from watermark_engine import (BatchMetrics, BatchJournal, MetadataIndex, EncoderSettings, DEFAULT_ENCODER_PRESET,
+                              apply_modern_watermark, load_preview_proxy, render_preview_overlay,
+                              find_font_path, iter_image_files, iter_batch_jobs, run_batch, watermark_fingerprint, ArchiveBatch, is_archive_batch,
+                              is_archive_path, run_archive_batch, OutputCache)
+
+# --- PyQt Application ---
+def pil_to_qimage(pil_image):
+    if pil_image.mode != "RGBA": pil_image = pil_image.convert("RGBA")
+    data = pil_image.tobytes("raw", "RGBA")
+    # copy() detaches the QImage from `data`, so it stays valid after this function returns
+    return QImage(data, pil_image.width, pil_image.height, pil_image.width * 4, QImage.Format_RGBA8888).copy()
+
+LOG_VIEW_MAX_LINES = 1000 # Ring buffer size for the log view and log_messages
+BATCH_UI_REFRESH_MS = 100 # Progress and batch log lines reach the UI at this rate, however fast images finish
+
+class PreviewSignals(QObject):
+    finished = pyqtSignal(int, object) # generation, result dict
+    failed = pyqtSignal(int, str)
+
+class PreviewTask(QRunnable):
+    # Renders the watermark overlay for the preview proxy off the GUI thread. The proxy is only decoded (and
+    # converted for display) when the GUI has none cached; otherwise just the small overlay tile is drawn.
+    def __init__(self, generation, image_path, max_size, proxy, proxy_scale, params, signals):
+        super().__init__()
+        self.generation = generation
+        self.image_path = image_path
+        self.max_size = max_size
+        self.proxy = proxy
+        self.proxy_scale = proxy_scale
+        self.params = params
+        self.signals = signals
+
+    def run(self):
+        try:
+            started = time.perf_counter()
+            proxy, scale, base_qimage = self.proxy, self.proxy_scale, None
+            if proxy is None:
+                proxy, scale = load_preview_proxy(self.image_path, self.max_size)
+                base_qimage = pil_to_qimage(proxy)
+            tile, box = render_preview_overlay(proxy.size, scale, *self.params)
+            self.signals.finished.emit(self.generation, {
+                "overlay_qimage": pil_to_qimage(tile) if tile is not None else None, "overlay_box": box,
+                "base_qimage": base_qimage, "proxy": proxy, "scale": scale, "proxy_key": (self.image_path, self.max_size),
+                "elapsed_ms": (time.perf_counter() - started) * 1000})
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+
+class BatchSignals(QObject):
+    finished = pyqtSignal(object) # summary dict
+    failed = pyqtSignal(str)
+
+class BatchTask(QRunnable):
+    # Scans the input folder and runs the batch off the GUI thread. Progress and log lines are only collected here;
+    # the GUI polls progress() on a timer instead of being signalled once per image.
+    def __init__(self, scan_kwargs, watermark_kwargs, journal, fingerprint, signals):
+        super().__init__()
+        self.scan_kwargs = scan_kwargs
+        self.watermark_kwargs = watermark_kwargs
+        self.journal = journal
+        self.fingerprint = fingerprint
+        self.signals = signals
+        self.stop_event = threading.Event()
+        self.metrics = BatchMetrics()
+        self.total = None # Unknown until the scan finishes
+        self.scanned = 0 # Jobs found so far; the folder scan runs alongside processing
+        self._log_lines = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self.stop_event.set()
+
+    def _log(self, message):
+        with self._lock: self._log_lines.append(message)
+
+    def progress(self):
+        # Called on the GUI thread: counters so far plus the log lines written since the last call
+        with self._lock: lines, self._log_lines = self._log_lines, []
+        return dict(self.metrics.snapshot(), total=self.total, scanned=self.scanned, lines=lines)
+
+    def _count_scanned(self, jobs):
+        for job in jobs:
+            self.scanned += 1
+            yield job
+        self.total = self.scanned # Scan finished: progress can show a total and an ETA
+
+    def run(self):
+        scan = self.scan_kwargs
+        archive = metadata_index = None
+        try:
+            # sqlite connections (and archive readers) are created on this thread; the index is also used by the pipeline readers
+            metadata_index = MetadataIndex() if scan["timestamp_source"] == "exif" or scan["order"] == "capture_time" else None
+            # Threads in this process: Pillow releases the GIL while decoding and encoding
+            if is_archive_batch(scan["input_folder"], scan["output_folder"]):
+                self._log("正在读取压缩包目录...")
+                archive = ArchiveBatch(scan["input_folder"], scan["output_folder"])
+                jobs = archive.plan_jobs(scan["base_timestamp_dt"], scan["increment"], timestamp_source=scan["timestamp_source"],
+                                         recursive=scan["recursive"], order=scan["order"], metadata_index=metadata_index)
+                self.total = self.scanned = len(jobs)
+                if jobs and not self.stop_event.is_set():
+                    self._log(f"开始批量处理 {len(jobs)} 张图片 (现代样式)...")
+                    run_archive_batch(archive, jobs, log_callback=self._log, engine="pipeline", metrics=self.metrics,
+                                      stop_event=self.stop_event, **self.watermark_kwargs)
+                archive.close(keep=bool(jobs)); archive = None # A cancelled run keeps the images finished so far
+            else:
+                # Streaming scan, as in the CLI: with the name order, processing starts while the folder tree is still being read
+                image_paths = iter_image_files(scan["input_folder"], recursive=scan["recursive"], order=scan["order"],
+                                               skip_dirs=[scan["output_folder"]], metadata_index=metadata_index)
+                jobs = iter_batch_jobs(image_paths, scan["input_folder"], scan["output_folder"], scan["base_timestamp_dt"], scan["increment"],
+                                       journal=self.journal, fingerprint=self.fingerprint, timestamp_source=scan["timestamp_source"],
+                                       metadata_index=metadata_index)
+                self._log("开始批量处理 (现代样式), 边扫描边处理...")
+                if self.journal: self.journal.start_run(self.fingerprint, scan["base_timestamp_dt"], scan["increment"], scan["timestamp_source"])
+                run_batch(self._count_scanned(jobs), log_callback=self._log, journal=self.journal, fingerprint=self.fingerprint,
+                          engine="pipeline", metrics=self.metrics, stop_event=self.stop_event, **self.watermark_kwargs)
+            self.signals.finished.emit({"total": self.scanned, "cancelled": self.stop_event.is_set()})
+        except Exception as e:
+            self.signals.failed.emit(f"{e}\n{traceback.format_exc()}")
+        finally:
+            if archive: archive.close(keep=False)
+            if metadata_index: metadata_index.close()
+            if self.journal: self.journal.close()
+            if self.watermark_kwargs.get("output_cache"): self.watermark_kwargs["output_cache"].close()
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes:02d}:{seconds:02d}"
+
+class WatermarkApp(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.current_image_path = None
+        self.output_folder = None
+        self.input_folder = None
+        self.log_messages = collections.deque(maxlen=LOG_VIEW_MAX_LINES)
+
+        # Preview state: a decoded proxy that fits the preview view, shown as a cached base pixmap with the
+        # watermark as a separate overlay item; parameter edits only re-render the overlay on a worker thread
+        self.preview_proxy = None
+        self.preview_proxy_scale = 1.0
+        self.preview_proxy_key = None
+        self.preview_base_pixmap = None
+        self.preview_base_key = None # proxy_key of the pixmap currently shown by preview_base_item
+        self.preview_generation = 0
+        self.preview_running = False
+        self.preview_pending = False
+        self.preview_log_result = False
+        self.preview_pool = QThreadPool(self); self.preview_pool.setMaxThreadCount(1)
+        self.preview_signals = PreviewSignals(self)
+        self.preview_signals.finished.connect(self._on_preview_ready)
+        self.preview_signals.failed.connect(self._on_preview_failed)
+        self.preview_timer = QTimer(self); self.preview_timer.setSingleShot(True); self.preview_timer.setInterval(40)
+        self.preview_timer.timeout.connect(lambda: self.update_preview(log_result=False))
+
+        # Batch state: one BatchTask at a time, polled by batch_timer
+        self.batch_task = None
+        self.batch_pool = QThreadPool(self); self.batch_pool.setMaxThreadCount(1)
+        self.batch_signals = BatchSignals(self)
+        self.batch_signals.finished.connect(self._on_batch_finished)
+        self.batch_signals.failed.connect(self._on_batch_failed)
+        self.batch_timer = QTimer(self); self.batch_timer.setInterval(BATCH_UI_REFRESH_MS)
+        self.batch_timer.timeout.connect(self._refresh_batch_progress)
+
+        self.initUI()
+
+    def log_message(self, message):
+        print(message)
+        line = f"{datetime.datetime.now().strftime('%H:%M:%S')} - {message}"
+        self.log_messages.append(line)
+        if hasattr(self, 'log_output_area'):
+            # Incremental append; the view drops its oldest lines itself (maximumBlockCount)
+            self.log_output_area.appendPlainText(line)
+
+    def log_messages_batch(self, messages):
+        # Many lines at once (batch progress): one append, so the view lays out and repaints once
+        if not messages: return
+        print("\n".join(messages))
+        stamp = datetime.datetime.now().strftime('%H:%M:%S')
+        lines = [f"{stamp} - {message}" for message in messages]
+        self.log_messages.extend(lines)
+        if hasattr(self, 'log_output_area'): self.log_output_area.appendPlainText("\n".join(lines))
+
+    def initUI(self):
+        self.setWindowTitle('照片批量加水印工具 V4')
+        self.setGeometry(100, 100, 1100, 850) # Increased height for new field & log
+
+        main_layout = QVBoxLayout()
+        top_h_layout = QHBoxLayout()
+        left_panel = QVBoxLayout()
+        right_panel = QVBoxLayout()
+
+        # --- Left Panel: Controls ---
+        # 1. File Selection (Same as before)
+        file_group = QGroupBox("文件选择")
+        file_layout = QVBoxLayout()
+        self.btn_load_single = QPushButton("选择单张图片")
+        self.btn_load_single.clicked.connect(self.load_single_image)
+        self.lbl_single_file = QLabel("未选择图片")
+        self.lbl_single_file.setWordWrap(True)
+        file_layout.addWidget(self.btn_load_single); file_layout.addWidget(self.lbl_single_file)
+        self.btn_input_folder = QPushButton("选择图片文件夹 (批量)")
+        self.btn_input_folder.clicked.connect(self.select_input_folder)
+        self.btn_input_archive = QPushButton("选择压缩包 (zip/tar, 批量)")
+        self.btn_input_archive.clicked.connect(self.select_input_archive)
+        self.lbl_input_folder = QLabel("未选择输入文件夹")
+        self.lbl_input_folder.setWordWrap(True)
+        file_layout.addWidget(self.btn_input_folder); file_layout.addWidget(self.btn_input_archive); file_layout.addWidget(self.lbl_input_folder)
+        self.btn_output_folder = QPushButton("选择输出文件夹")
+        self.btn_output_folder.clicked.connect(self.select_output_folder)
+        self.btn_output_archive = QPushButton("输出为压缩包...")
+        self.btn_output_archive.clicked.connect(self.select_output_archive)
+        self.lbl_output_folder = QLabel("未选择输出文件夹")
+        self.lbl_output_folder.setWordWrap(True)
+        file_layout.addWidget(self.btn_output_folder); file_layout.addWidget(self.btn_output_archive); file_layout.addWidget(self.lbl_output_folder)
+        file_group.setLayout(file_layout)
+        left_panel.addWidget(file_group)
+
+        # 2. Watermark Content (Updated for Title Text)
+        content_group = QGroupBox("水印内容")
+        content_layout = QVBoxLayout()
+
+        content_layout.addWidget(QLabel("标题文字:"))
+        self.edit_title_text = QTextEdit("施工记录") # New field
+        content_layout.addWidget(self.edit_title_text)
+
+        content_layout.addWidget(QLabel("拍摄地点:"))
+        self.edit_location = QTextEdit("")
+        content_layout.addWidget(self.edit_location)
+
+        content_layout.addWidget(QLabel("起始拍摄时间:"))
+        self.edit_start_time = QDateTimeEdit(QDateTime.currentDateTime())
+        self.edit_start_time.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+        content_layout.addWidget(self.edit_start_time)
+        content_group.setLayout(content_layout)
+        left_panel.addWidget(content_group)
+
+        # 3. Watermark Style & Relative Position (Font size now 'Base Font Size')
+        style_group = QGroupBox("水印样式与相对位置")
+        style_layout = QVBoxLayout()
+        anchor_layout = QHBoxLayout()
+        lbl_anchor = QLabel("水印锚点:")
+        self.combo_anchor = QComboBox()
+        self.anchor_map_ui_to_code = {
+            "右下角": "bottom_right", "左下角": "bottom_left", "中下部": "bottom_center",
+            "右上角": "top_right", "左上角": "top_left", "中上部": "top_center",
+            "右中部": "middle_right", "左中部": "middle_left", "正中间": "middle_center"
+        }
+        self.combo_anchor.addItems(self.anchor_map_ui_to_code.keys())
+        self.combo_anchor.setCurrentText("左下角")
+        anchor_layout.addWidget(lbl_anchor); anchor_layout.addWidget(self.combo_anchor)
+        style_layout.addLayout(anchor_layout)
+
+        padding_layout = QHBoxLayout()
+        lbl_padding_x = QLabel("整体水平边距(X):")
+        self.spin_padding_x = QSpinBox(); self.spin_padding_x.setRange(0, 1000); self.spin_padding_x.setValue(30)
+        lbl_padding_y = QLabel("整体垂直边距(Y):")
+        self.spin_padding_y = QSpinBox(); self.spin_padding_y.setRange(0, 1000); self.spin_padding_y.setValue(30)
+        padding_layout.addWidget(lbl_padding_x); padding_layout.addWidget(self.spin_padding_x)
+        padding_layout.addWidget(lbl_padding_y); padding_layout.addWidget(self.spin_padding_y)
+        style_layout.addLayout(padding_layout)
+
+        font_size_layout = QHBoxLayout()
+        lbl_font_size = QLabel("基础字体大小 (时间/地点):") # Label changed
+        self.spin_base_font_size = QSpinBox() # Renamed variable
+        self.spin_base_font_size.setRange(8, 128); self.spin_base_font_size.setValue(40)
+        font_size_layout.addWidget(lbl_font_size); font_size_layout.addWidget(self.spin_base_font_size)
+        style_layout.addLayout(font_size_layout)
+        style_group.setLayout(style_layout)
+        left_panel.addWidget(style_group)
+
+        # 4. Batch Processing Settings (Same as before)
+        batch_group = QGroupBox("批量处理设置")
+        batch_layout = QVBoxLayout()
+        lbl_time_increment = QLabel("时间递增:")
+        self.combo_time_increment = QComboBox()
+        self.increment_map_ui_to_code = {
+            "递增1分钟": "1min", "无递增": "none", "递增2分钟": "2min",
+            "递增5分钟": "5min", "递增10分钟": "10min", "随机(1-5分钟)": "random_1_5min"
+        }
+        self.combo_time_increment.addItems(self.increment_map_ui_to_code.keys())
+        batch_layout.addWidget(lbl_time_increment); batch_layout.addWidget(self.combo_time_increment)
+        self.chk_recursive = QCheckBox("包含子文件夹 (输出保持相同目录结构)")
+        self.chk_recursive.setChecked(True)
+        batch_layout.addWidget(self.chk_recursive)
+        order_layout = QHBoxLayout()
+        self.combo_order = QComboBox()
+        self.order_map_ui_to_code = {"按文件名": "name", "按修改时间": "mtime", "按拍摄时间 (EXIF)": "capture_time"}
+        self.combo_order.addItems(self.order_map_ui_to_code.keys())
+        order_layout.addWidget(QLabel("处理顺序:")); order_layout.addWidget(self.combo_order)
+        batch_layout.addLayout(order_layout)
+        preset_layout = QHBoxLayout()
+        self.combo_preset = QComboBox()
+        self.preset_map_ui_to_code = {"均衡": "balanced", "快速 (文件较大)": "fast", "存档 (高质量)": "archival"}
+        self.combo_preset.addItems(self.preset_map_ui_to_code.keys())
+        preset_layout.addWidget(QLabel("编码预设:")); preset_layout.addWidget(self.combo_preset)
+        batch_layout.addLayout(preset_layout)
+        self.chk_exif_time = QCheckBox("使用照片的EXIF拍摄时间 (没有时按上面的递增规则)")
+        batch_layout.addWidget(self.chk_exif_time)
+        self.chk_incremental = QCheckBox("增量处理 (记录批量日志, 跳过未变化的图片)")
+        self.chk_incremental.setChecked(True)
+        batch_layout.addWidget(self.chk_incremental)
+        self.chk_output_cache = QCheckBox("使用输出缓存 (重复提交或多个文件夹中相同的照片直接复用之前的输出)")
+        batch_layout.addWidget(self.chk_output_cache)
+        batch_group.setLayout(batch_layout)
+        left_panel.addWidget(batch_group)
+
+        # 5. Actions (Same as before)
+        action_group = QGroupBox("操作")
+        action_layout = QVBoxLayout()
+        self.btn_preview = QPushButton("刷新预览")
+        self.btn_preview.clicked.connect(lambda: self.update_preview(log_result=True))
+        action_layout.addWidget(self.btn_preview)
+        self.btn_apply_single = QPushButton("应用到单张图片并保存")
+        self.btn_apply_single.clicked.connect(self.process_single_image)
+        action_layout.addWidget(self.btn_apply_single)
+        self.btn_process_batch = QPushButton("开始批量处理")
+        self.btn_process_batch.clicked.connect(self.process_batch_images)
+        action_layout.addWidget(self.btn_process_batch)
+        self.btn_cancel_batch = QPushButton("取消批量处理")
+        self.btn_cancel_batch.setEnabled(False)
+        self.btn_cancel_batch.clicked.connect(self.cancel_batch)
+        action_layout.addWidget(self.btn_cancel_batch)
+        self.progress_batch = QProgressBar(); self.progress_batch.setValue(0)
+        action_layout.addWidget(self.progress_batch)
+        self.lbl_batch_status = QLabel("")
+        action_layout.addWidget(self.lbl_batch_status)
+        action_group.setLayout(action_layout)
+        left_panel.addWidget(action_group)
+        left_panel.addStretch(1)
+
+        # --- Right Panel: Preview (Same as before) ---
+        self.preview_scene = QGraphicsScene(self)
+        self.preview_base_item = self.preview_scene.addPixmap(QPixmap())
+        self.preview_overlay_item = self.preview_scene.addPixmap(QPixmap()); self.preview_overlay_item.setZValue(1)
+        self.preview_text_item = self.preview_scene.addSimpleText("")
+        self.preview_view = QGraphicsView(self.preview_scene)
+        self.preview_view.setMinimumSize(400, 300)
+        self.preview_view.setStyleSheet("border: 1px solid gray;")
+        right_panel.addWidget(self.preview_view)
+        self._show_preview_message("图片预览区域")
+
+        top_h_layout.addLayout(left_panel, 1)
+        top_h_layout.addLayout(right_panel, 2)
+        main_layout.addLayout(top_h_layout)
+
+        # --- Log Output Area (Same as before) ---
+        log_group = QGroupBox("日志输出")
+        log_layout = QVBoxLayout()
+        self.log_output_area = QPlainTextEdit(); self.log_output_area.setReadOnly(True); self.log_output_area.setFixedHeight(150)
+        self.log_output_area.setMaximumBlockCount(LOG_VIEW_MAX_LINES)
+        for line in self.log_messages: self.log_output_area.appendPlainText(line) # Lines logged before the view existed
+        log_layout.addWidget(self.log_output_area)
+        log_group.setLayout(log_layout)
+        main_layout.addWidget(log_group)
+
+        # Debounced automatic preview refresh while editing
+        self.edit_title_text.textChanged.connect(self.schedule_preview)
+        self.edit_location.textChanged.connect(self.schedule_preview)
+        self.edit_start_time.dateTimeChanged.connect(self.schedule_preview)
+        self.combo_anchor.currentIndexChanged.connect(self.schedule_preview)
+        for spin in (self.spin_padding_x, self.spin_padding_y, self.spin_base_font_size): spin.valueChanged.connect(self.schedule_preview)
+
+        self.setLayout(main_layout)
+        self.show()
+        self.log_message("应用程序已启动。现代水印样式 V4。")
+
+    def load_single_image(self): # Same as before
+        options = QFileDialog.Options()
+        filePath, _ = QFileDialog.getOpenFileName(self, "选择单张图片", "", "图片文件 (*.png *.jpg *.jpeg *.bmp *.tif *.tiff);;所有文件 (*)", options=options)
+        if filePath:
+            self.current_image_path = filePath
+            self.lbl_single_file.setText(os.path.basename(filePath))
+            try:
+                with Image.open(filePath): pass # Only checks that Pillow recognises the file; the preview decodes its own proxy
+                self.preview_proxy = None; self.preview_proxy_key = None
+                self.log_message(f"已加载图片: {filePath}")
+                self.update_preview()
+            except Exception as e:
+                QMessageBox.warning(self, "错误", f"无法加载图片: {e}")
+                self.log_message(f"加载图片失败: {filePath} - {e}")
+                self.current_image_path = None
+                self.lbl_single_file.setText("未选择图片"); self._show_preview_message("图片加载失败")
+
+    def select_input_folder(self): # Same as before
+        folderPath = QFileDialog.getExistingDirectory(self, "选择图片文件夹")
+        if folderPath: self.input_folder = folderPath; self.lbl_input_folder.setText(folderPath); self.log_message(f"输入文件夹已选择: {folderPath}")
+
+    def select_output_folder(self): # Same as before
+        folderPath = QFileDialog.getExistingDirectory(self, "选择输出文件夹")
+        if folderPath: self.output_folder = folderPath; self.lbl_output_folder.setText(folderPath); self.log_message(f"输出文件夹已选择: {folderPath}")
+
+    def select_input_archive(self):
+        filePath, _ = QFileDialog.getOpenFileName(self, "选择压缩包", "", "压缩包 (*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tbz2 *.tar.xz *.txz)")
+        if filePath: self.input_folder = filePath; self.lbl_input_folder.setText(filePath); self.log_message(f"输入压缩包已选择: {filePath}")
+
+    def select_output_archive(self):
+        filePath, _ = QFileDialog.getSaveFileName(self, "输出压缩包", "watermarked.zip", "ZIP 压缩包 (*.zip);;TAR 压缩包 (*.tar *.tar.gz *.tgz)")
+        if not filePath: return
+        if not is_archive_path(filePath): filePath += ".zip"
+        self.output_folder = filePath; self.lbl_output_folder.setText(filePath); self.log_message(f"输出压缩包已选择: {filePath}")
+
+    def _get_font_path(self):
+        return find_font_path(log_callback=self.log_message)
+
+    def _get_watermark_params_from_ui(self, current_dt_override=None):
+        title_text = self.edit_title_text.toPlainText() # New
+        location_text = self.edit_location.toPlainText()
+        timestamp_dt = current_dt_override if current_dt_override else self.edit_start_time.dateTime().toPyDateTime()
+
+        anchor_ui = self.combo_anchor.currentText()
+        anchor = self.anchor_map_ui_to_code.get(anchor_ui, "bottom_right")
+
+        padding = (self.spin_padding_x.value(), self.spin_padding_y.value())
+        base_font_size = self.spin_base_font_size.value() # Updated
+        font_path = self._get_font_path()
+
+        return title_text, location_text, timestamp_dt, anchor, padding, font_path, base_font_size
+
+    def _get_encoder_from_ui(self):
+        return EncoderSettings(self.preset_map_ui_to_code.get(self.combo_preset.currentText(), DEFAULT_ENCODER_PRESET))
+
+    def schedule_preview(self):
+        if self.current_image_path: self.preview_timer.start() # Restarts the debounce interval
+
+    def _preview_max_size(self):
+        viewport = self.preview_view.viewport() # Less a small margin, so a fitted proxy never brings up scrollbars
+        return max(1, viewport.width() - 4), max(1, viewport.height() - 4)
+
+    def _show_preview_message(self, text):
+        self.preview_base_item.setPixmap(QPixmap()); self.preview_overlay_item.setPixmap(QPixmap())
+        self.preview_base_key = None
+        self.preview_text_item.setText(text); self.preview_text_item.setVisible(True)
+        self.preview_scene.setSceneRect(self.preview_text_item.boundingRect())
+
+    def update_preview(self, log_result=True):
+        if not self.current_image_path: self._show_preview_message("请先加载一张图片以预览"); return
+        self.preview_log_result = self.preview_log_result or log_result
+        if self.preview_running: self.preview_pending = True; return # Coalesce: re-render once the current one lands
+
+        max_size = self._preview_max_size()
+        if self.preview_proxy_key != (self.current_image_path, max_size): self.preview_proxy = None
+        params = self._get_watermark_params_from_ui() # title, location, timestamp, anchor, padding, font_path, base_font_size
+
+        self.preview_generation += 1
+        self.preview_running = True
+        self.preview_pool.start(PreviewTask(self.preview_generation, self.current_image_path, max_size,
+                                            self.preview_proxy, self.preview_proxy_scale, params, self.preview_signals))
+
+    def _finish_preview_run(self):
+        self.preview_running = False
+        if self.preview_pending: self.preview_pending = False; self.update_preview(log_result=False)
+
+    def _on_preview_ready(self, generation, result):
+        if result["proxy_key"][0] == self.current_image_path and result["base_qimage"] is not None:
+            self.preview_proxy, self.preview_proxy_scale, self.preview_proxy_key = result["proxy"], result["scale"], result["proxy_key"]
+            self.preview_base_pixmap = QPixmap.fromImage(result["base_qimage"])
+        if generation == self.preview_generation and not self.preview_pending:
+            if self.preview_base_key != self.preview_proxy_key: # New image or view size: swap the base layer once
+                self.preview_text_item.setVisible(False)
+                self.preview_base_item.setPixmap(self.preview_base_pixmap)
+                self.preview_scene.setSceneRect(self.preview_base_item.boundingRect())
+                self.preview_base_key = self.preview_proxy_key
+            overlay = result["overlay_qimage"]
+            self.preview_overlay_item.setPixmap(QPixmap.fromImage(overlay) if overlay is not None else QPixmap())
+            self.preview_overlay_item.setPos(*result["overlay_box"][:2])
+            if self.preview_log_result: self.log_message(f"预览已更新 ({result['elapsed_ms']:.0f} ms)。")
+            self.preview_log_result = False
+        self._finish_preview_run()
+
+    def _on_preview_failed(self, generation, error):
+        if generation == self.preview_generation:
+            self._show_preview_message("预览生成失败"); self.log_message(f"预览生成失败: {error}")
+            self.preview_proxy = None; self.preview_proxy_key = None
+            self.preview_log_result = False
+        self._finish_preview_run()
+
+    def process_single_image(self): # Updated to use new params
+        if not self.current_image_path: QMessageBox.warning(self, "提示", "请先选择一张图片。"); return
+
+        default_filename = os.path.splitext(os.path.basename(self.current_image_path))[0] + "" + os.path.splitext(self.current_image_path)[1]
+        output_dir = self.output_folder if self.output_folder and not is_archive_path(self.output_folder) else None
+        default_output_path = os.path.join(output_dir or os.path.dirname(self.current_image_path) or ".", default_filename)
+        save_path, _ = QFileDialog.getSaveFileName(self, "保存水印图片", default_output_path, "图片文件 (*.png *.jpg *.jpeg *.bmp *.tif *.tiff)")
+        if not save_path: self.log_message("单张图片保存操作已取消。"); return
+
+        params = self._get_watermark_params_from_ui()
+        success = apply_modern_watermark(self.current_image_path, save_path, *params, log_callback=self.log_message,
+                                         encoder=self._get_encoder_from_ui())
+        if success: QMessageBox.information(self, "成功", f"水印图片已保存到: {save_path}")
+        else: QMessageBox.warning(self, "失败", "添加水印失败，请查看日志输出。")
+
+    def process_batch_images(self): # Updated for new params and time increment logic
+        if not self.input_folder: QMessageBox.warning(self, "提示", "请选择输入图片文件夹。"); return
+        if not self.output_folder: QMessageBox.warning(self, "提示", "请选择输出文件夹。"); return
+        if self.input_folder == self.output_folder: QMessageBox.warning(self, "警告", "输入和输出文件夹不能相同。"); return
+
+        archive_mode = is_archive_batch(self.input_folder, self.output_folder) # No journal: it lives in an output folder
+        if not archive_mode: os.makedirs(self.output_folder, exist_ok=True)
+        title_text, location_text, base_timestamp_dt, anchor, padding, font_path, base_font_size = self._get_watermark_params_from_ui()
+        increment = self.increment_map_ui_to_code.get(self.combo_time_increment.currentText(), "1min")
+        encoder = self._get_encoder_from_ui()
+
+        timestamp_source = "exif" if self.chk_exif_time.isChecked() else "sequence"
+        journal = BatchJournal(self.output_folder) if self.chk_incremental.isChecked() and not archive_mode else None
+        fingerprint = watermark_fingerprint(title_text, location_text, anchor, padding, font_path, base_font_size, base_timestamp_dt, increment,
+                                            timestamp_source, encoder=encoder)
+        last_run = journal.last_run() if journal else None
+        if last_run and last_run["fingerprint"] != fingerprint:
+            answer = QMessageBox.question(self, "继续上次任务?",
+                                          f"输出文件夹中有上次的批量记录 (起始时间 {last_run['base_timestamp'].replace('T', ' ')})。\n"
+                                          "是否沿用上次的起始时间和递增方式继续? 选择“否”将按当前设置重新处理。")
+            if answer == QMessageBox.Yes:
+                base_timestamp_dt = datetime.datetime.fromisoformat(last_run["base_timestamp"])
+                increment = last_run["increment"]
+                fingerprint = watermark_fingerprint(title_text, location_text, anchor, padding, font_path, base_font_size, base_timestamp_dt, increment,
+                                                    timestamp_source, encoder=encoder)
+
+        order = self.order_map_ui_to_code.get(self.combo_order.currentText(), "name")
+        scan_kwargs = dict(input_folder=self.input_folder, output_folder=self.output_folder, base_timestamp_dt=base_timestamp_dt,
+                           increment=increment, timestamp_source=timestamp_source, recursive=self.chk_recursive.isChecked(), order=order)
+        watermark_kwargs = dict(title_text=title_text, location_text=location_text, anchor=anchor, padding=padding,
+                                font_path=font_path, base_font_size=base_font_size, encoder=encoder)
+        # The index connection opens on first use, on the batch thread; archive batches write no output files to reuse
+        if self.chk_output_cache.isChecked() and not archive_mode: watermark_kwargs["output_cache"] = OutputCache()
+        self.batch_task = BatchTask(scan_kwargs, watermark_kwargs, journal, fingerprint, self.batch_signals)
+        self._set_batch_running(True)
+        self.batch_pool.start(self.batch_task)
+        self.batch_timer.start()
+
+    def cancel_batch(self):
+        if not self.batch_task: return
+        self.batch_task.cancel()
+        self.btn_cancel_batch.setEnabled(False)
+        self.log_message("正在取消批量处理: 等待正在处理的图片完成...")
+
+    def _set_batch_running(self, running):
+        self.btn_process_batch.setEnabled(not running)
+        self.btn_cancel_batch.setEnabled(running)
+        if running: self.progress_batch.setRange(0, 0); self.lbl_batch_status.setText("正在扫描...") # Busy until the total is known
+
+    def _refresh_batch_progress(self):
+        if not self.batch_task: return
+        state = self.batch_task.progress()
+        self.log_messages_batch(state["lines"])
+        total = state["total"]
+        counters = state["counters"]
+        finished = counters["processed"] + counters["failed"] + counters["skipped"]
+        if total is None: # Still scanning: the bar stays busy, the count of images found so far grows
+            self.lbl_batch_status.setText(f"{finished} 张已完成, 已找到 {state['scanned']} 张 (仍在扫描)  "
+                                          f"{state['images_per_second']:.2f} 张/秒")
+            return
+        self.progress_batch.setRange(0, max(total, 1)); self.progress_batch.setValue(finished)
+        rate = state["images_per_second"]
+        remaining = total - finished
+        eta = format_duration(remaining / rate) if rate and remaining else "--:--"
+        self.lbl_batch_status.setText(f"{finished} / {total} 张 (失败 {counters['failed']}, 跳过 {counters['skipped']})  "
+                                      f"{rate:.2f} 张/秒  剩余约 {eta}")
+
+    def _end_batch(self):
+        self.batch_timer.stop()
+        self._refresh_batch_progress() # Last progress and log lines
+        task, self.batch_task = self.batch_task, None
+        self._set_batch_running(False)
+        if self.progress_batch.maximum() == 0: self.progress_batch.setRange(0, 1) # Stop the busy indicator
+        return task
+
+    def _on_batch_finished(self, summary):
+        task = self._end_batch()
+        if not summary["total"] and not summary["cancelled"]: QMessageBox.information(self, "提示", "输入文件夹中没有找到支持的图片文件。"); return
+        counters = task.metrics.snapshot()["counters"]
+        self.log_message("批量处理完成。" + "\n".join(task.metrics.summary_lines()))
+        title = "已取消" if summary["cancelled"] else "完成"
+        QMessageBox.information(self, title, f"批量处理{title}！共处理 {counters['processed']} / {summary['total']} 张图片, "
+                                             f"跳过 {counters['skipped']} 张未变化的图片。")
+
+    def _on_batch_failed(self, error):
+        self._end_batch()
+        self.log_message(f"批量处理出错: {error}")
+        QMessageBox.warning(self, "失败", "批量处理出错，请查看日志输出。")
+
+    def closeEvent(self, event):
+        # Let the images in flight finish so no half-written outputs or journal lines are left behind
+        if self.batch_task: self.batch_task.cancel(); self.batch_pool.waitForDone()
+        super().closeEvent(event)
+
+def run_gui(argv):
+    app = QApplication(argv)
+    ex = WatermarkApp()
+    return app.exec_()
@@ -0,0 +1,209 @@
+"""Local HTTP watermarking service: POST image bytes to /watermark, get the watermarked image back.
+Started with `python main.py serve`."""
+import os
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import http.server
+import json
+import queue
+import threading
+import time
+import urllib.parse
+
+from PIL import Image
+
+from watermark_engine import (BatchMetrics, StageTimer, EncoderSettings, ENCODER_PRESETS, DEFAULT_ENCODER_PRESET,
+                              watermark_image_bytes, load_watermark_fonts, get_cache_stats, find_font_path)
+
+# --- HTTP Service ---
+def _percentile(sorted_values, percent):
+    if not sorted_values: return None
+    return sorted_values[int(round(percent / 100 * (len(sorted_values) - 1)))]
+
+class WatermarkService:
+    """Runs watermark requests on a fixed thread pool and keeps request statistics.
+
+    All workers share this process's font and tile caches, so only the first request with a given style pays for
+    loading fonts and drawing the static watermark parts. At most max_queue requests wait for a worker; beyond
+    that process() raises queue.Full, so callers are turned away instead of piling up decoded images.
+    Requests are not grouped into batches: the shared caches already give same-style requests the batching win,
+    and grouping them would only make them wait for each other.
+    """
+    def __init__(self, font_path, defaults=None, workers=None, max_queue=64, max_body_bytes=200 * 1024 * 1024,
+                 latency_window=10000, log_callback=print):
+        self.font_path = font_path
+        self.defaults = dict(dict(title_text="施工记录", location_text="", anchor="bottom_left", padding=(30, 30), base_font_size=40),
+                             **(defaults or {}))
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_body_bytes = max_body_bytes
+        self.log_callback = log_callback
+        self.metrics = BatchMetrics(max_events=0) # Stage aggregates and byte counters; no per-request events
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self.latencies = collections.deque(maxlen=latency_window) # End-to-end ms of the most recent requests
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="watermark")
+
+    def warm_up(self):
+        load_watermark_fonts(self.font_path, self.defaults["base_font_size"], self.log_callback)
+
+    def _run(self, data, params):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        timer = StageTimer()
+        try:
+            kwargs = dict(self.defaults, **params)
+            timestamp_dt = kwargs.pop("timestamp_dt", None) or datetime.datetime.now().replace(microsecond=0)
+            encoded, image_format = watermark_image_bytes(data, timestamp_dt=timestamp_dt, font_path=self.font_path,
+                                                          log_callback=self.log_callback, timer=timer, **kwargs)
+            self.metrics.record("<request>", True, timer.stages, timer.bytes_read, timer.bytes_written, encodes=timer.encodes)
+            return encoded, image_format, timer
+        except Exception:
+            self.metrics.record("<request>", False, timer.stages, timer.bytes_read)
+            raise
+        finally:
+            with self._lock: self.running -= 1
+
+    def process(self, data, params=None):
+        """Watermark `data` (encoded image bytes) with the defaults overridden by params; blocks until done.
+
+        Returns (encoded bytes, format, StageTimer). params keys: title_text, location_text, timestamp_dt, anchor,
+        padding, base_font_size, output_format, encoder.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise queue.Full("等待处理的请求过多")
+            self.queued += 1
+        try: return self._executor.submit(self._run, data, params or {}).result()
+        finally:
+            with self._lock: self.latencies.append((time.perf_counter() - started) * 1000)
+
+    def stats(self):
+        snap = self.metrics.snapshot()
+        with self._lock:
+            latencies = sorted(self.latencies)
+            queued, running, rejected = self.queued, self.running, self.rejected
+        return {
+            "uptime_s": snap["elapsed_s"], "workers": self.workers, "queue_depth": queued, "running": running,
+            "max_queue": self.max_queue, "rejected": rejected, "counters": snap["counters"],
+            "latency_ms": {"count": len(latencies), "p50": _percentile(latencies, 50), "p90": _percentile(latencies, 90),
+                           "p99": _percentile(latencies, 99), "max": latencies[-1] if latencies else None},
+            "stages": snap["stages"], "encoders": snap["encoders"], "caches": get_cache_stats(),
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+def parse_service_params(query):
+    """Watermark parameters from a parsed query string (urllib.parse.parse_qs); raises ValueError on bad values."""
+    query = {key: values[-1] for key, values in query.items()}
+    params = {}
+    if "title" in query: params["title_text"] = query["title"]
+    if "location" in query: params["location_text"] = query["location"]
+    if "anchor" in query: params["anchor"] = query["anchor"]
+    if query.get("time"): params["timestamp_dt"] = datetime.datetime.fromisoformat(query["time"])
+    if "padding" in query:
+        padding = tuple(int(v) for v in query["padding"].split(","))
+        if len(padding) != 2: raise ValueError("padding 格式应为 X,Y")
+        params["padding"] = padding
+    if "font_size" in query:
+        params["base_font_size"] = int(query["font_size"])
+        if not 1 <= params["base_font_size"] <= 1000: raise ValueError("font_size 超出范围")
+    if query.get("format"): params["output_format"] = query["format"]
+    if query.get("preset"):
+        if query["preset"] not in ENCODER_PRESETS: raise ValueError(f"未知的编码预设: {query['preset']}")
+        params["encoder"] = EncoderSettings(query["preset"])
+    return params
+
+class WatermarkRequestHandler(http.server.BaseHTTPRequestHandler):
+    """POST /watermark?title=...&time=...: body is the image, the response is the watermarked image.
+    GET /stats: latency percentiles, queue depth and cache statistics as JSON. GET /health: liveness."""
+    protocol_version = "HTTP/1.1" # Keep-alive, so repeat callers skip the TCP handshake
+    server_version = "AutoPhotoWatermarker"
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items(): self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8", headers)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/stats": self._send_json(200, self.server.service.stats())
+        elif path == "/health": self._send_json(200, {"status": "ok"})
+        else: self._send_json(404, {"error": f"未知路径: {path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        if url.path != "/watermark" or not length or length > service.max_body_bytes:
+            self.close_connection = True # The unread body would otherwise be parsed as the next request
+            if url.path != "/watermark": self._send_json(404, {"error": f"未知路径: {url.path}"})
+            elif not length: self._send_json(411, {"error": "需要 Content-Length 和图片数据"})
+            else: self._send_json(413, {"error": f"图片超过 {service.max_body_bytes} 字节"})
+            return
+        data = self.rfile.read(length)
+        try:
+            encoded, image_format, timer = service.process(data, parse_service_params(urllib.parse.parse_qs(url.query)))
+        except queue.Full as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+        except (OSError, SyntaxError, ValueError) as e: # Unreadable image or bad parameters
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+        else:
+            self._send(200, encoded, Image.MIME.get(image_format, "application/octet-stream"),
+                       {"X-Watermark-Ms": f"{sum(timer.stages.values()):.1f}"})
+
+    def log_message(self, format, *args):
+        pass # Per-request lines would flood the console; see /stats instead
+
+def create_watermark_server(service, host="127.0.0.1", port=8765):
+    """HTTP server bound to host:port (port 0 picks a free one) that serves `service`; call serve_forever()."""
+    server = http.server.ThreadingHTTPServer((host, port), WatermarkRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+def run_service_cli(argv):
+    parser = argparse.ArgumentParser(description="照片加水印 HTTP 服务 (POST 图片数据到 /watermark, 返回加水印后的图片)")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认只接受本机请求)")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--workers", type=int, default=None, help="处理线程数 (默认: CPU核心数)")
+    parser.add_argument("--max-queue", type=int, default=64, help="最多等待处理的请求数, 超出时返回 503")
+    parser.add_argument("--font", default=None, help="字体文件路径 (默认自动查找)")
+    parser.add_argument("--title", default="施工记录", help="默认标题文字")
+    parser.add_argument("--location", default="", help="默认拍摄地点")
+    parser.add_argument("--anchor", default="bottom_left", help="默认水印锚点")
+    parser.add_argument("--padding", type=int, nargs=2, default=(30, 30), metavar=("X", "Y"), help="默认整体边距")
+    parser.add_argument("--font-size", type=int, default=40, help="默认基础字体大小")
+    parser.add_argument("--preset", default=DEFAULT_ENCODER_PRESET, choices=list(ENCODER_PRESETS), help="默认编码预设")
+    args = parser.parse_args(argv)
+
+    defaults = dict(title_text=args.title, location_text=args.location, anchor=args.anchor, padding=tuple(args.padding),
+                    base_font_size=args.font_size, encoder=EncoderSettings(args.preset))
+    service = WatermarkService(args.font or find_font_path(), defaults, workers=args.workers, max_queue=args.max_queue)
+    service.warm_up()
+    server = create_watermark_server(service, args.host, args.port)
+    print(f"水印服务已启动: http://{server.server_address[0]}:{server.server_address[1]}/watermark "
+          f"(处理线程: {service.workers}), 按 Ctrl+C 退出...")
+    try: server.serve_forever()
+    except KeyboardInterrupt: print("停止服务。")
+    finally:
+        server.server_close()
+        service.close()
+    print(json.dumps(service.stats()["latency_ms"], ensure_ascii=False))
+    return 0